@@ -3,4 +3,11 @@ A new version of PARANSYS library.
 """
 
 from paransys2.ansys import ANSYS
+from paransys2.pool import ANSYSPool
+from paransys2.scheduler import Scheduler
+from paransys2.utils_messages import SolverError
+from paransys2.surrogate import Surrogate
+from paransys2.reliability import MonteCarlo, FORM
+from paransys2.jacobian import Jacobian
+from paransys2.distributed import Coordinator, Worker
 from time import sleep
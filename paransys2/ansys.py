@@ -5,8 +5,17 @@ The main class of the library
 import re 
 import os
 import time
-import atexit
+import asyncio
+import collections
+import concurrent.futures
+import numpy
+import pandas
 import paransys2.utils as utils
+from paransys2.cache import ResultCache
+from paransys2.store import ResultStore
+from paransys2.timing import SolveTimer, TimingStats
+from paransys2.jacobian import Jacobian
+from paransys2.utils_messages import SolverError
 
 class ANSYS:
     """
@@ -14,29 +23,37 @@ class ANSYS:
      
     """
     
-    def __init__(self, exec_loc=None, run_location='.\\workingdir', jobname='file', nproc=2, cleardir=False, add_flags=''):
+    def __init__(self, exec_loc=None, run_location=os.path.join('.', 'workingdir'), jobname='file', nproc=2, cleardir=False, add_flags=''):
         """
         Configure the connection betwen Python and ANSYS setting ANSYS configuration.
 
         Args:
             exec_loc (str, optional): ANSYS executable location (like ANSYS194.exe). Defaults to None, then PARANSYS will try to find it.
-            run_location (str, optional): Folder where ANSYS will work. Defaults to '.\\workingdir\\'.
+            run_location (str, optional): Folder where ANSYS will work. Defaults to 'workingdir' at current folder.
             jobname (str, optional): ANSYS jobname. Defaults to 'file'.
             nproc (int, optional): number of processor cores used. Defaults to 2.
             cleardir (bool, optional): clear all files in the working directory before running. Defaults to False.
             add_flags (str, optional): additional ANSYS execution flags. Do not use `-b -i -o`. Defaults to ''.
         """
 
-        atexit.register(self.exit)
-
         # Define default variables
         self._print = True
         self._log = False
 
         self._settings = {
-            'monitor_wait':     0.5,    # Seconds
+            'monitor_wait':     0.1,    # Seconds
             'starter_max_wait':  30,    # Seconds
-            'starter_sleep':    2.0     # Seconds
+            'kill_timeout':      60,    # Seconds, ANSYS is terminated if it doesn't close after it
+            'solve_timeout':   None,    # Seconds, maximum time of each solution (None waits forever)
+            'solve_retries':      0,    # Times a timed out or crashed solution is tried again with a new ANSYS
+            'use_inotify':     True,    # Wait for control file changes with inotify (Linux only)
+            'poll_min':        0.01,    # Seconds, first control file polling interval
+            'poll_max':         1.0,    # Seconds, maximum control file polling interval
+            'poll_growth':      1.5,    # Polling interval growth factor
+            'stage_mode':    'link',    # Model binaries are 'link'ed or 'copy'ed to run_location
+            'p26_format':    'text',    # POST26 values exported as 'text' (%G) or 'fixed' width (E24.16)
+            'deriv_noise':    1e-10,    # Relative noise of the outputs, it's the round-off error of adaptive derivatives
+            'deriv_levels':       6     # Maximum times the step of adaptive derivatives is halved
 
         }
 
@@ -44,11 +61,46 @@ class ANSYS:
         self._model = {
             'main': '',
             'extrafiles': [],
-            'location': ''
+            'location': '',
+            'solution': None,
+            'invariant': []
         }
 
-        # Define
+        # Model files already staged at run_location
+        self._staged = {}
+
+        # Key of the preprocessing saved by ANSYS (see `setAPDLmodel(solution=...)`)
+        self._prepkey = None
+
+        # Parameters files already read {(file, only): (signature, parameters)}
+        self._parcache = {}
+
+        # Results cache (disabled by default)
+        self._cache = None
+
+        # Information about the last solution
+        self._lastrun = {}
+
+        # ANSYS process started by this session, function that receives it's log lines and the log follower
+        self._process = None
+        self._logstream = None
+        self._logtail = None
 
+        # Phases times of each solution, the last one and functions called at each phase
+        self._timings = TimingStats()
+        self._lasttiming = None
+        self._timing_callbacks = []
+        self._solvertime = None
+
+        # Steps where adaptive derivatives converged {(parameter, central, richardson, tolerance): step relative to the parameter value} and the last errors
+        self._derivsteps = {}
+        self._lastderiv = None
+
+        # Base points where derivatives were exactly null {(output, parameter): {parameters sets}}, see `derivatives(sparse=True)`
+        self._derivzeros = {}
+
+        # Lock of the async methods, with it's event loop
+        self._alock = None
 
         # Try to find ANSYS executable location 
         if exec_loc is None:
@@ -56,7 +108,7 @@ class ANSYS:
 
         # Try to acces run_location folder
         if not os.path.isdir(run_location):
-            if run_location == '.\\workingdir':
+            if run_location == os.path.join('.', 'workingdir'):
                 os.mkdir(run_location)
             else:
                 utils.messages.cerror(self, f'PARANSYS could not access current run_location folder ({run_location}).')
@@ -72,14 +124,20 @@ class ANSYS:
         }
 
 
-    def setAPDLmodel(self, main, extrafiles=[], location='.'):
+    def setAPDLmodel(self, main, extrafiles=[], location='.', solution=None, invariant=[]):
         """
         Sets APDL model script and other necessary files.
 
+        The model could be split in a preprocessing script (`main`) and a `solution` script. Then ANSYS saves the
+        preprocessed database and, when just the `invariant` parameters (like loads and materials) change from
+        the last solution, it's resumed and only the solution script runs again, skipping geometry and meshing.
+
         Args:
-            main (str): main APDL script (who will run)
+            main (str): main APDL script (who will run), or the preprocessing script if `solution` is set.
             extrafiles (list of strings, optional): list with files that will complete the model. Defaults to [].
             location (str, optional): Folder where the main script and another files are. Defaults to '.' (current folder).
+            solution (str, optional): solution APDL script, it runs after `main` or after the saved preprocessing. Defaults to None.
+            invariant (list of strings, optional): parameters that don't change the preprocessing, used just with `solution`. Defaults to [].
         """
 
         # Test location folder
@@ -88,25 +146,148 @@ class ANSYS:
                 utils.messages.cerror(self, f'PARANSYS could not access current model location folder ({location}).')
         
         # Test all files
-        curfile = f'{location}\\{main}'
+        curfile = os.path.join(location, main)
         if not os.path.isfile(curfile):
             utils.messages.cerror(self, f'Main APDL script doesn\'t exist as \"{curfile}\".')
         for each in extrafiles:
-            curfile = f'{location}\\{each}'
+            curfile = os.path.join(location, each)
             if not os.path.isfile(curfile):
                 utils.messages.cerror(self, f'Extra file {each} doesn\'t exist as \"{curfile}\".')
+        if solution is not None:
+            curfile = os.path.join(location, solution)
+            if not os.path.isfile(curfile):
+                utils.messages.cerror(self, f'Solution APDL script doesn\'t exist as \"{curfile}\".')
 
         # Save
         self._model['main'] = main
         self._model['extrafiles'] = extrafiles
         self._model['location'] = location
+        self._model['solution'] = solution
+        self._model['invariant'] = utils.anothers.to_upper(list(invariant))
+        utils.files.classify_model(self)
+        self._staged = {}
+        self._prepkey = None
+        self._derivsteps = {}
+        self._derivzeros = {}
 
         utils.messages.cprint(self, f'APDL model scripts set as:')
         utils.messages.cprint(self, f'   Main script: {main}.')
+        if solution is not None:
+            utils.messages.cprint(self, f'   Solution script: {solution}.')
+            utils.messages.cprint(self, f'   Invariant parameters: {self._model["invariant"]}.')
         utils.messages.cprint(self, f'   Extra files: {extrafiles}.')
         utils.messages.cprint(self, f'   Location: {location}.')
 
 
+    def setCache(self, location=os.path.join('.', 'paransys_cache'), maxsize=1024):
+        """
+        Enable a persistent cache of results, so `solve()` doesn't run ANSYS again for a known parameters set.
+
+        The results are identified by the model files contents, the input parameters and the POST26 variables.
+
+        Args:
+            location (str, optional): Folder where results are saved. Set it as None to disable the cache. Defaults to 'paransys_cache' at current folder.
+            maxsize (float, optional): Maximum cache size in MB, the least recently used results are removed after it. Defaults to 1024.
+        """
+        if location is None:
+            self._cache = None
+            utils.messages.cprint(self, 'Results cache disabled.')
+        else:
+            self._cache = ResultCache(location, maxsize)
+            utils.messages.cprint(self, f'Results cache set at {location} with {maxsize} MB.')
+
+
+    def setLogStream(self, enabled=True, callback=None):
+        """
+        Follow the ANSYS log (`paransys.ansys.log`) while ANSYS runs, sending each new line to a function.
+
+        Args:
+            enabled (bool, optional): follow the log or stop following it. Defaults to True.
+            callback (function, optional): called as `callback(line)` for each line. Defaults to None, then lines are printed.
+        """
+        if not enabled:
+            self._logstream = None
+        elif callback is None:
+            self._logstream = lambda line: utils.messages.cprint(self, f'   ANSYS| {line}')
+        else:
+            self._logstream = callback
+        if self._process is not None and self._process.poll() is None:
+            utils.ansys.tail_log(self)
+
+
+    def process_status(self):
+        """
+        Status of the ANSYS process started by this session.
+
+        Returns:
+            dict: with the process `pid`, if it's `running` and it's `returncode` (None while it runs).
+        """
+        return utils.ansys.status(self)
+
+
+    def cache_stats(self):
+        """
+        Results cache counters.
+
+        Returns:
+            dict: with `hits`, `misses`, number of `entries` and `size` in MB, or None if the cache is disabled.
+        """
+        if self._cache is None:
+            return None
+        return self._cache.stats()
+
+
+    def addTimingCallback(self, callback):
+        """
+        Register a function called when each phase of a solution starts and ends, to plug in a profiler or metrics exporter.
+
+        It's called as `callback(phase, event, timer)`, where `event` is 'start' or 'end' and `timer` is the
+        `SolveTimer` of the current solution. When the solution ends it's called as `callback('total', 'end', timer)`.
+        In an `ANSYSPool` it could be called by many sessions at the same time.
+
+        Args:
+            callback (function): the function.
+        """
+        self._timing_callbacks.append(callback)
+
+
+    def timing_stats(self, reset=False):
+        """
+        Statistics of the time spent at each phase of all solutions, see `SolveTimer` for the phases.
+
+        Args:
+            reset (bool, optional): forget all solutions after it. Defaults to False.
+
+        Returns:
+            pandas.DataFrame: one row by phase, with `count`, `mean`, `p50`, `p95`, `max` and `sum` in seconds.
+        """
+        summary = self._timings.summary()
+        if reset:
+            self._timings.clear()
+        return summary
+
+
+    def last_timing(self):
+        """
+        Times of each phase of the last solution.
+
+        Returns:
+            SolveTimer: the last solution times, or None if nothing was solved yet.
+        """
+        return self._lasttiming
+
+
+    def last_derivatives(self):
+        """
+        Errors and steps of the last adaptive derivatives (`derivatives()` or `jacobian()` with a `tolerance`).
+
+        Returns:
+            pandas.DataFrame: a row by output and input, with the DERIVATIVE, it's estimated ERROR, the last STEP, 
+                the LEVELS of steps solved and if it CONVERGED. None if there wasn't adaptive derivatives yet.
+        """
+        return self._lastderiv
+
+
     def solve(self, P26vars=[], **parin):
         """
         Solve ANSYS model with parameters set as `solve(parA=1, B=2, c=5)` or by a dictionary with names and values set by **parin.
@@ -119,35 +300,646 @@ class ANSYS:
         Returns:
             dict: An dictionary with all parameters values at the end of the analysis.
             pandas.DataFrame: A pandas DataFrame with asked POST26 variables.
+
+        Raises:
+            SolverError: if ANSYS takes longer than `solve_timeout` or crashes (status 'timeout' or 'crashed'), after `solve_retries` new tries.
         """
-        
-        utils.ansys.start(self)
-        utils.messages.cprint(self, 'Setting solver.')
 
-        utils.files.write_parin(self, parin)
-        utils.files.write_ask_post26(self, P26vars)
-        utils.files.copy_model(self, parin)
+        run = self._begin_solve(parin, P26vars)
+        if run['cached'] is not None:
+            return run['cached']
 
-        utils.files.write_control(self, go=True)
-        utils.messages.cprint(self, '   Solving...')
+        for attempt in range(self._settings['solve_retries']+1):
+            try:
+                if not utils.ansys.is_running(self):
+                    with run['timer'].span('start'):
+                        utils.ansys.start(self)
+                self._send_solve(run, parin, P26vars)
+
+                with run['timer'].span('wait'):
+                    control = utils.watch.wait_done(self, timeout=self._settings['solve_timeout'])
+                break
+            except SolverError as error:
+                self._solve_failed(error, attempt)
+
+        return self._end_solve(run, control, parin, P26vars)
+
+
+    def solve_batch(self, parins, P26vars=[], batchsize=None, failsafe=False, lookahead=None):
+        """
+        Solve many parameters sets in batches, each batch is solved inside ANSYS in just one run signal.
+
+        The monitor runs all sets of a batch one after another (each one after a `/CLEAR`) and signals
+        it's done once, so for small models it's much faster than solving them one by one. Sets found in
+        the cache aren't sent to ANSYS. Sets with different parameters names are solved in different batches.
+
+        A batch can take `solve_timeout` seconds by set. If it times out or ANSYS crashes, the sets already solved
+        are kept and the others are sent again to a new ANSYS, the set that failed is tried `solve_retries` times.
+
+        With `lookahead` the batch is pipelined: the run signal is sent as soon as the first sets are written,
+        the next sets are written while ANSYS solves (`lookahead` sets ahead of the one solving) and the results
+        of each set are read by a background thread as soon as it's done, so the Python I/O is hidden behind the
+        solver time. If ANSYS ends the batch before a set is written, a new run signal is sent for the others
+        and the lookahead is doubled.
+
+        Args:
+            parins (iterable of dicts): parameters sets, each one like the `**parin` of `solve()`.
+            P26vars (list of integers, optional): POST26 variables numbers asked for all sets. Defaults to [].
+            batchsize (int, optional): maximum number of sets by batch. Defaults to None (all of them in one batch).
+            failsafe (bool, optional): if True a failed set doesn't stop the others and returns `({'PARANSYS_ERROR': message, 'PARANSYS_STATUS': status}, None)`. Defaults to False.
+            lookahead (int, optional): number of sets written ahead of the one solving, 1 is a double buffer. Defaults to None (not pipelined).
+
+        Returns:
+            list: A list with `(parout, p26df)` for each parameters set, in the same order of `parins`.
+        """
+        if lookahead is not None and lookahead < 1:
+            utils.messages.cerror(self, 'The batch lookahead must be at least 1.')
+
+        parins = [dict(parin) for parin in parins]
+        results = [None]*len(parins)
+
+        # Sets already in the cache
+        runs = {}
+        for i, parin in enumerate(parins):
+            run = self._begin_solve(parin, P26vars)
+            if run['cached'] is not None:
+                results[i] = run['cached']
+            else:
+                runs[i] = run
+
+        # Sets with the same parameters names are solved together, and with the same preprocessing, starting by the one 
+        # already saved, so it's reused
+        names = {i: sorted(utils.anothers.to_upper(list(parins[i]))) for i in runs}
+        def preporder(i):
+            key = utils.files.prep_key(self, parins[i]) or ''
+            return (names[i], key != self._prepkey, key)
+        todo = sorted(runs, key=preporder)
+        batchsize = batchsize or max(len(todo), 1)
+        attempts = {}
+        while todo:
+            indexes = [i for i in todo[:batchsize] if names[i] == names[todo[0]]]
+            solved, error = self._solve_batch([parins[i] for i in indexes], [runs[i] for i in indexes], P26vars, lookahead)
+            for i, result in zip(indexes, solved):
+                results[i] = result
+            todo = todo[len(solved):]
+
+            # The set that failed starts the next batch, until it's out of retries
+            if error is not None:
+                i = todo[0]
+                attempts[i] = attempts.get(i, 0) + 1
+                if attempts[i] > self._settings['solve_retries']:
+                    if not failsafe:
+                        raise error
+                    parout, p26df, _ = self._failure(parins[i], error, runs[i]['tsolve'])
+                    results[i] = (parout, p26df)
+                    todo = todo[1:]
+                else:
+                    utils.messages.cprint(self, f'** Solution {error.status}, trying again with a new ANSYS ({attempts[i]}/{self._settings["solve_retries"]}).')
+
+        return results
+
+
+    def _solve_batch(self, parins, runs, P26vars, lookahead=None):
+        """
+        (For internal use)
+        Solve a batch of parameters sets in one run signal, or pipelined with `lookahead`.
+
+        If ANSYS times out or crashes it's terminated and just the sets solved before are returned.
+
+        Returns:
+            list: `(parout, p26df)` for each set solved.
+            SolverError: the error, or None if all sets were solved.
+        """
+        # The scripts are filtered once, for the parameters of all sets
+        names = frozenset(utils.anothers.to_upper(list(parins[0])))
+        if any(frozenset(utils.anothers.to_upper(list(parin))) != names for parin in parins):
+            utils.messages.cerror(self, 'All sets of a batch must have the same parameters names.')
+
+        tsolve = time.time()
+        timer = SolveTimer(self._timing_callbacks)
+
+        if not utils.ansys.is_running(self):
+            with timer.span('start'):
+                utils.ansys.start(self)
+        utils.messages.cprint(self, f'Setting solver for a batch of {len(parins)} sets.')
+
+
+        # Each set reuses the preprocessing of the previous one if it's the same
+        prepkeys = [utils.files.prep_key(self, parin) for parin in parins]
+        reuse = None
+        if prepkeys[0] is not None:
+            reuse = [key == previous for key, previous in zip(prepkeys, [self._prepkey]+prepkeys[:-1])]
+            self._prepkey = None
+
+        with timer.span('write'):
+            if lookahead is None:
+                utils.files.write_batch(self, parins, reuse=reuse)
+            utils.files.write_ask_post26(self, P26vars, batch=True)
+        with timer.span('stage'):
+            utils.files.copy_model(self, parins[0])
 
         tstart = time.time()
-        time.sleep(1)
-        while utils.files.read_control(self)['PARANSYS_DONE'] == 0:
-            time.sleep(1)
+        timeout = self._settings['solve_timeout']
+        timeout = None if timeout is None else timeout*len(parins)
+        error = None
+        try:
+            if lookahead is None:
+                with timer.span('write'):
+                    utils.files.write_control(self, go=True)
+                utils.messages.cprint(self, '   Solving...')
+                with timer.span('wait'):
+                    control = utils.watch.wait_done(self, timeout=timeout)
+                solved = len(parins)
+            else:
+                reader = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+                pipeline = {'reads': [], 'staged': 0}
+                with timer.span('wait'):
+                    control = self._pipeline_batch(parins, reuse, P26vars, lookahead, timeout, reader, pipeline)
+                solved = len(parins)
+        except SolverError as failure:
+            error = failure
+            control = {'PARANSYS_RUNS': None}
+            utils.ansys.terminate(self)
+            if lookahead is None:
+                solved = utils.files.batch_solved(self, len(parins), len(P26vars) > 0)
+            else:
+                # Sets finished after the last check are read too
+                reads = pipeline['reads']
+                first = len(reads)+1
+                for n in range(first, first+utils.files.batch_solved(self, pipeline['staged'], len(P26vars) > 0, first=first)):
+                    reads.append(reader.submit(self._read_batch_set, n, parins[n-1], P26vars))
+                solved = len(reads)
+        finally:
+            # The next run signal is a single set again
+            utils.files.write_batch(self, [])
+            utils.files.remove_ask_post26(self)
 
-        utils.messages.cprint(self, 'Solved in {:.3f} minutes.'.format((time.time()-tstart)/60))
-        
-        parameters = utils.files.read_parout(self)
+        if error is None:
+            utils.messages.cprint(self, 'Batch solved in {:.3f} minutes.'.format((time.time()-tstart)/60))
+        else:
+            utils.messages.cprint(self, '** Batch {} after {} of {} sets.'.format(error.status, solved, len(parins)))
+            parins, runs, prepkeys = parins[:solved], runs[:solved], prepkeys[:solved]
+
+        with timer.span('read'):
+            if lookahead is None:
+                reads = [self._read_batch_set(n, parin, P26vars) for n, parin in enumerate(parins, start=1)]
+            else:
+                reads = [read.result() for read in pipeline['reads'][:solved]]
+                reader.shutdown()
+        results = [(parameters, p26df) for parameters, p26df, _ in reads]
+        solvertime = sum(settime or 0 for _, _, settime in reads)
+
+        if self._cache is not None:
+            with timer.span('cache'):
+                for parin, run, (parameters, p26df) in zip(parins, runs, results):
+                    self._cache.put(run['cachekey'], parameters, p26df, parin)
+
+        if error is None:
+            self._prepkey = prepkeys[-1]
+        timer.stop(solver=solvertime)
+        self._finish_timing(timer)
+        self._lastrun = {'PARANSYS_RUNS': control['PARANSYS_RUNS'], 'PARANSYS_TIME': time.time()-tsolve, 'PARANSYS_CACHED': False, 'PARANSYS_SOLVER_TIME': solvertime}
+
+        return results, error
+
+
+    def _pipeline_batch(self, parins, reuse, P26vars, lookahead, timeout, reader, pipeline):
+        """
+        (For internal use)
+        Solve a batch writing each set while the previous ones are solved, all of them with the same parameters names
+        (as checked by `_solve_batch()`, the scripts are filtered once). The results of each finished set
+        are read by `reader`, their futures are appended to `pipeline['reads']` in the sets order and the
+        number of sets written is kept at `pipeline['staged']`.
+
+        Returns:
+            dict: the last control values read.
+
+        Raises:
+            SolverError: with status 'timeout' or 'crashed'.
+        """
+        tend = None if timeout is None else time.monotonic()+timeout
+        reads = pipeline['reads']
+        while len(reads) < len(parins):
+            # ANSYS ran out of sets, so they are solved faster than written and more of them are written ahead
+            if len(reads) > 0:
+                lookahead *= 2
+
+            # A run signal from the first set not solved yet
+            first = len(reads)+1
+            staged = min(first+lookahead, len(parins))
+            utils.files.write_batch_sets(self, parins[first-1:staged], None if reuse is None else reuse[first-1:staged], first=first)
+            utils.files.write_batch_size(self, staged, first=first)
+            pipeline['staged'] = staged
+            utils.files.remove_set(self)
+            utils.files.write_control(self, go=True)
+            utils.messages.cprint(self, f'   Solving from set {first}...')
+
+            current = 0
+            control = {}
+            while True:
+                def changed():
+                    control.update(utils.files.read_control(self))
+                    return control['PARANSYS_DONE'] != 0 or utils.files.read_set(self) != current or not utils.ansys.is_running(self)
+                remaining = None if tend is None else max(tend-time.monotonic(), 0)
+                finished = utils.watch.wait_for(self, changed, fname=['control.paransys', 'set.paransys'], timeout=remaining)
+                if not finished or (control['PARANSYS_DONE'] == 0 and not utils.ansys.is_running(self)):
+                    control = utils.watch.check_done(self, control, finished, timeout)
+
+                # Sets before the one solving are done, and the last one when the run signal is done. A set written
+                # just after the monitor read the batch size isn't solved, the next run signal starts from it.
+                current = utils.files.read_set(self)
+                done = min(current if control['PARANSYS_DONE'] != 0 else current-1, staged)
+                for n in range(len(reads)+1, done+1):
+                    reads.append(reader.submit(self._read_batch_set, n, parins[n-1], P26vars))
+                if control['PARANSYS_DONE'] != 0:
+                    break
+
+                # Keep the next sets written ahead
+                if staged < len(parins) and staged < current+lookahead:
+                    ahead = min(current+lookahead, len(parins))
+                    utils.files.write_batch_sets(self, parins[staged:ahead], None if reuse is None else reuse[staged:ahead], first=staged+1)
+                    utils.files.write_batch_size(self, ahead, first=first)
+                    staged = pipeline['staged'] = ahead
+
+        return control
+
+
+    def _read_batch_set(self, n, parin, P26vars):
+        """
+        (For internal use)
+        Read the results of the n-th set of a batch.
+
+        Returns:
+            tuple: `(parout, p26df, solvertime)`.
+        """
+        self._parin = parin
+        parameters = utils.files.read_parout(self, fname=f'par_out_{n}.paransys')
+        solvertime = self._solvertime
         if len(P26vars) > 0:
-            p26df = utils.files.read_post26(self)
+            p26df = utils.files.read_post26(self, fname=f'P26_out_{n}.paransys')
         else:
             p26df = None
+        return parameters, p26df, solvertime
 
-        return parameters, p26df
+
+    async def solve_async(self, P26vars=[], **parin):
+        """
+        Coroutine version of `solve()`, ANSYS is started and waited without blocking the event loop.
+
+        Many calls to the same session are solved one at a time, so use `asyncio.gather()` over many
+        sessions (or an `ANSYSPool`) to overlap their solutions.
+
+        Args:
+            **parin (dict): each model parameter in the form `name=value` or a dictionary with names and values set by **dictname. 
+            P26vars (list of integers): A list of POST26 (time history postproccess) variables numbers. This POST26 variables will be exported in a pandas.DataFrame.
+
+        Returns:
+            dict: An dictionary with all parameters values at the end of the analysis.
+            pandas.DataFrame: A pandas DataFrame with asked POST26 variables.
+        """
+        async with self._async_lock():
+            run = self._begin_solve(parin, P26vars)
+            if run['cached'] is not None:
+                return run['cached']
+
+            for attempt in range(self._settings['solve_retries']+1):
+                try:
+                    if not utils.ansys.is_running(self):
+                        with run['timer'].span('start'):
+                            await utils.ansys.start_async(self)
+                    self._send_solve(run, parin, P26vars)
+
+                    with run['timer'].span('wait'):
+                        control = await utils.watch.wait_done_async(self, timeout=self._settings['solve_timeout'])
+                    break
+                except SolverError as error:
+                    self._solve_failed(error, attempt)
+
+            return self._end_solve(run, control, parin, P26vars)
+
+
+    async def start_async(self):
+        """
+        Start ANSYS, if it isn't running, without blocking the event loop.
+        """
+        async with self._async_lock():
+            await utils.ansys.start_async(self)
+
+
+    def _async_lock(self):
+        """
+        (For internal use)
+        Lock that makes async calls to this session run one at a time. A new one is created for each event loop.
+        """
+        loop = asyncio.get_running_loop()
+        if self._alock is None or self._alock[0] is not loop:
+            self._alock = (loop, asyncio.Lock())
+        return self._alock[1]
+
+
+    def _begin_solve(self, parin, P26vars):
+        """
+        (For internal use)
+        Start timing a solution and look for it in the cache.
+
+        Returns:
+            dict: the solution state, with the result at `cached` if it was found in the cache.
+        """
+        run = {'tsolve': time.time(), 'timer': SolveTimer(self._timing_callbacks), 'cachekey': None, 'cached': None}
+        if self._cache is not None:
+            with run['timer'].span('cache'):
+                run['cachekey'] = self._cache.key(self._model, parin, P26vars)
+                run['cached'] = self._cache.get(run['cachekey'])
+            if run['cached'] is not None:
+                utils.messages.cprint(self, 'Solution found in cache.')
+                run['timer'].stop(cached=True)
+                self._finish_timing(run['timer'])
+                self._lastrun = {'PARANSYS_RUNS': None, 'PARANSYS_TIME': time.time()-run['tsolve'], 'PARANSYS_CACHED': True, 'PARANSYS_SOLVER_TIME': None}
+        return run
+
+
+    def _send_solve(self, run, parin, P26vars):
+        """
+        (For internal use)
+        Write the input files, stage the model and send the run signal.
+        """
+        utils.messages.cprint(self, 'Setting solver.')
+
+        run['prepkey'] = utils.files.prep_key(self, parin)
+        reuse = None
+        if run['prepkey'] is not None:
+            reuse = run['prepkey'] == self._prepkey
+            self._prepkey = None
+
+        with run['timer'].span('write'):
+            utils.files.write_parin(self, parin, reuse=reuse)
+            utils.files.write_ask_post26(self, P26vars)
+        with run['timer'].span('stage'):
+            utils.files.copy_model(self, parin)
+
+        with run['timer'].span('write'):
+            utils.files.write_control(self, go=True)
+        utils.messages.cprint(self, '   Solving...')
+        run['tstart'] = time.time()
+
+
+    def _end_solve(self, run, control, parin, P26vars):
+        """
+        (For internal use)
+        Read the results of a finished solution, saving them in the cache.
+
+        Returns:
+            tuple: `(parout, p26df)` like `solve()`.
+        """
+        utils.messages.cprint(self, 'Solved in {:.3f} minutes.'.format((time.time()-run['tstart'])/60))
         
+        with run['timer'].span('read'):
+            parameters = utils.files.read_parout(self)
+            if len(P26vars) > 0:
+                p26df = utils.files.read_post26(self)
+            else:
+                p26df = None
+
+        if self._cache is not None:
+            with run['timer'].span('cache'):
+                self._cache.put(run['cachekey'], parameters, p26df, parin)
+
+        self._prepkey = run['prepkey']
+        run['timer'].stop(solver=self._solvertime)
+        self._finish_timing(run['timer'])
+        self._lastrun = {'PARANSYS_RUNS': control['PARANSYS_RUNS'], 'PARANSYS_TIME': time.time()-run['tsolve'], 'PARANSYS_CACHED': False, 'PARANSYS_SOLVER_TIME': self._solvertime}
+
+        return parameters, p26df
+
+
+    def _finish_timing(self, timer):
+        """
+        (For internal use)
+        Keep the times of a finished solution.
+        """
+        self._lasttiming = timer
+        self._timings.add(timer)
+
+
+    def _solve_failed(self, error, attempt):
+        """
+        (For internal use)
+        Terminate a hung or crashed ANSYS, so the next try starts a new one. The error is raised if there isn't any try left.
+        """
+        utils.ansys.terminate(self)
+        if attempt >= self._settings['solve_retries']:
+            raise error
+        utils.messages.cprint(self, f'** Solution {error.status}, trying again with a new ANSYS ({attempt+1}/{self._settings["solve_retries"]}).')
+
+
+    def _failure(self, parin, error, tstart):
+        """
+        (For internal use)
+        Result of a failed parameters set.
+
+        Returns:
+            tuple: `(parout, p26df, info)`, where `parout` has the error message at `PARANSYS_ERROR` and `PARANSYS_STATUS`
+                as 'timeout', 'crashed' (see `SolverError`) or 'error' for any other error.
+        """
+        status = error.status if isinstance(error, SolverError) else 'error'
+        utils.messages.cprint(self, f'** Parameters set {parin} failed ({status}): {error}')
+        runinfo = {'PARANSYS_RUNS': None, 'PARANSYS_TIME': time.time()-tstart, 'PARANSYS_CACHED': False, 'PARANSYS_SOLVER_TIME': None}
+        return {'PARANSYS_ERROR': str(error).strip(), 'PARANSYS_STATUS': status}, None, runinfo
+
+
+    def map(self, parins, P26vars=[], callback=None, failsafe=False, info=False):
+        """
+        Solve ANSYS model for a sequence of parameters sets, yielding the results in the same order of `parins`.
+
+        Here each set is solved one after another by `solve()`, but `ANSYSPool` dispatches them to many sessions.
+
+        Args:
+            parins (iterable of dicts): parameters sets, each one like the `**parin` of `solve()`.
+            P26vars (list of integers, optional): POST26 variables numbers asked for all sets. Defaults to [].
+            callback (function, optional): function called as `callback(i, parout, p26df)` when the i-th set is solved. Defaults to None.
+            failsafe (bool, optional): if True a failed set doesn't stop the others and returns `({'PARANSYS_ERROR': message, 'PARANSYS_STATUS': status}, None)`. Defaults to False.
+            info (bool, optional): if True it also yields a dictionary with `PARANSYS_RUNS`, `PARANSYS_TIME`, `PARANSYS_CACHED` and `PARANSYS_SOLVER_TIME`. Defaults to False.
+
+        Yields:
+            tuple: `(parout, p26df)` for each parameters set, as returned by `solve()`, or `(parout, p26df, info)`.
+        """
+        for i, parin in enumerate(parins):
+            parout, p26df, runinfo = self._solve_point(parin, P26vars, failsafe)
+            if callback is not None:
+                callback(i, parout, p26df)
+            yield (parout, p26df, runinfo) if info else (parout, p26df)
+
+
+    def solve_many(self, parins, P26vars=[], callback=None, failsafe=False):
+        """
+        Solve ANSYS model for a list of parameters sets. It is the same as `list(map(...))`.
+
+        Args:
+            parins (iterable of dicts): parameters sets, each one like the `**parin` of `solve()`.
+            P26vars (list of integers, optional): POST26 variables numbers asked for all sets. Defaults to [].
+            callback (function, optional): function called as `callback(i, parout, p26df)` when the i-th set is solved. Defaults to None.
+            failsafe (bool, optional): if True a failed set doesn't stop the others and returns `({'PARANSYS_ERROR': message, 'PARANSYS_STATUS': status}, None)`. Defaults to False.
+
+        Returns:
+            list: A list with `(parout, p26df)` for each parameters set, in the same order of `parins`.
+        """
+        return list(self.map(parins, P26vars=P26vars, callback=callback, failsafe=failsafe))
+
+
+    def _solve_point(self, parin, P26vars, failsafe):
+        """
+        (For internal use)
+        Solve one parameters set, optionally catching it's errors.
+
+        Returns:
+            tuple: `(parout, p26df, info)`.
+        """
+        tstart = time.time()
+        try:
+            parout, p26df = self.solve(P26vars=P26vars, **parin)
+            return parout, p26df, dict(self._lastrun)
+        except Exception as error:
+            if not failsafe:
+                raise
+            return self._failure(parin, error, tstart)
 
-    def derivatives(self, dh=0.05, method='forward', onlyfor=[], notfor=[], **parin):
+
+    async def solve_many_async(self, parins, P26vars=[], callback=None, failsafe=False):
+        """
+        Coroutine version of `solve_many()`. Here each set is solved one after another, `ANSYSPool` overlaps them in all sessions.
+
+        Args:
+            parins (iterable of dicts): parameters sets, each one like the `**parin` of `solve()`.
+            P26vars (list of integers, optional): POST26 variables numbers asked for all sets. Defaults to [].
+            callback (function, optional): function called as `callback(i, parout, p26df)` when the i-th set is solved. Defaults to None.
+            failsafe (bool, optional): if True a failed set doesn't stop the others and returns `({'PARANSYS_ERROR': message, 'PARANSYS_STATUS': status}, None)`. Defaults to False.
+
+        Returns:
+            list: A list with `(parout, p26df)` for each parameters set, in the same order of `parins`.
+        """
+        results = []
+        for i, parin in enumerate(parins):
+            parout, p26df, _ = await self._solve_point_async(parin, P26vars, failsafe)
+            if callback is not None:
+                callback(i, parout, p26df)
+            results.append((parout, p26df))
+        return results
+
+
+    async def _solve_point_async(self, parin, P26vars, failsafe):
+        """
+        (For internal use)
+        Coroutine version of `_solve_point()`.
+
+        Returns:
+            tuple: `(parout, p26df, info)`.
+        """
+        tstart = time.time()
+        try:
+            parout, p26df = await self.solve_async(P26vars=P26vars, **parin)
+            return parout, p26df, dict(self._lastrun)
+        except Exception as error:
+            if not failsafe:
+                raise
+            return self._failure(parin, error, tstart)
+
+
+    def run_doe(self, points, P26vars=[], names=None):
+        """
+        Solve ANSYS model for all points of a design of experiments.
+
+        The points are solved by `map()`, so using an `ANSYSPool` they are solved in parallel. A failed point
+        doesn't stop the others, it's just marked with `PARANSYS_OK=False`, it's error message at `PARANSYS_ERROR` and
+        the failure kind at `PARANSYS_STATUS` ('timeout', 'crashed' or 'error').
+
+        Args:
+            points (pandas.DataFrame, numpy.ndarray or list of dicts): one point by row and one parameter by column.
+            P26vars (list of integers, optional): POST26 variables numbers asked for all points. Defaults to [].
+            names (list of strings, optional): parameters names, needed just if `points` is a numpy.ndarray. Defaults to None.
+
+        Returns:
+            pandas.DataFrame: one row by point, with the input parameters and all output parameters.
+            pandas.DataFrame: POST26 variables in long format (columns `POINT`, `Time`, `VARIABLE` and `VALUE`), or None if `P26vars` is empty.
+        """
+
+        index, parins = [], []
+        for point, parin in utils.anothers.doe_points(self, points, names):
+            index.append(point)
+            parins.append(parin)
+
+        tstart = time.time()
+        utils.messages.cprint(self, f'Running a design of experiments with {len(parins)} points.')
+
+        rows = []
+        p26frames = []
+        for i, (parout, p26df) in enumerate(self.map(parins, P26vars=P26vars, failsafe=True)):
+            row = parins[i].copy()
+            row.update(parout)
+            row['PARANSYS_OK'] = 'PARANSYS_ERROR' not in parout
+            row.setdefault('PARANSYS_ERROR', None)
+            row.setdefault('PARANSYS_STATUS', 'ok')
+            rows.append(row)
+            if p26df is not None and len(p26df) > 0:
+                p26long = p26df.reset_index().melt(id_vars='Time', var_name='VARIABLE', value_name='VALUE')
+                p26long.insert(0, 'POINT', index[i])
+                p26frames.append(p26long)
+
+        results = pandas.DataFrame(rows, index=pandas.Index(index))
+        if len(P26vars) > 0:
+            p26 = pandas.concat(p26frames, ignore_index=True) if p26frames else pandas.DataFrame(columns=['POINT', 'Time', 'VARIABLE', 'VALUE'])
+        else:
+            p26 = None
+
+        failed = len(results) - int(results['PARANSYS_OK'].sum())
+        utils.messages.cprint(self, 'Design of experiments solved in {:.3f} minutes, {} points failed.'.format((time.time()-tstart)/60, failed))
+        return results, p26
+
+
+    def sweep(self, points, store=os.path.join('.', 'paransys_store'), P26vars=[], names=None):
+        """
+        Solve a long sequence of points writing each one to a `ResultStore` as soon as it's solved.
+
+        Points already solved in the store are skipped, so a stopped sweep could be resumed just running it again.
+        Points are taken from `points` as they are needed and results aren't kept in memory, so a generator of dicts
+        could be used for really long sweeps. Failed points are saved with `PARANSYS_OK=False` and solved again when resumed.
+
+        Args:
+            points (pandas.DataFrame, numpy.ndarray or iterable of dicts): one point by row and one parameter by column.
+            store (str or ResultStore, optional): the store or it's folder. Defaults to 'paransys_store' at current folder.
+            P26vars (list of integers, optional): POST26 variables numbers asked for all points. Defaults to [].
+            names (list of strings, optional): parameters names, needed just if `points` is a numpy.ndarray. Defaults to None.
+
+        Returns:
+            ResultStore: the store, use it's `read()` and `read_post26()` to get the results.
+        """
+        if not isinstance(store, ResultStore):
+            store = ResultStore(store)
+
+        tstart = time.time()
+        utils.messages.cprint(self, f'Running a sweep with {len(store)} points already solved.')
+
+        # Points waiting for results, in the same order that map() returns them
+        waiting = collections.deque()
+        def pending():
+            for point, parin in utils.anothers.doe_points(self, points, names):
+                if store.key(parin, P26vars) not in store:
+                    waiting.append((point, parin))
+                    yield parin
+
+        solved = 0
+        failed = 0
+        for parout, p26df, runinfo in self.map(pending(), P26vars=P26vars, failsafe=True, info=True):
+            point, parin = waiting.popleft()
+            store.append(point, parin, parout, runinfo, p26df, P26vars)
+            solved += 1
+            failed += 'PARANSYS_ERROR' in parout
+        store.close()
+
+        utils.messages.cprint(self, 'Sweep solved in {:.3f} minutes, {} points solved and {} failed.'.format((time.time()-tstart)/60, solved, failed))
+        return store
+
+
+    def derivatives(self, dh=0.05, method='forward', onlyfor=[], notfor=[], base_parout=None, tolerance=None, richardson=False, outputs=None, dense=False, sparse=False, **parin):
         """
         Evaluate the derivatives of all output parameters with respect to input parameters using the finite difference method.
 
@@ -166,16 +958,44 @@ class ANSYS:
         The `central` method: `f\'(x) = (f(x+h/2)-f(x-h/2))/h`
 
         The forward and backward methods need to evaluate the function at `f(x)`, so in this cases this result is appendend in the dictionary.
+        If it's already known (like the current point of an iterative algorithm) it could be given as `base_parout`, so it isn't solved again.
+
+        All points are solved at once by `solve_many()`, so using an `ANSYSPool` they are solved in parallel.
+
+        When a `tolerance` is given the step is adaptive: starting at `dh` the step of each parameter is halved until 
+        two successive derivatives agree within the tolerance (relative to the derivative, or to `f(x)/x` when it's
+        almost null). The round-off error, from the `deriv_noise` setting, stops the halving when smaller steps can't 
+        do better. With `richardson=True` the derivatives of all steps are extrapolated (like Ridders' method), it 
+        doesn't need more solutions and usually converges with less steps. The points of each step are solved at 
+        once, just for the parameters not converged yet. The converged steps, relative to the parameters values, are
+        just a starting guess of the next calls with the same method and tolerance (the step is still verified and 
+        halved if needed), they are forgotten when the model changes by `setAPDLmodel()`. The errors are at 
+        `last_derivatives()`.
+
+        Models saving all parameters (`PARSAV,ALL`) have lots of outputs, so the derivatives could be evaluated just for 
+        some `outputs`, and with `dense=True` they are returned as a `Jacobian` (a NumPy matrix, with `to_frame()`) 
+        instead of a dictionary. With `sparse=True` the derivatives that are exactly null (the outputs didn't change at
+        all) at two different points or more are kept as structural zeros, so the next calls skip the parameters that 
+        have no effect on any of the `outputs`. A zero at a single point could be just a flat spot, so it's perturbed 
+        again. Skipped parameters aren't verified anymore, so they are structural zeros until the model changes by 
+        `setAPDLmodel()`, use `sparse=False` when a parameter could affect the outputs at other regions.
 
         Args:
             dh (float, optional): Relative step size in relation to the variable value. Defaults to 0.05.
             method (str, optional): Finite difference method. Defaults to 'forward'.
             onlyfor (list of strings, optional): A list with the exclusive parameters that model will be derivated for.
             notfor (list of strings, optional): A list with the parameters that model will not be derivated for.
+            base_parout (dict, optional): output parameters at `parin`, as returned by `solve()`. Defaults to None.
+            tolerance (float, optional): relative error of adaptive derivatives. Defaults to None, a single step `dh`.
+            richardson (bool, optional): use Richardson extrapolation in adaptive derivatives. Defaults to False.
+            outputs (list of strings, optional): output parameters derivated. Defaults to None, all numeric outputs.
+            dense (bool, optional): return a `Jacobian` instead of a dictionary. Defaults to False.
+            sparse (bool, optional): keep and skip structural zeros. Defaults to False.
             **parin (dict): each model parameter in the form `name=value` or a dictionary with names and values set by **parin.
 
         Returns:
-            dict: A dictionary with the derivatives of all output parameters in relation to here inputed parameters.
+            dict: A dictionary with the derivatives of all output parameters in relation to here inputed parameters,
+                or a `Jacobian` with `dense=True`.
 
         The derivative returned is in the form `deriv['parameter','variable']`, that is, the variation of `parameter` in relation to `variable`. 
         
@@ -186,13 +1006,91 @@ class ANSYS:
 
         """
 
+        plan = self._deriv_stencil(dh, method, onlyfor, notfor, parin, base_parout, tolerance, outputs, sparse)
+        if tolerance is not None:
+            return self._deriv_adapted(plan, *self._deriv_solve(self._deriv_adaptive(plan, tolerance, richardson, outputs)), dense)
+        results = self.solve_many([point for _, point in plan['stencil']], callback=self._deriv_progress(plan))
+        return self._deriv_combine(plan, results, outputs, dense)
+
+
+    def jacobian(self, parin, inputs=None, outputs=None, dh=0.05, method='forward', base=None, tolerance=None, richardson=False, sparse=False):
+        """
+        Evaluate the Jacobian matrix of output parameters with respect to input parameters by finite differences,
+        like `derivatives()`, but as a `Jacobian`: a NumPy matrix with labeled axes, for iterative algorithms.
+
+        The base point and all perturbations are solved at once by `solve_many()` (in parallel with an `ANSYSPool`),
+        or just the perturbations if the outputs at the base point are given as `base`.
+
+        Args:
+            parin (dict): input parameters at the base point.
+            inputs (list of strings, optional): parameters it's derivated for. Defaults to None, all parameters of `parin`.
+            outputs (list of strings, optional): output parameters. Defaults to None, all numeric outputs.
+            dh (float, optional): relative step size. Defaults to 0.05.
+            method (str, optional): 'forward', 'backward' or 'central' finite difference method. Defaults to 'forward'.
+            base (dict, optional): output parameters at `parin`, as returned by `solve()`. Defaults to None.
+            tolerance (float, optional): relative error of adaptive derivatives, see `derivatives()`. Defaults to None.
+            richardson (bool, optional): use Richardson extrapolation in adaptive derivatives. Defaults to False.
+            sparse (bool, optional): keep and skip structural zeros, see `derivatives()`. Defaults to False.
+
+        Returns:
+            Jacobian: derivatives, with the base point at `point` and it's outputs at `values`.
+        """
+        plan = self._deriv_stencil(dh, method, inputs or [], [], parin, base, tolerance, outputs, sparse)
+        if tolerance is not None:
+            return self._deriv_adapted(plan, *self._deriv_solve(self._deriv_adaptive(plan, tolerance, richardson, outputs, needbase=True)), True)
+        points = [point for _, point in plan['stencil']]
+        if plan['base'] is None and plan['central']:
+            # The central stencil hasn't the base point
+            points = [plan['parin']] + points
+        results = self.solve_many(points, callback=self._deriv_progress(plan, len(points)))
+        if plan['base'] is None:
+            plan['base'] = results[0][0]
+            results = results[1:]
+        return self._deriv_combine(plan, results, outputs, True)
+
+
+    async def derivatives_async(self, dh=0.05, method='forward', onlyfor=[], notfor=[], base_parout=None, tolerance=None, richardson=False, outputs=None, dense=False, sparse=False, **parin):
+        """
+        Coroutine version of `derivatives()`, all points are solved by `solve_many_async()`.
+
+        Returns:
+            dict: A dictionary with the derivatives of all output parameters in relation to here inputed parameters,
+                or a `Jacobian` with `dense=True`.
+        """
+        plan = self._deriv_stencil(dh, method, onlyfor, notfor, parin, base_parout, tolerance, outputs, sparse)
+        if tolerance is not None:
+            adaptive = self._deriv_adaptive(plan, tolerance, richardson, outputs)
+            points = next(adaptive)
+            try:
+                while True:
+                    points = adaptive.send(await self.solve_many_async(points))
+            except StopIteration as stop:
+                return self._deriv_adapted(plan, *stop.value, dense)
+        results = await self.solve_many_async([point for _, point in plan['stencil']], callback=self._deriv_progress(plan))
+        return self._deriv_combine(plan, results, outputs, dense)
+
+
+    def _deriv_stencil(self, dh, method, onlyfor, notfor, parin, base=None, tolerance=None, outputs=None, sparse=False):
+        """
+        (For internal use)
+        Build the finite difference stencil of `derivatives()`. If the outputs at `parin` are given as `base` it isn't solved.
+        With a `tolerance` the stencil is just the first step of adaptive derivatives, it's points are made by `_deriv_adaptive()`.
+        With `sparse` the parameters whose derivatives of all `outputs` are structural zeros aren't perturbed.
+
+        Returns:
+            dict: the plan, with the points at `stencil` as `(parameter, parameters set)`.
+        """
+
         # Everything need to be in UPPER CASE or it will be a mess
         parin = utils.anothers.to_upper(parin)
         onlyfor = utils.anothers.to_upper(onlyfor)
         notfor = utils.anothers.to_upper(notfor)
 
         tstart = time.time()
-        utils.messages.cprint(self, f'Evaluating derivatives using {method} method and dh={dh}.')
+        if tolerance is None:
+            utils.messages.cprint(self, f'Evaluating derivatives using {method} method and dh={dh}.')
+        else:
+            utils.messages.cprint(self, f'Evaluating adaptive derivatives using {method} method, from dh={dh} to a tolerance of {tolerance}.')
         
         if len(onlyfor) > 0:
             evalfor = onlyfor.copy()
@@ -205,6 +1103,16 @@ class ANSYS:
                 if parameter in evalfor:
                     evalfor.remove(parameter)
         utils.messages.cprint(self, 'Evaluating derivatives with respect to: {}.'.format(', '.join(evalfor)))
+
+        # Parameters without effect on the outputs aren't perturbed again
+        inputs = evalfor.copy()
+        if outputs is not None:
+            outputs = utils.anothers.to_upper(list(outputs))
+        if sparse and outputs is not None:
+            skipped = [parameter for parameter in evalfor if all(len(self._derivzeros.get((output, parameter), ())) >= 2 for output in outputs)]
+            if skipped:
+                evalfor = [parameter for parameter in evalfor if parameter not in skipped]
+                utils.messages.cprint(self, 'Skipping structural zeros of: {}.'.format(', '.join(skipped)))
         
         # h couldn't be 0
         def hnotnull(par):
@@ -216,53 +1124,282 @@ class ANSYS:
         backwardaliases = ['backward', 'backw', 'b']
         centralaliases = ['central', 'center', 'cent', 'c']
         
+        # Build the whole stencil first, each point as (parameter, parameters set)
         # Forward and Backward are the same, just change dh to negative
         if method in forwardaliases+backwardaliases:
             if method in backwardaliases: dh = -dh
             # base = f(x)
-            utils.messages.cprint(self, 'Solving base function.')
-            base, _ = self.solve(**parin)
-            deriv = base.copy() # Append f(x)
+            stencil = [(None, parin.copy())] if base is None else []
             for parameter in evalfor:
                 parcur = parin.copy()
-                h = hnotnull(parin[parameter])
-                parcur[parameter] += h
-                utils.messages.cprint(self, f'Solving for {parameter}.')
-                this, _ = self.solve(**parcur)
-                for each in this:
-                    deriv[each, parameter] = (this[each]-base[each])/h
-                utils.anothers.deriv_progress(self, parameter, evalfor)
-
+                parcur[parameter] += hnotnull(parin[parameter])
+                stencil.append((parameter, parcur))
 
-        # Central method
+        # Central method: minor and major limits for each parameter
         elif method in centralaliases:
-            deriv = {}
+            stencil = []
             for parameter in evalfor:
                 parinf = parin.copy()
                 parsup = parin.copy()
                 h = hnotnull(parin[parameter])
                 parinf[parameter] -= h/2
                 parsup[parameter] += h/2
-                utils.messages.cprint(self, f'Solving minor limit for {parameter}.')
-                minor, _ = self.solve(**parinf)
-                utils.messages.cprint(self, f'Solving major limit for {parameter}.')
-                major, _ = self.solve(**parsup)
-                for each in minor:
-                    deriv[each, parameter] = (major[each]-minor[each])/h
-                utils.anothers.deriv_progress(self, parameter, evalfor)
+                stencil.append((parameter, parinf))
+                stencil.append((parameter, parsup))
 
         # Sometimes life isn't like we expect   
         else:
             utils.messages.cerror(self, "Unkown method.")
 
+        # All points are solved at once, with ANSYSPool they could finish out of order
+        if tolerance is None:
+            utils.messages.cprint(self, f'Solving {len(stencil)} points.')
+        return {
+            'parin': parin,
+            'inputs': inputs,
+            'evalfor': evalfor,
+            'outputs': outputs,
+            'sparse': sparse,
+            'stencil': stencil,
+            'central': method in centralaliases,
+            'base': None if base is None else utils.anothers.to_upper(dict(base)),
+            'h': {parameter: hnotnull(parin[parameter]) for parameter in evalfor},
+            'tstart': tstart
+        }
+
+
+    def _deriv_progress(self, plan, total=None):
+        """
+        (For internal use)
+        Callback that shows the `derivatives()` progress, of `total` points (by default the stencil size).
+        """
+        solved = []
+        total = len(plan['stencil']) if total is None else total
+        def progress(i, parout, p26df):
+            solved.append(i)
+            utils.anothers.deriv_progress(self, len(solved), total)
+        return progress
+
+
+    def _deriv_combine(self, plan, results, outputs=None, dense=False):
+        """
+        (For internal use)
+        Evaluate the derivatives from the solved stencil, with the outputs at the base point in `plan['base']` if it's known.
+
+        Returns:
+            dict: the derivatives, as returned by `derivatives()`, or a `Jacobian` with `dense=True`.
+        """
+        results = [parout for parout, _ in results]
+        base = plan['base']
+        if not plan['central'] and base is None:
+            base, results = results[0], results[1:]
+
+        if outputs is None:
+            sample = results[0] if base is None else base
+            outputs = [name for name, value in sample.items() if isinstance(value, (int, float)) and not isinstance(value, bool)]
+        outputs = utils.anothers.to_upper(list(outputs))
+        values = lambda parout: numpy.array([parout[output] for output in outputs], dtype=float)
+
+        # A column by parameter, the skipped ones are null
+        matrix = numpy.zeros((len(outputs), len(plan['inputs'])))
+        for k, parameter in enumerate(plan['evalfor']):
+            if plan['central']:
+                minor, major = results[2*k], results[2*k+1]
+            else:
+                minor, major = base, results[k]
+            matrix[:, plan['inputs'].index(parameter)] = (values(major)-values(minor))/plan['h'][parameter]
 
         # Thats the end    
-        utils.messages.cprint(self, 'Derivatives evaluated in {:.3f} minutes.'.format((time.time()-tstart)/60))
+        utils.messages.cprint(self, 'Derivatives evaluated in {:.3f} minutes.'.format((time.time()-plan['tstart'])/60))
+        return self._deriv_result(plan, base, matrix, outputs, dense)
+
+
+    def _deriv_result(self, plan, base, matrix, outputs, dense):
+        """
+        (For internal use)
+        Keep the points of null derivatives in `matrix` (with `plan['sparse']`) and return it as a `Jacobian`, 
+        with `dense`, or as the dictionary of `derivatives()`, with `f(x)` for forward and backward methods.
+        """
+        if plan['sparse']:
+            # Zeros at two different points are structural, any non zero value isn't
+            point = utils.anothers.normalize_parin(plan['parin'])
+            for k, parameter in enumerate(plan['inputs']):
+                if parameter not in plan['evalfor']: continue
+                for output, value in zip(outputs, matrix[:, k]):
+                    if value == 0.0:
+                        self._derivzeros.setdefault((output, parameter), set()).add(point)
+                    else:
+                        self._derivzeros.pop((output, parameter), None)
+
+        if dense:
+            point = {parameter: plan['parin'][parameter] for parameter in plan['inputs']}
+            return Jacobian(matrix, outputs, plan['inputs'], point, None if base is None else {output: base[output] for output in outputs})
+
+        deriv = {}
+        if base is not None and not plan['central']:
+            # Append f(x), all of it if outputs weren't chosen
+            deriv = base.copy() if plan['outputs'] is None else {output: base[output] for output in outputs}
+        for i, output in enumerate(outputs):
+            for k, parameter in enumerate(plan['inputs']):
+                deriv[output, parameter] = float(matrix[i, k])
         return deriv
 
 
+    def _deriv_adaptive(self, plan, tolerance, richardson, outputs=None, needbase=False):
+        """
+        (For internal use)
+        Adaptive finite differences of `derivatives()`. It's a generator: it yields the lists of points to be solved and
+        receives their results, as returned by `solve_many()`, so it's the same with and without async.
+
+        At each level the step of the parameters not converged yet is halved, and the derivatives of all levels make
+        a Richardson tableau (just it's first column without `richardson`). The error of each derivative is the difference
+        to the previous level, plus the round-off error `2*noise*|f(x)|/h`.
+
+        Returns:
+            tuple: the outputs at the base point (None if it wasn't solved), the derivatives `{(output, parameter): value}`
+                and the outputs list.
+        """
+        parin, evalfor, central = plan['parin'], plan['evalfor'], plan['central']
+        noise = self._settings['deriv_noise']
+        order = 2 if central else 1
+        solves = 0
+
+        # f(x) is needed by forward and backward methods
+        base = plan['base']
+        if base is None and (needbase or not central):
+            base = (yield [parin])[0][0]
+            solves += 1
+
+        # The first step is where the last call converged, scaled to the current value, if it's smaller than dh
+        steps = {}
+        for parameter in evalfor:
+            h = plan['h'][parameter]
+            last = self._derivsteps.get((parameter, central, richardson, tolerance))
+            if last is not None and last*(abs(parin[parameter]) or 1) < abs(h):
+                h = numpy.copysign(last*(abs(parin[parameter]) or 1), h)
+            steps[parameter] = h
+
+        tables = {parameter: [] for parameter in evalfor}
+        best, errors, converged, levels = {}, {}, {}, {}
+        active = list(evalfor)
+        for level in range(self._settings['deriv_levels']):
+            if not active: break
+
+            points = []
+            for parameter in active:
+                h = steps[parameter]/2**level
+                if central:
+                    for delta in [-h/2, h/2]:
+                        parcur = parin.copy()
+                        parcur[parameter] += delta
+                        points.append(parcur)
+                else:
+                    parcur = parin.copy()
+                    parcur[parameter] += h
+                    points.append(parcur)
+            utils.messages.cprint(self, f'Level {level+1} of adaptive derivatives: solving {len(points)} points.')
+            results = [parout for parout, _ in (yield points)]
+            solves += len(points)
+
+            if outputs is None:
+                sample = results[0] if base is None else base
+                outputs = [name for name, value in sample.items() if isinstance(value, (int, float)) and not isinstance(value, bool)]
+            outputs = utils.anothers.to_upper(list(outputs))
+            values = lambda parout: numpy.array([parout[output] for output in outputs], dtype=float)
+
+            for k, parameter in enumerate(list(active)):
+                h = steps[parameter]/2**level
+                if central:
+                    minor, major = values(results[2*k]), values(results[2*k+1])
+                    fx = numpy.abs(minor+major)/2 if base is None else numpy.abs(values(base))
+                else:
+                    minor, major = values(base), values(results[k])
+                    fx = numpy.abs(minor)
+
+                # Richardson tableau, each level reuses all previous ones
+                row = [(major-minor)/h]
+                previous = tables[parameter][-1] if tables[parameter] else []
+                if richardson:
+                    for j in range(1, len(previous)+1):
+                        row.append(row[j-1] + (row[j-1]-previous[j-1])/(2**(order*j)-1))
+                tables[parameter].append(row)
+                levels[parameter] = level+1
+                if not previous:
+                    best[parameter], errors[parameter] = row[0], numpy.full(len(outputs), numpy.inf)
+                    continue
+
+                rounding = 2*noise*fx/abs(h)
+                levelerror = numpy.full(len(outputs), numpy.inf)
+                for j, value in enumerate(row):
+                    error = numpy.abs(value-previous[j-1 if j else 0])
+                    if j: error = numpy.maximum(error, numpy.abs(value-row[j-1]))
+                    error = error + rounding
+                    better = error < errors[parameter]
+                    best[parameter] = numpy.where(better, value, best[parameter])
+                    errors[parameter] = numpy.where(better, error, errors[parameter])
+                    levelerror = numpy.minimum(levelerror, error)
+
+                # Converged, or the round-off error took over: the error grew or the next step can't reach the tolerance
+                target = tolerance*numpy.maximum(numpy.abs(best[parameter]), fx/(abs(parin[parameter]) or 1))
+                converged[parameter] = errors[parameter] <= target
+                stuck = (levelerror > 2*errors[parameter]) | (2*rounding > target)
+                if numpy.all(converged[parameter] | stuck):
+                    active.remove(parameter)
+                    # Without extrapolation it converges again from the previous step, but the tableau needs all levels
+                    if numpy.all(converged[parameter]):
+                        self._derivsteps[parameter, central, richardson, tolerance] = abs(steps[parameter] if richardson else 2*h)/(abs(parin[parameter]) or 1)
+
+        deriv = {}
+        rows = []
+        for parameter in evalfor:
+            convergence = converged.get(parameter, numpy.zeros(len(outputs), dtype=bool))
+            for i, output in enumerate(outputs):
+                deriv[output, parameter] = float(best[parameter][i])
+                rows.append({'OUTPUT': output, 'INPUT': parameter, 'DERIVATIVE': float(best[parameter][i]),
+                             'ERROR': float(errors[parameter][i]), 'STEP': abs(steps[parameter])/2**(levels[parameter]-1),
+                             'LEVELS': levels[parameter], 'CONVERGED': bool(convergence[i])})
+            if not numpy.all(convergence):
+                utils.messages.cprint(self, f'** Derivatives with respect to {parameter} didn\'t reach the tolerance, see last_derivatives().')
+        self._lastderiv = pandas.DataFrame(rows, columns=['OUTPUT', 'INPUT', 'DERIVATIVE', 'ERROR', 'STEP', 'LEVELS', 'CONVERGED'])
+
+        utils.messages.cprint(self, 'Adaptive derivatives evaluated with {} solutions in {:.3f} minutes.'.format(solves, (time.time()-plan['tstart'])/60))
+        return base, deriv, outputs
+
+
+    def _deriv_solve(self, adaptive):
+        """
+        (For internal use)
+        Solve the points of an adaptive derivatives generator, from `_deriv_adaptive()`, with `solve_many()`.
+
+        Returns:
+            tuple: the generator result.
+        """
+        points = next(adaptive)
+        try:
+            while True:
+                points = adaptive.send(self.solve_many(points))
+        except StopIteration as stop:
+            return stop.value
+
+
+    def _deriv_adapted(self, plan, base, deriv, outputs, dense=False):
+        """
+        (For internal use)
+        Derivatives, as returned by `derivatives()`, from the adaptive derivatives.
+        """
+        matrix = numpy.array([[deriv.get((output, parameter), 0.0) for parameter in plan['inputs']] for output in outputs], dtype=float)
+        return self._deriv_result(plan, base, matrix.reshape(len(outputs), len(plan['inputs'])), outputs, dense)
+
+
     def exit(self):
         """
         Close ANSYS
         """
         utils.ansys.kill(self)
+
+
+    async def exit_async(self):
+        """
+        Close ANSYS without blocking the event loop
+        """
+        await utils.ansys.kill_async(self)
@@ -0,0 +1,4 @@
+from paransys2.benchmarks.filtering import filtering
+from paransys2.benchmarks.solving import overhead, throughput, batching
+from paransys2.benchmarks.staging import staging
+from paransys2.benchmarks.parsing import parsing
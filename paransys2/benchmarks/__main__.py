@@ -0,0 +1,12 @@
+"""
+Run all benchmarks, as `python -m paransys2.benchmarks`
+"""
+
+from paransys2.benchmarks import filtering, staging, parsing, overhead, throughput, batching
+
+filtering()
+staging()
+parsing()
+overhead()
+throughput()
+batching()
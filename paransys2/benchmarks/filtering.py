@@ -0,0 +1,77 @@
+def filtering(lines=50000, parameters=300, repeat=3):
+    import os
+    import re
+    import time
+    import random
+    import shutil
+    import tempfile
+    import paransys2
+
+    # Print some explanations
+    print(f'\n\nFiltering a synthetic APDL script with {lines} lines and {parameters} parameters.\n\n')
+
+    # The filter used before the compiled and cached one, just to compare
+    def reference_filter(fname, destination, parameters):
+        pattLineKeys = {
+            'parameters':   '|'.join(parameters),
+            'assigns':      '|'.join(paransys2.utils.files.keys_line_assigns),
+            'forbidden':    '|'.join(paransys2.utils.files.keys_line_forbidden)
+        }
+        pattLine = re.compile(r"^[^!]*((?<![\w])({parameters})(?![\w])\s*\=|(?<=({assigns}))\s*,\s*({parameters})\s*,|({forbidden}))".format(**pattLineKeys), flags=re.IGNORECASE)
+        with open(fname, 'r') as f:
+            script = f.readlines()
+        _, scriptname = os.path.split(fname)
+        with open(os.path.join(destination, scriptname), 'w') as f:
+            for line in script:
+                if pattLine.search(line):
+                    f.write('! Line Removed by PARANSYS, old content: ')
+                f.write(line)
+
+    # Create a synthetic script, mostly with commands and some assignments
+    random.seed(0)
+    names = [f'PAR{i}' for i in range(parameters)]
+    content = []
+    for i in range(lines):
+        kind = random.random()
+        name = random.choice(names) + random.choice(['', '', 'X'])
+        if kind < 0.70:
+            content.append(f'K,{i},{random.random():.6f},{random.random():.6f},0\n')
+        elif kind < 0.80:
+            content.append(f'{name} = {random.random():.6f} ! assignment\n')
+        elif kind < 0.85:
+            content.append(f'*SET,{name},{random.random():.6f}\n')
+        elif kind < 0.90:
+            content.append(f'*GET,{name},NODE,{i},U,X\n')
+        elif kind < 0.95:
+            content.append(f'! Just a comment about {name} = 1\n')
+        else:
+            content.append(f'/TITLE,Step {i}\n')
+
+    folder = tempfile.mkdtemp()
+    fname = os.path.join(folder, 'synthetic.inp')
+    with open(fname, 'w') as f:
+        f.writelines(content)
+    parin = {name: 1.0 for name in names}
+    output = tempfile.mkdtemp()
+    outname = os.path.join(output, 'synthetic.inp')
+
+    # Time both filters
+    results = {}
+    for name, function in [('reference', reference_filter), ('paransys2', paransys2.utils.files.copy_and_filter_scripts)]:
+        best = float('inf')
+        for _ in range(repeat):
+            tstart = time.perf_counter()
+            function(fname, output, parin)
+            best = min(best, time.perf_counter()-tstart)
+        with open(outname, 'r') as f:
+            results[name] = f.read()
+        print('{:>12}: {:.4f} s ({:.0f} lines/s)'.format(name, best, lines/best))
+
+    if results['reference'] != results['paransys2']:
+        print('** The filtered scripts are different!')
+    else:
+        print('The filtered scripts are the same.')
+
+    # Clean everything
+    shutil.rmtree(folder)
+    shutil.rmtree(output)
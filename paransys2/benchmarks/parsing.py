@@ -0,0 +1,59 @@
+def parsing(parameters=5000, steps=100000, variables=4, repeat=3):
+    import os
+    import time
+    import shutil
+    import tempfile
+    import paransys2
+    from paransys2 import mockansys
+
+    # Print some explanations
+    print(f'\n\nReading {parameters} output parameters and {variables} POST26 variables with {steps} steps.\n\n')
+
+    folder = tempfile.mkdtemp()
+    ansys = paransys2.ANSYS(exec_loc=mockansys.__file__, run_location=folder)
+    ansys._print = False
+    ansys._parin = {}
+
+    # Output parameters, as written by PARSAV
+    fname = os.path.join(folder, 'par_out.paransys')
+    with open(fname, 'w') as f:
+        f.write('/NOPR\n')
+        for i in range(parameters):
+            f.write('*SET,{:<8s},{!r}\n'.format(f'PAR{i}', i/7))
+        f.write('/GO\n')
+    # An old file, so it's result could be kept
+    os.utime(fname, (time.time()-60, time.time()-60))
+
+    def best(function):
+        result = float('inf')
+        for _ in range(repeat):
+            tstart = time.perf_counter()
+            function()
+            result = min(result, time.perf_counter()-tstart)
+        return result
+
+    def cold():
+        ansys._parcache = {}
+        paransys2.utils.files.read_parout(ansys)
+
+    print('{:>24}: {:.6f} s'.format('read_parout', best(cold)))
+    print('{:>24}: {:.6f} s'.format('read_parout (unchanged)', best(lambda: paransys2.utils.files.read_parout(ansys))))
+    print('{:>24}: {:.6f} s'.format('read_parout (only 3)', best(lambda: (ansys._parcache.clear(), paransys2.utils.files.read_parout(ansys, only=['PAR0', 'PAR1', 'PAR2'])))))
+
+    # POST26 variables, in both formats
+    times = [(i+1)/steps for i in range(steps)]
+    for p26format in ['text', 'fixed']:
+        with open(os.path.join(folder, 'P26_out.paransys'), 'w') as f:
+            f.write('!---PARANSYS---!\n')
+            for var in range(1, variables+1):
+                f.write(f'*P26VAR={var}\n')
+                for t in times:
+                    value = t if var == 1 else var*t
+                    f.write((mockansys.fixed_width(value) if p26format == 'fixed' else '%G' % value) + '\n')
+                f.write('*P26END\n')
+        ansys._settings['p26_format'] = p26format
+        elapsed = best(lambda: paransys2.utils.files.read_post26(ansys))
+        print('{:>24}: {:.6f} s ({:.0f} values/s)'.format(f'read_post26 ({p26format})', elapsed, steps*variables/elapsed))
+
+    # Clean everything
+    shutil.rmtree(folder)
@@ -0,0 +1,144 @@
+def mock_model(folder):
+    """
+    Write a small APDL model, understood by the mock solver, at `folder` and return it's name.
+    """
+    import os
+
+    content = (
+        '! Cantilever formulas, so outputs depend on inputs\n'
+        'B = 4\n'
+        'H = 1\n'
+        'L = 60\n'
+        'Q = 1.15\n'
+        'E = 2000000\n'
+        '/PREP7\n'
+        'ET,1,BEAM189\n'
+        'STRESS = 6*Q*L**2/(B*H**2)\n'
+        'DEFL = Q*L**4/(8*E*B*H**3/12)\n'
+    )
+    with open(os.path.join(folder, 'mock.inp'), 'w') as f:
+        f.write(content)
+    return 'mock.inp'
+
+
+def overhead(solves=20, mock_time=0.0, monitor_wait=0.01):
+    import os
+    import time
+    import shutil
+    import tempfile
+    import numpy
+    import paransys2
+    from paransys2 import mockansys
+
+    # Print some explanations
+    print(f'\n\nSolving a mock model {solves} times, each solution takes {mock_time} s at the mock solver.\n\n')
+
+    folder = tempfile.mkdtemp()
+    run_location = os.path.join(folder, 'workingdir')
+    os.mkdir(run_location)
+
+    ansys = paransys2.ANSYS(exec_loc=mockansys.__file__, run_location=run_location, add_flags=f'-mock_time {mock_time}')
+    ansys._print = False
+    ansys._settings['monitor_wait'] = monitor_wait
+    ansys.setAPDLmodel(mock_model(folder), location=folder)
+
+    # Start time
+    tstart = time.perf_counter()
+    paransys2.utils.ansys.start(ansys)
+    print('{:>24}: {:.4f} s'.format('start', time.perf_counter()-tstart))
+
+    # Each solution, the same parameters and changing them
+    for name, parin in [('solve (same set)', lambda i: {'B': 5}), ('solve (new set)', lambda i: {'B': 5+i})]:
+        times = []
+        for i in range(solves):
+            tstart = time.perf_counter()
+            ansys.solve(**parin(i))
+            times.append(time.perf_counter()-tstart)
+        times = numpy.array(times) - mock_time
+        print('{:>24}: mean {:.4f} s, p50 {:.4f} s, p95 {:.4f} s of overhead'.format(name, times.mean(), *numpy.percentile(times, [50, 95])))
+
+    # Where the time goes
+    print('\nTime by phase:')
+    print(ansys.timing_stats(reset=True))
+    print('')
+
+    # Derivatives
+    tstart = time.perf_counter()
+    ansys.derivatives(method='central', B=5, H=2)
+    print('{:>24}: {:.4f} s'.format('derivatives (central)', time.perf_counter()-tstart))
+
+    # Clean everything
+    ansys.exit()
+    shutil.rmtree(folder)
+
+
+def throughput(points=24, workers=[1, 2, 4], mock_time=0.2, monitor_wait=0.01):
+    import os
+    import time
+    import shutil
+    import tempfile
+    import paransys2
+    from paransys2 import mockansys
+
+    # Print some explanations
+    print(f'\n\nSolving {points} points of a mock model, each solution takes {mock_time} s at the mock solver.\n\n')
+
+    parins = [{'B': 1+i/points, 'H': 2-i/points} for i in range(points)]
+    for nworkers in workers:
+        folder = tempfile.mkdtemp()
+        run_location = os.path.join(folder, 'workingdir')
+        os.mkdir(run_location)
+
+        pool = paransys2.ANSYSPool(workers=nworkers, exec_loc=mockansys.__file__, run_location=run_location, add_flags=f'-mock_time {mock_time}')
+        pool._print = False
+        for session in pool._sessions:
+            session._print = False
+        pool._settings['monitor_wait'] = monitor_wait
+        pool.setAPDLmodel(mock_model(folder), location=folder)
+
+        # Sessions are started by a first run, so just the solutions are timed
+        pool.solve_many([{'B': 1}]*nworkers)
+
+        tstart = time.perf_counter()
+        pool.solve_many(parins)
+        elapsed = time.perf_counter()-tstart
+        ideal = points*mock_time/nworkers
+        print('{:>12} workers: {:.3f} s, {:.2f} points/s, {:.0%} of the ideal'.format(nworkers, elapsed, points/elapsed, ideal/elapsed if elapsed > 0 else 1))
+
+        # Clean everything
+        pool.exit()
+        shutil.rmtree(folder)
+
+
+def batching(points=50, mock_time=0.01, monitor_wait=0.1):
+    import os
+    import time
+    import shutil
+    import tempfile
+    import paransys2
+    from paransys2 import mockansys
+
+    # Print some explanations
+    print(f'\n\nSolving {points} points of a small mock model one by one, in a batch and in a pipelined batch, each solution takes {mock_time} s at the mock solver.\n\n')
+
+    folder = tempfile.mkdtemp()
+    run_location = os.path.join(folder, 'workingdir')
+    os.mkdir(run_location)
+
+    ansys = paransys2.ANSYS(exec_loc=mockansys.__file__, run_location=run_location, add_flags=f'-mock_time {mock_time}')
+    ansys._print = False
+    ansys._settings['monitor_wait'] = monitor_wait
+    ansys.setAPDLmodel(mock_model(folder), location=folder)
+    paransys2.utils.ansys.start(ansys)
+
+    parins = [{'B': 1+i/points, 'H': 2-i/points} for i in range(points)]
+    pipelined = lambda parins: ansys.solve_batch(parins, lookahead=1)
+    for name, function in [('one by one', ansys.solve_many), ('batch', ansys.solve_batch), ('pipelined', pipelined)]:
+        tstart = time.perf_counter()
+        function(parins)
+        elapsed = time.perf_counter()-tstart
+        print('{:>12}: {:.3f} s, {:.2f} points/s'.format(name, elapsed, points/elapsed))
+
+    # Clean everything
+    ansys.exit()
+    shutil.rmtree(folder)
@@ -0,0 +1,49 @@
+def staging(binary_mb=50, lines=50000, repeat=3):
+    import os
+    import time
+    import shutil
+    import tempfile
+    import paransys2
+    from paransys2 import mockansys
+    from paransys2.benchmarks.solving import mock_model
+
+    # Print some explanations
+    print(f'\n\nStaging a model with a {binary_mb} MB binary file and a {lines} lines script.\n\n')
+
+    folder = tempfile.mkdtemp()
+    model = os.path.join(folder, 'model')
+    os.mkdir(model)
+    main = mock_model(model)
+    with open(os.path.join(model, 'mesh.db'), 'wb') as f:
+        f.write(b'\x00' + os.urandom(binary_mb*1024**2))
+    with open(os.path.join(model, 'loads.inp'), 'w') as f:
+        for i in range(lines):
+            f.write(f'F,{i},FX,{i/lines:.6f}\n')
+
+    for mode in ['copy', 'link']:
+        run_location = os.path.join(folder, mode)
+        os.mkdir(run_location)
+        ansys = paransys2.ANSYS(exec_loc=mockansys.__file__, run_location=run_location)
+        ansys._print = False
+        ansys._settings['stage_mode'] = mode
+        ansys.setAPDLmodel(main, extrafiles=['mesh.db', 'loads.inp'], location=model)
+
+        # First staging, everything is written
+        first = float('inf')
+        for _ in range(repeat):
+            ansys._staged = {}
+            tstart = time.perf_counter()
+            paransys2.utils.files.copy_model(ansys, {'B': 1})
+            first = min(first, time.perf_counter()-tstart)
+
+        # Same parameters names, nothing changes
+        again = float('inf')
+        for i in range(repeat):
+            tstart = time.perf_counter()
+            paransys2.utils.files.copy_model(ansys, {'B': i})
+            again = min(again, time.perf_counter()-tstart)
+
+        print('{:>6}: first staging {:.4f} s, staging again {:.6f} s'.format(mode, first, again))
+
+    # Clean everything
+    shutil.rmtree(folder)
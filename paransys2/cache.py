@@ -0,0 +1,201 @@
+"""
+A persistent cache of ANSYS results
+"""
+
+import os
+import pickle
+import hashlib
+import threading
+import paransys2.utils as utils
+
+class ResultCache:
+    """
+    This class keeps `solve()` results in a folder, so the same parameters set isn't solved twice.
+
+    Each result is saved in a file named by a hash of the model files contents, the input parameters and
+    the POST26 variables. When the cache is bigger than `maxsize` the least recently used results are removed.
+
+    """
+
+    def __init__(self, location=os.path.join('.', 'paransys_cache'), maxsize=1024):
+        """
+        Open (or create) a cache folder.
+
+        Args:
+            location (str, optional): Folder where results are saved. Defaults to 'paransys_cache' at current folder.
+            maxsize (float, optional): Maximum cache size in MB. Defaults to 1024.
+        """
+        os.makedirs(location, exist_ok=True)
+        self.location = location
+        self.maxsize = maxsize*1024**2
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._filehashes = {}
+
+        # Index of saved results {key: size}
+        self._index = {}
+        for entry in os.scandir(location):
+            if entry.name.endswith('.pkl'):
+                self._index[entry.name[:-4]] = entry.stat().st_size
+
+
+    def filehash(self, fname):
+        """
+        Hash a file contents. It's only read again when it's modification time or size change.
+
+        Args:
+            fname (str): file location.
+
+        Returns:
+            str: SHA-256 hash of the file.
+        """
+        stat = os.stat(fname)
+        signature = (stat.st_mtime_ns, stat.st_size)
+        cached = self._filehashes.get(fname)
+        if cached is None or cached[0] != signature:
+            hasher = hashlib.sha256()
+            with open(fname, 'rb') as f:
+                for chunk in iter(lambda: f.read(1024**2), b''):
+                    hasher.update(chunk)
+            cached = (signature, hasher.hexdigest())
+            self._filehashes[fname] = cached
+        return cached[1]
+
+
+    def key(self, model, parin, P26vars):
+        """
+        Create the key of a solution.
+
+        Args:
+            model (dict): APDL model as in `ANSYS._model`.
+            parin (dict): input parameters.
+            P26vars (list of integers): POST26 variables numbers.
+
+        Returns:
+            str: the key.
+        """
+        hasher = hashlib.sha256()
+        for fname in utils.files.model_files(model):
+            hasher.update(fname.encode())
+            hasher.update(self.filehash(os.path.join(model['location'], fname)).encode())
+
+        hasher.update(utils.anothers.normalize_parin(parin, P26vars).encode())
+
+        return hasher.hexdigest()
+
+
+    def _fname(self, key):
+        return os.path.join(self.location, '{}.pkl'.format(key))
+
+
+    def get(self, key):
+        """
+        Get a saved result.
+
+        Args:
+            key (str): the solution key.
+
+        Returns:
+            tuple: `(parout, p26df)` like `solve()`, or None if it isn't in the cache.
+        """
+        with self._lock:
+            if key not in self._index:
+                self.misses += 1
+                return None
+            fname = self._fname(key)
+            try:
+                with open(fname, 'rb') as f:
+                    result = pickle.load(f)
+                os.utime(fname)
+            except (OSError, pickle.UnpicklingError, EOFError):
+                self._index.pop(key, None)
+                self.misses += 1
+                return None
+            self.hits += 1
+        return result['parout'], result['p26df']
+
+
+    def put(self, key, parout, p26df, parin=None):
+        """
+        Save a result, removing the least recently used ones if needed.
+
+        Args:
+            key (str): the solution key.
+            parout (dict): output parameters.
+            p26df (pandas.DataFrame): POST26 variables or None.
+            parin (dict, optional): input parameters, saved just for reference. Defaults to None.
+        """
+        with self._lock:
+            fname = self._fname(key)
+            with open(fname, 'wb') as f:
+                pickle.dump({'parin': parin, 'parout': parout, 'p26df': p26df}, f)
+            self._index[key] = os.path.getsize(fname)
+            self._evict()
+
+
+    def entries(self):
+        """
+        Iterate over all saved results.
+
+        Yields:
+            tuple: `(key, parin, parout, p26df)` for each result.
+        """
+        for key in list(self._index):
+            try:
+                with open(self._fname(key), 'rb') as f:
+                    result = pickle.load(f)
+            except (OSError, pickle.UnpicklingError, EOFError):
+                continue
+            yield key, result['parin'], result['parout'], result['p26df']
+
+
+    def _evict(self):
+        """
+        Remove the least recently used results until the cache fits in `maxsize`.
+        """
+        size = sum(self._index.values())
+        if size <= self.maxsize:
+            return
+        used = []
+        for key in self._index:
+            try:
+                used.append((os.path.getmtime(self._fname(key)), key))
+            except OSError:
+                used.append((0, key))
+        for _, key in sorted(used):
+            if size <= self.maxsize:
+                break
+            size -= self._index.pop(key)
+            try:
+                os.remove(self._fname(key))
+            except OSError:
+                pass
+
+
+    def clear(self):
+        """
+        Remove all saved results.
+        """
+        with self._lock:
+            for key in list(self._index):
+                try:
+                    os.remove(self._fname(key))
+                except OSError:
+                    pass
+            self._index = {}
+
+
+    def stats(self):
+        """
+        Cache counters.
+
+        Returns:
+            dict: with `hits`, `misses`, number of `entries` and `size` in MB.
+        """
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'entries': len(self._index),
+            'size': sum(self._index.values())/1024**2
+        }
@@ -0,0 +1,707 @@
+"""
+Distributed solution of parameters sets in many machines
+"""
+
+import os
+import json
+import time
+import uuid
+import pickle
+import socket
+import threading
+import collections
+import socketserver
+import pandas
+import paransys2.utils as utils
+from paransys2.ansys import ANSYS
+
+class Coordinator:
+    """
+    This class keeps a queue of parameters sets that are solved by `Worker`s running in other machines (or in
+    other processes of this one), each worker solving them with it's own `ANSYS` or `ANSYSPool`.
+
+    Workers pull the sets when they have a free session, so the throughput grows with the number of nodes and
+    license seats. They send heartbeats while solving, and the sets of a worker that stops sending them
+    (or that closes it's connection) are given to another worker. Results are returned in the same order of the
+    parameters sets, like `ANSYS.map()`.
+
+    Two transports are available:
+
+        `location`: a folder shared by all machines (like a network drive). Sets, results and heartbeats are
+                    files, claimed by atomic renames, so no port has to be opened.
+        `address`:  a TCP `(host, port)` where the coordinator listens, workers connect to it.
+
+    `run_doe()` and `sweep()` work here like in `ANSYS`.
+
+    """
+
+    def __init__(self, location=None, address=None, timeout=60, window=1000):
+        """
+        Create the coordinator and start listening to workers.
+
+        Args:
+            location (str, optional): shared folder used as transport. Defaults to None.
+            address (tuple, optional): `(host, port)` used as TCP transport, a port 0 takes any free port (see `address`). Defaults to None.
+            timeout (float, optional): seconds without heartbeats after a worker is considered lost. Defaults to 60.
+            window (int, optional): maximum number of queued sets, so `parins` could be a long generator. Defaults to 1000.
+        """
+        self._print = True
+        self._log = False
+
+        if (location is None) == (address is None):
+            utils.messages.cerror(self, 'Coordinator needs a shared folder (location) or a TCP address, just one of them.')
+
+        self.timeout = timeout
+        self.window = window
+        if location is not None:
+            self._transport = _FolderServer(self, location)
+        else:
+            self._transport = _SocketServer(self, address)
+
+        self._nexttask = 0
+
+
+    @property
+    def address(self):
+        """
+        Returns:
+            tuple: `(host, port)` where the coordinator listens, or None for a shared folder.
+        """
+        return self._transport.address
+
+
+    def map(self, parins, P26vars=[], callback=None, failsafe=False, info=False):
+        """
+        Solve ANSYS model for a sequence of parameters sets in the workers, yielding the results in the same order of `parins`.
+
+        Args:
+            parins (iterable of dicts): parameters sets, each one like the `**parin` of `solve()`.
+            P26vars (list of integers, optional): POST26 variables numbers asked for all sets. Defaults to [].
+            callback (function, optional): function called as `callback(i, parout, p26df)` when the i-th set is solved. Defaults to None.
+            failsafe (bool, optional): if True a failed set doesn't stop the others and returns `({'PARANSYS_ERROR': message, 'PARANSYS_STATUS': status}, None)`. Defaults to False.
+            info (bool, optional): if True it also yields a dictionary with `PARANSYS_RUNS`, `PARANSYS_TIME`, `PARANSYS_CACHED`, `PARANSYS_SOLVER_TIME` and the `PARANSYS_WORKER` name. Defaults to False.
+
+        Yields:
+            tuple: `(parout, p26df)` for each parameters set, as returned by `solve()`, or `(parout, p26df, info)`.
+        """
+        P26vars = list(P26vars)
+        parins = iter(parins)
+        queued = collections.deque()
+        waiting = set()
+        results = {}
+        exhausted = False
+        i = 0
+        while True:
+            # Keep the queue full
+            while not exhausted and len(queued) < self.window:
+                try:
+                    parin = next(parins)
+                except StopIteration:
+                    exhausted = True
+                    break
+                task = '{:012d}'.format(self._nexttask)
+                self._nexttask += 1
+                parin = {name: value.item() if hasattr(value, 'item') else value for name, value in parin.items()}
+                self._transport.submit(task, {'parin': parin, 'P26vars': P26vars})
+                queued.append(task)
+                waiting.add(task)
+
+            if not queued:
+                return
+
+            # Results arrive out of order, they are kept until it's turn. A set given again to another
+            # worker could be solved twice, just the first result is used.
+            while queued[0] not in results:
+                for task, result in self._transport.collect(wait=1.0):
+                    if task in waiting:
+                        waiting.discard(task)
+                        results[task] = result
+
+            parout, p26df, runinfo = results.pop(queued.popleft())
+            if 'PARANSYS_ERROR' in parout and not failsafe:
+                self._transport.cancel()
+                utils.messages.cerror(self, 'Parameters set failed in worker {}: {}'.format(runinfo.get('PARANSYS_WORKER'), parout['PARANSYS_ERROR']))
+            if callback is not None:
+                callback(i, parout, p26df)
+            i += 1
+            yield (parout, p26df, runinfo) if info else (parout, p26df)
+
+
+    def solve_many(self, parins, P26vars=[], callback=None, failsafe=False):
+        """
+        Solve ANSYS model for a list of parameters sets in the workers. It is the same as `list(map(...))`.
+
+        Returns:
+            list: A list with `(parout, p26df)` for each parameters set, in the same order of `parins`.
+        """
+        return list(self.map(parins, P26vars=P26vars, callback=callback, failsafe=failsafe))
+
+
+    def solve(self, P26vars=[], **parin):
+        """
+        Solve one parameters set in the first free worker.
+
+        Returns:
+            dict: An dictionary with all parameters values at the end of the analysis.
+            pandas.DataFrame: A pandas DataFrame with asked POST26 variables.
+        """
+        return self.solve_many([parin], P26vars=P26vars)[0]
+
+
+    run_doe = ANSYS.run_doe
+    sweep = ANSYS.sweep
+
+
+    def workers(self):
+        """
+        Workers heard by the coordinator.
+
+        Returns:
+            dict: `{name: seconds since it's last heartbeat}`.
+        """
+        now = time.monotonic()
+        return {name: now-seen for name, seen in self._transport.seen.items()}
+
+
+    def close(self):
+        """
+        Tell the workers to stop and stop listening.
+        """
+        self._transport.close()
+
+
+
+class Worker:
+    """
+    This class pulls parameters sets from a `Coordinator` and solves them by `solve()` of an `ANSYS` session.
+    Using an `ANSYSPool` each session pulls it's own sets.
+
+    """
+
+    def __init__(self, ansys, location=None, address=None, name=None, heartbeat=5, idle=0.5):
+        """
+        Connect a session to a coordinator.
+
+        Args:
+            ansys (ANSYS or ANSYSPool): the session that solves the sets, with it's APDL model already set.
+            location (str, optional): shared folder of the coordinator. Defaults to None.
+            address (tuple, optional): `(host, port)` of the coordinator. Defaults to None.
+            name (str, optional): worker name, it must be unique. Defaults to None, then the host name and the process id are used.
+            heartbeat (float, optional): seconds between heartbeats, it must be smaller than the coordinator `timeout`. Defaults to 5.
+            idle (float, optional): seconds waited when the queue is empty. Defaults to 0.5.
+        """
+        self._print = ansys._print
+        self._log = ansys._log
+
+        if (location is None) == (address is None):
+            utils.messages.cerror(self, 'Worker needs the coordinator shared folder (location) or TCP address, just one of them.')
+
+        self.ansys = ansys
+        self.name = name if name is not None else '{}-{}-{}'.format(socket.gethostname(), os.getpid(), uuid.uuid4().hex[:6])
+        self.name = self.name.replace('.', '_')
+        self.heartbeat = heartbeat
+        self.idle = idle
+        self._location = location
+        self._address = address
+
+
+    def run(self, maxtasks=None):
+        """
+        Solve parameters sets until the coordinator is closed.
+
+        Args:
+            maxtasks (int, optional): stop after solving this number of sets. Defaults to None.
+
+        Returns:
+            int: number of sets solved.
+        """
+        sessions = getattr(self.ansys, '_sessions', [self.ansys])
+        if self._location is not None:
+            client = _FolderClient(self._location, self.name)
+        else:
+            client = _SocketClient(self._address, self.name)
+
+        utils.messages.cprint(self, f'Worker {self.name} solving with {len(sessions)} session(s).')
+
+        stop = threading.Event()
+        lock = threading.Lock()
+        solved = [0]
+
+        def beat():
+            while not stop.wait(self.heartbeat):
+                if not client.beat():
+                    stop.set()
+
+        def slot(session):
+            while not stop.is_set():
+                with lock:
+                    if maxtasks is not None and solved[0] >= maxtasks:
+                        return
+                    solved[0] += 1
+                task = client.take()
+                if task is _STOP:
+                    stop.set()
+                if task is None or task is _STOP:
+                    with lock:
+                        solved[0] -= 1
+                    stop.wait(self.idle)
+                    continue
+                task, data = task
+                parout, p26df, runinfo = session._solve_point(data['parin'], data['P26vars'], failsafe=True)
+                runinfo['PARANSYS_WORKER'] = self.name
+                if not client.finish(task, (parout, p26df, runinfo)):
+                    stop.set()
+
+        client.beat()
+        beater = threading.Thread(target=beat, daemon=True)
+        beater.start()
+        slots = [threading.Thread(target=slot, args=(session,), daemon=True) for session in sessions]
+        for thread in slots:
+            thread.start()
+        for thread in slots:
+            thread.join()
+        stop.set()
+        beater.join()
+        client.close()
+
+        utils.messages.cprint(self, f'Worker {self.name} stopped after {solved[0]} sets.')
+        return solved[0]
+
+
+
+# Returned by the clients when the coordinator is closed
+_STOP = object()
+
+
+class _FolderServer:
+    """
+    (For internal use)
+    Coordinator side of the shared folder transport.
+
+    Sets are `queue/<task>.task` files. A worker claims a set renaming it to `claimed/<task>.<worker>.task`,
+    so just one worker gets it, and writes it's result to `results/<task>.result`. Each worker rewrites a counter
+    at `workers/<worker>.alive`, the coordinator uses it's own clock to see when it changes, so the clocks of the
+    machines don't have to be synchronized.
+
+    Tasks names start with the coordinator session, and the coordinator rewrites a counter (with it's timeout) at
+    `sessions/<session>.alive` in the same way, so many coordinators could share the folder: each one collects and
+    removes just it's own results, and workers don't take sets of closed or crashed coordinators.
+    """
+
+    def __init__(self, coordinator, location):
+        self._coordinator = coordinator
+        self.address = None
+        self.location = location
+        for folder in ['queue', 'claimed', 'results', 'workers', 'sessions']:
+            os.makedirs(os.path.join(location, folder), exist_ok=True)
+        _remove(os.path.join(location, 'stop'))
+
+        # Tasks names start with the session, so files of other coordinators are ignored
+        self._session = uuid.uuid4().hex[:8]
+        self._counters = {}
+        self._beats = 0
+        self.seen = {}
+        self._lastcheck = time.monotonic()
+        self._beat()
+
+        # Sets queued by closed coordinators are never collected
+        sessions = {fname.split('.')[0] for fname in os.listdir(os.path.join(location, 'sessions'))}
+        folder = os.path.join(location, 'queue')
+        for fname in os.listdir(folder):
+            if fname.split('_')[0] not in sessions:
+                _remove(os.path.join(folder, fname))
+
+
+    def _beat(self):
+        """
+        Show to workers that this coordinator is alive.
+        """
+        self._beats += 1
+        _write_text(os.path.join(self.location, 'sessions', f'{self._session}.alive'), f'{self._beats} {self._coordinator.timeout}')
+
+
+    def submit(self, task, data):
+        _write(os.path.join(self.location, 'queue', f'{self._session}_{task}.task'), data)
+
+
+    def collect(self, wait):
+        tend = time.monotonic() + wait
+        while True:
+            results = []
+            folder = os.path.join(self.location, 'results')
+            for fname in sorted(os.listdir(folder)):
+                if not fname.endswith('.result'):
+                    continue
+                if fname.startswith(self._session):
+                    path = os.path.join(folder, fname)
+                    results.append((fname[len(self._session)+1:-len('.result')], _read(path)))
+                    _remove(path)
+
+            if time.monotonic() - self._lastcheck > 0.5:
+                self._check()
+            if results or time.monotonic() > tend:
+                return results
+            time.sleep(0.02)
+
+
+    def _check(self):
+        """
+        Update the workers heartbeats and give the sets of lost workers back to the queue.
+        """
+        now = time.monotonic()
+        self._lastcheck = now
+        self._beat()
+        folder = os.path.join(self.location, 'workers')
+        for fname in os.listdir(folder):
+            if not fname.endswith('.alive'):
+                continue
+            worker = fname[:-len('.alive')]
+            try:
+                with open(os.path.join(folder, fname)) as file:
+                    counter = file.read()
+            except OSError:
+                continue
+            if self._counters.get(worker) != counter:
+                self._counters[worker] = counter
+                self.seen[worker] = now
+
+        folder = os.path.join(self.location, 'claimed')
+        for fname in os.listdir(folder):
+            if not fname.startswith(self._session):
+                continue
+            task, worker, _ = fname.split('.')
+            self.seen.setdefault(worker, now)
+            if now - self.seen[worker] > self._coordinator.timeout:
+                try:
+                    os.replace(os.path.join(folder, fname), os.path.join(self.location, 'queue', f'{task}.task'))
+                except OSError:
+                    continue
+                utils.messages.cprint(self._coordinator, f'** Worker {worker} lost, it\'s set {task[len(self._session)+1:]} was queued again.')
+
+
+    def cancel(self):
+        folder = os.path.join(self.location, 'queue')
+        for fname in os.listdir(folder):
+            if fname.startswith(self._session):
+                _remove(os.path.join(folder, fname))
+
+
+    def close(self):
+        self.cancel()
+        _remove(os.path.join(self.location, 'sessions', f'{self._session}.alive'))
+        with open(os.path.join(self.location, 'stop'), 'w') as file:
+            file.write(self._session)
+
+
+
+class _FolderClient:
+    """
+    (For internal use)
+    Worker side of the shared folder transport.
+    """
+
+    def __init__(self, location, name):
+        self.location = location
+        self.name = name
+        self._counter = 0
+        self._lock = threading.Lock()
+        # Coordinators heartbeats {session: (counter, time it changed or None if it didn't change yet)}
+        self._sessions = {}
+
+
+    def _active(self):
+        """
+        Sessions of the coordinators alive: their heartbeat changed within their timeout, by the worker clock.
+        A session just found isn't alive until it's heartbeat changes, it could be left by a crashed coordinator.
+        """
+        now = time.monotonic()
+        folder = os.path.join(self.location, 'sessions')
+        active = set()
+        with self._lock:
+            for fname in os.listdir(folder):
+                if not fname.endswith('.alive'):
+                    continue
+                session = fname[:-len('.alive')]
+                try:
+                    with open(os.path.join(folder, fname)) as file:
+                        counter, timeout = file.read().split()
+                    timeout = float(timeout)
+                except (OSError, ValueError):
+                    continue
+                if session not in self._sessions:
+                    self._sessions[session] = (counter, None)
+                elif self._sessions[session][0] != counter:
+                    self._sessions[session] = (counter, now)
+                changed = self._sessions[session][1]
+                if changed is not None and now - changed <= timeout:
+                    active.add(session)
+        return active
+
+
+    def take(self):
+        if os.path.exists(os.path.join(self.location, 'stop')):
+            return _STOP
+        folder = os.path.join(self.location, 'queue')
+        active = None
+        for fname in sorted(os.listdir(folder)):
+            if not fname.endswith('.task'):
+                continue
+            task = fname[:-len('.task')]
+            # Sets of closed or crashed coordinators are never collected
+            active = self._active() if active is None else active
+            if task.split('_')[0] not in active:
+                continue
+            claimed = os.path.join(self.location, 'claimed', f'{task}.{self.name}.task')
+            try:
+                os.replace(os.path.join(folder, fname), claimed)
+            except OSError:
+                # Another worker was faster
+                continue
+            return task, _read(claimed)
+        return None
+
+
+    def beat(self):
+        with self._lock:
+            self._counter += 1
+            _write_text(os.path.join(self.location, 'workers', f'{self.name}.alive'), str(self._counter))
+        return True
+
+
+    def finish(self, task, result):
+        _write(os.path.join(self.location, 'results', f'{task}.result'), result)
+        _remove(os.path.join(self.location, 'claimed', f'{task}.{self.name}.task'))
+        return True
+
+
+    def close(self):
+        _remove(os.path.join(self.location, 'workers', f'{self.name}.alive'))
+
+
+
+class _SocketServer:
+    """
+    (For internal use)
+    Coordinator side of the TCP transport.
+
+    Each message is a JSON line answered by another one: `get` (answered with a set, no set or stop), `beat`
+    and `result`. Any message is a heartbeat, and a closed connection loses the sets of it's worker at once.
+    """
+
+    def __init__(self, coordinator, address):
+        self._coordinator = coordinator
+        self._queue = collections.deque()
+        self._tasks = {}
+        self._assigned = {}
+        self._results = []
+        self._closed = False
+        self._changed = threading.Condition()
+        self.seen = {}
+
+        server = self
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                worker = None
+                try:
+                    for line in self.rfile:
+                        message = json.loads(line)
+                        worker = message['worker']
+                        reply = server._message(message)
+                        self.wfile.write((json.dumps(reply) + '\n').encode())
+                except (OSError, ValueError):
+                    pass
+                finally:
+                    if worker is not None:
+                        server._lost(worker)
+
+        self._server = socketserver.ThreadingTCPServer(tuple(address), Handler)
+        self._server.daemon_threads = True
+        self.address = self._server.server_address
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+
+
+    def _message(self, message):
+        with self._changed:
+            worker = message['worker']
+            self.seen[worker] = time.monotonic()
+            if self._closed:
+                return {'stop': True}
+
+            if message['op'] == 'get':
+                if not self._queue:
+                    return {'task': None}
+                task = self._queue.popleft()
+                self._assigned[task] = worker
+                return {'task': task, 'data': self._tasks[task]}
+
+            if message['op'] == 'result':
+                task = message['task']
+                if task in self._tasks:
+                    del self._tasks[task]
+                    self._assigned.pop(task, None)
+                    self._results.append((task, _unpack(message['result'])))
+                    self._changed.notify_all()
+
+            return {'ok': True}
+
+
+    def _lost(self, worker):
+        """
+        Give the sets of a worker back to the front of the queue.
+        """
+        with self._changed:
+            lost = [task for task, owner in self._assigned.items() if owner == worker]
+            for task in sorted(lost, reverse=True):
+                del self._assigned[task]
+                self._queue.appendleft(task)
+            if lost and not self._closed:
+                utils.messages.cprint(self._coordinator, f'** Worker {worker} lost, {len(lost)} set(s) queued again.')
+
+
+    def submit(self, task, data):
+        with self._changed:
+            self._tasks[task] = data
+            self._queue.append(task)
+
+
+    def collect(self, wait):
+        with self._changed:
+            if not self._results:
+                self._changed.wait(wait)
+            now = time.monotonic()
+            lost = {worker for worker in self._assigned.values() if now - self.seen.get(worker, now) > self._coordinator.timeout}
+        for worker in lost:
+            self._lost(worker)
+        with self._changed:
+            results, self._results = self._results, []
+        return results
+
+
+    def cancel(self):
+        with self._changed:
+            for task in self._queue:
+                self._tasks.pop(task, None)
+            self._queue.clear()
+
+
+    def close(self):
+        with self._changed:
+            self._closed = True
+            self._queue.clear()
+        self._server.shutdown()
+        self._server.server_close()
+
+
+
+class _SocketClient:
+    """
+    (For internal use)
+    Worker side of the TCP transport. A closed coordinator stops the worker.
+    """
+
+    def __init__(self, address, name):
+        self.name = name
+        self._socket = socket.create_connection(tuple(address))
+        self._file = self._socket.makefile('rwb')
+        self._lock = threading.Lock()
+
+
+    def _request(self, message):
+        message['worker'] = self.name
+        with self._lock:
+            try:
+                self._file.write((json.dumps(message) + '\n').encode())
+                self._file.flush()
+                line = self._file.readline()
+            except (OSError, ValueError):
+                return {'stop': True}
+        if not line:
+            return {'stop': True}
+        return json.loads(line)
+
+
+    def take(self):
+        reply = self._request({'op': 'get'})
+        if reply.get('stop'):
+            return _STOP
+        if reply['task'] is None:
+            return None
+        return reply['task'], reply['data']
+
+
+    def beat(self):
+        return not self._request({'op': 'beat'}).get('stop')
+
+
+    def finish(self, task, result):
+        return not self._request({'op': 'result', 'task': task, 'result': _pack(result)}).get('stop')
+
+
+    def close(self):
+        try:
+            self._file.close()
+            self._socket.close()
+        except OSError:
+            pass
+
+
+
+def _write(path, data):
+    """
+    (For internal use)
+    Write a pickle file at once, renaming a temporary file, so it's never read half written.
+    """
+    with open(path + '.tmp', 'wb') as file:
+        pickle.dump(data, file)
+    os.replace(path + '.tmp', path)
+
+
+def _read(path):
+    """
+    (For internal use)
+    """
+    with open(path, 'rb') as file:
+        return pickle.load(file)
+
+
+def _write_text(path, text):
+    """
+    (For internal use)
+    Write a small text file atomically.
+    """
+    with open(path + '.tmp', 'w') as file:
+        file.write(text)
+    os.replace(path + '.tmp', path)
+
+
+def _remove(path):
+    """
+    (For internal use)
+    """
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def _pack(result):
+    """
+    (For internal use)
+    `(parout, p26df, info)` as JSON, with the POST26 DataFrame split in index, columns and data.
+    """
+    parout, p26df, runinfo = result
+    if p26df is not None:
+        p26df = {'index': p26df.index.tolist(), 'columns': p26df.columns.tolist(), 'data': p26df.values.tolist()}
+    return {'parout': parout, 'p26df': p26df, 'info': runinfo}
+
+
+def _unpack(result):
+    """
+    (For internal use)
+    Inverse of `_pack()`.
+    """
+    p26df = result['p26df']
+    if p26df is not None:
+        p26df = pandas.DataFrame(p26df['data'], index=pandas.Index(p26df['index'], name='Time'), columns=p26df['columns'])
+    return result['parout'], p26df, result['info']
@@ -1,4 +1,5 @@
 def cantilever():
+    import os
     import paransys2
     import pandas 
     import matplotlib.pyplot as plt
@@ -10,7 +11,7 @@ def cantilever():
     ansys = paransys2.ANSYS()
 
     # Find APDL script path that is located at examples folder
-    apdlloc = '{}\\examples\\'.format(paransys2.__path__[0])
+    apdlloc = os.path.join(paransys2.__path__[0], 'examples')
 
     # Set ANSYS APDL script 
     ansys.setAPDLmodel('cant.inp', location=apdlloc)
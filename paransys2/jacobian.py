@@ -0,0 +1,94 @@
+"""
+Jacobian matrix with labeled axes
+"""
+
+import numpy
+import pandas
+
+class Jacobian:
+    """
+    This class keeps the derivatives of many outputs with respect to many inputs as a NumPy matrix,
+    one row by output and one column by input, with the point where they were evaluated.
+
+    It's indexed like the dictionary of `derivatives()`, `jac['STRESS', 'B']`, and `matrix` could be used
+    directly by iterative algorithms. `broyden()` updates it to a new point without finite differences.
+
+    """
+
+    def __init__(self, matrix, outputs, inputs, point=None, values=None):
+        """
+        Args:
+            matrix (numpy.ndarray): derivatives, with a row by output and a column by input.
+            outputs (list of strings): outputs names.
+            inputs (list of strings): inputs names.
+            point (dict, optional): inputs values where it was evaluated. Defaults to None.
+            values (dict, optional): outputs values at `point`. Defaults to None.
+        """
+        self.matrix = numpy.asarray(matrix, dtype=float).reshape(len(outputs), len(inputs))
+        self.outputs = list(outputs)
+        self.inputs = list(inputs)
+        self.point = {} if point is None else dict(point)
+        self.values = {} if values is None else dict(values)
+        self._rows = {name: i for i, name in enumerate(self.outputs)}
+        self._columns = {name: j for j, name in enumerate(self.inputs)}
+
+
+    def __getitem__(self, key):
+        output, input = key
+        return self.matrix[self._rows[output.upper()], self._columns[input.upper()]]
+
+
+    def __repr__(self):
+        return 'Jacobian(\n{}\n)'.format(self.to_frame())
+
+
+    def gradient(self, output):
+        """
+        Derivatives of one output with respect to all inputs.
+
+        Args:
+            output (str): output name.
+
+        Returns:
+            numpy.ndarray: in the order of `inputs`.
+        """
+        return self.matrix[self._rows[output.upper()]].copy()
+
+
+    def to_frame(self):
+        """
+        Returns:
+            pandas.DataFrame: derivatives with outputs as index and inputs as columns.
+        """
+        return pandas.DataFrame(self.matrix, index=pandas.Index(self.outputs, name='OUTPUT'), columns=pandas.Index(self.inputs, name='INPUT'))
+
+
+    def to_dict(self):
+        """
+        Returns:
+            dict: derivatives as `{(output, input): value}`, like `derivatives()`.
+        """
+        return {(output, input): self.matrix[i, j] for i, output in enumerate(self.outputs) for j, input in enumerate(self.inputs)}
+
+
+    def broyden(self, point, values):
+        """
+        Broyden's rank-one update to a new point, where just the outputs are known.
+
+        The secant condition `J.dx = df` is satisfied with the smallest change of the matrix, so a finite difference
+        pass (one solution by input) is replaced by the solution of the new point.
+
+        Args:
+            point (dict): inputs values at the new point.
+            values (dict): outputs values at the new point.
+
+        Returns:
+            Jacobian: the updated Jacobian, at the new point.
+        """
+        dx = numpy.array([point[name] - self.point[name] for name in self.inputs], dtype=float)
+        df = numpy.array([values[name] - self.values[name] for name in self.outputs], dtype=float)
+        step = dx @ dx
+        matrix = self.matrix.copy()
+        if step > 0:
+            matrix += numpy.outer(df - matrix @ dx, dx)/step
+        return Jacobian(matrix, self.outputs, self.inputs, point, values)
@@ -0,0 +1,437 @@
+"""
+A stand-in for the ANSYS executable, to run and time PARANSYS without an ANSYS license.
+
+It's a Python script that follows the `monitor.paransys` control protocol: it waits for `PARANSYS_GO` at
+`control.paransys` (after writing `ready.paransys`), reads `par_in.paransys`, runs the model, writes `par_out.paransys` (like PARSAV) and
+the asked POST26 variables at `P26_out.paransys`, and then writes `PARANSYS_DONE` back.
+
+The model is interpreted just for parameters: `name=expression`, `*SET,name,expression`, `/INPUT`, `/EOF`,
+`*IF` blocks, `SAVE`/`RESUME`, `PARSAV`/`PARRES` and `/WAIT` (it really waits, like a slow meshing) are followed,
+any other command is ignored. So a model like `STRESS = 6*Q*L**2/(B*H**2)` gives a real output.
+
+Use it as the `exec_loc` of `ANSYS` or `ANSYSPool`, some extra flags can be set by `add_flags`:
+    -mock_time T    each solution takes T seconds (or the `MOCK_TIME` model parameter, if it exists). Defaults to 0.
+    -mock_start T   ANSYS takes T seconds to start (like checking out a license). Defaults to 0.
+    -mock_steps N   number of POST26 time steps. Defaults to 10.
+    -mock_parallel P  parallel fraction of the solution (Amdahl's law), it takes `T*((1-P) + P/np)` with `-np`
+                    cores. Defaults to 0 (the number of cores doesn't change it).
+
+A solution with the `MOCK_CRASH` parameter not zero closes the mock with it as exit code, like an ANSYS crash,
+and a long `MOCK_TIME` looks like a hung solution.
+
+POST26 variable 1 is time (from 1/N to 1) and variable V is `V*time*(sum of input parameters)`.
+"""
+
+import os
+import re
+import sys
+import json
+import math
+import time
+
+# Parameters as "parm=value" or "*SET,parm,value", just the first one of each line
+pattParameter = re.compile(r'^.*?(?:\*SET\s*,\s*(\w+)\s*,|(\w+)\s*\=)\s*([-+]?(?:[0-9]+\.?[0-9]*|\.[0-9]+)(?:[ED][-+]?[0-9]+)?)', re.IGNORECASE | re.MULTILINE)
+pattAssign = re.compile(r'^([A-Za-z_]\w*)\s*=(.*)$')
+pattName = re.compile(r'(?<![\w.])([A-Za-z_]\w*)(\s*\()?')
+pattDouble = re.compile(r'(?<=[0-9.])[Dd](?=[-+]?[0-9])')
+
+# *IF operators
+operators = {
+    'EQ': lambda a, b: a == b, 'NE': lambda a, b: a != b,
+    'LT': lambda a, b: a < b, 'GT': lambda a, b: a > b,
+    'LE': lambda a, b: a <= b, 'GE': lambda a, b: a >= b,
+    'ABLT': lambda a, b: abs(a) < abs(b), 'ABGT': lambda a, b: abs(a) > abs(b)
+}
+
+# APDL functions known by the interpreter (angles in radians)
+functions = {
+    'SIN': math.sin, 'COS': math.cos, 'TAN': math.tan,
+    'ASIN': math.asin, 'ACOS': math.acos, 'ATAN': math.atan, 'ATAN2': math.atan2,
+    'SINH': math.sinh, 'COSH': math.cosh, 'TANH': math.tanh,
+    'SQRT': math.sqrt, 'EXP': math.exp, 'LOG': math.log, 'LOG10': math.log10,
+    'ABS': abs, 'SIGN': math.copysign, 'NINT': round, 'MOD': math.fmod,
+    'MIN': min, 'MAX': max
+}
+
+
+def parse_args(argv):
+    """
+    Read the command line flags.
+
+    Args:
+        argv (list of strings): arguments, without the script name.
+
+    Returns:
+        dict: with `input`, `output`, `jobname`, `dir`, `nproc`, `time`, `start`, `steps` and `parallel`.
+    """
+    args = {'input': None, 'output': None, 'jobname': 'file', 'dir': '.', 'nproc': 1, 'time': 0.0, 'start': 0.0, 'steps': 10, 'parallel': 0.0}
+    flags = {
+        '-i': ('input', str), '-o': ('output', str), '-j': ('jobname', str), '-dir': ('dir', str), '-np': ('nproc', int),
+        '-mock_time': ('time', float), '-mock_start': ('start', float), '-mock_steps': ('steps', int),
+        '-mock_parallel': ('parallel', float)
+    }
+    i = 0
+    while i < len(argv):
+        flag = argv[i].lower()
+        if flag in flags and i+1 < len(argv):
+            name, kind = flags[flag]
+            args[name] = kind(argv[i+1])
+            i += 2
+        else:
+            i += 1
+    return args
+
+
+def read_values(fname):
+    """
+    Read `name=value` or `*SET,name,value` numbers from a file.
+
+    Returns:
+        dict: {NAME: value}, empty if the file doesn't exist.
+    """
+    try:
+        with open(fname, 'r') as f:
+            content = f.read()
+    except OSError:
+        return {}
+    values = {}
+    for result in pattParameter.finditer(content):
+        name = result.group(1) or result.group(2)
+        values[name.upper()] = float(result.group(3).replace('D', 'E').replace('d', 'E'))
+    return values
+
+
+def write_parameters(fname, parameters):
+    """
+    Write parameters like PARSAV.
+    """
+    with open(fname, 'w') as f:
+        f.write('/NOPR\n')
+        for name, value in parameters.items():
+            f.write('*SET,{:<8s},{!r}\n'.format(name, value))
+        f.write('/GO\n')
+
+
+def write_control(go, runs, done, kill):
+    """
+    Write `control.paransys` like `rewctrl.paransys` does.
+    """
+    with open('control.paransys', 'w') as f:
+        f.write(f'PARANSYS_GO={go:d}\nPARANSYS_RUNS={runs:d}\nPARANSYS_DONE={done:d}\nPARANSYS_KILL={kill:d}\n')
+
+
+def fixed_width(value):
+    """
+    Write a value like the Fortran `(E24.16)` format.
+    """
+    if value == 0:
+        return '{:>24}'.format('0.0000000000000000E+00')
+    mantissa, exponent = '{:.15E}'.format(value).split('E')
+    sign = '-' if mantissa.startswith('-') else ''
+    digits = mantissa.lstrip('-').replace('.', '')
+    exponent = int(exponent) + 1
+    if abs(exponent) < 100:
+        exponent = 'E{:+03d}'.format(exponent)
+    else:
+        exponent = '{:+04d}'.format(exponent)
+    return '{:>24}'.format(f'{sign}0.{digits}{exponent}')
+
+
+class Interpreter:
+    """
+    A tiny APDL interpreter that only follows parameters.
+    """
+
+    def __init__(self):
+        self.parameters = {}
+
+    def clear(self):
+        """
+        Like /CLEAR, all parameters are removed.
+        """
+        self.parameters = {}
+
+    def run_file(self, fname):
+        """
+        Run all lines of an APDL file until it ends or finds /EOF.
+        """
+        # *IF blocks as [running, some branch was taken]
+        blocks = []
+        with open(fname, 'r') as f:
+            for line in f:
+                for command in line.split('!', 1)[0].split('$'):
+                    command = command.strip()
+                    upper = command.upper()
+                    running = all(block[0] for block in blocks)
+                    if upper.startswith('*IF') and upper.rstrip().endswith('THEN'):
+                        taken = running and self.condition(command)
+                        blocks.append([taken, taken or not running])
+                    elif upper.startswith('*ELSEIF') and blocks:
+                        taken = not blocks[-1][1] and self.condition(command)
+                        blocks[-1] = [taken, blocks[-1][1] or taken]
+                    elif upper.startswith('*ELSE') and blocks:
+                        blocks[-1] = [not blocks[-1][1], True]
+                    elif upper.startswith('*ENDIF') and blocks:
+                        blocks.pop()
+                    elif running and not self.run_command(command):
+                        return
+
+    def condition(self, command):
+        """
+        Evaluate the condition of `*IF,VAL1,Oper,VAL2,THEN`.
+        """
+        args = [arg.strip() for arg in command.split(',')]
+        if len(args) < 4 or args[2].upper() not in operators:
+            return False
+        first, second = self.evaluate(args[1]), self.evaluate(args[3])
+        if first is None or second is None:
+            return False
+        return operators[args[2].upper()](first, second)
+
+    def run_command(self, command):
+        """
+        Run a command.
+
+        Returns:
+            bool: False if the file must stop here (/EOF).
+        """
+        upper = command.upper()
+        if not command:
+            return True
+        args = [arg.strip().strip('\'') for arg in command.split(',')] + ['', '', '', '']
+        if upper.startswith('/EOF'):
+            return False
+        if upper.startswith('/INPUT'):
+            fname = f'{args[1]}.{args[2]}' if args[2] else args[1]
+            if os.path.isfile(fname):
+                self.run_file(fname)
+        elif upper.startswith('/WAIT'):
+            time.sleep(self.evaluate(args[1]) or 0)
+        elif upper.startswith('SAVE'):
+            with open('{}.{}'.format(args[1] or 'file', args[2] or 'db'), 'w') as f:
+                json.dump(self.parameters, f)
+        elif upper.startswith('RESUME'):
+            with open('{}.{}'.format(args[1] or 'file', args[2] or 'db'), 'r') as f:
+                self.parameters = json.load(f)
+        elif upper.startswith('PARSAV'):
+            write_parameters('{}.{}'.format(args[2] or 'file', args[3] or 'parm'), self.parameters)
+        elif upper.startswith('PARRES'):
+            values = read_values('{}.{}'.format(args[2] or 'file', args[3] or 'parm'))
+            if args[1].upper() == 'NEW':
+                self.parameters = {}
+            self.parameters.update(values)
+        elif upper.startswith('*SET'):
+            args = command.split(',', 2)
+            if len(args) == 3:
+                self.assign(args[1], args[2])
+        else:
+            result = pattAssign.match(command)
+            if result:
+                self.assign(result.group(1), result.group(2))
+        return True
+
+    def assign(self, name, expression):
+        """
+        Evaluate an expression and save it as a parameter. Expressions that can't be evaluated are ignored.
+        """
+        value = self.evaluate(expression)
+        if value is not None:
+            self.parameters[name.strip().upper()] = value
+
+    def evaluate(self, expression):
+        """
+        Evaluate an APDL expression with the current parameters.
+
+        Returns:
+            float: the value, or None if it isn't a number or uses something unknown.
+        """
+        namespace = {}
+        def name(result):
+            word = result.group(1).upper()
+            if result.group(2):
+                if word not in functions:
+                    raise KeyError(word)
+                namespace[word] = functions[word]
+            else:
+                if word not in self.parameters:
+                    raise KeyError(word)
+                namespace[word] = self.parameters[word]
+            return word + (result.group(2) or '')
+        try:
+            expression = pattName.sub(name, pattDouble.sub('E', expression.strip()))
+            if not expression:
+                return None
+            value = eval(expression, {'__builtins__': {}}, namespace)
+            return float(value)
+        except Exception:
+            return None
+
+
+class MockANSYS:
+    """
+    The stand-in solver, it runs the monitor loop until it's killed.
+    """
+
+    def __init__(self, args):
+        self.args = args
+        self.tstart = time.time()
+        self.interpreter = Interpreter()
+
+        # Monitor settings: waiting time, main file and POST26 format
+        with open(args['input'], 'r') as f:
+            monitor = f.read()
+        result = re.search(r'^/WAIT\s*,\s*([0-9.Ee+-]+)', monitor, re.MULTILINE)
+        self.wait = float(result.group(1)) if result else 0.1
+        result = re.search(r'^/GOPR\s*\n/INPUT\s*,\s*(\S+)', monitor, re.MULTILINE)
+        self.main = result.group(1) if result else 'main.paransys'
+        result = re.search(r'^\*VWRITE,_P26_EXPORT\(1,0\)\s*\n(\S+)', monitor, re.MULTILINE)
+        self.fixed = result is not None and result.group(1).upper() == '(E24.16)'
+
+    def wall(self):
+        """
+        Wall clock time since the start in hours, like `*GET,...,ACTIVE,0,TIME,WALL`.
+        """
+        return (time.time()-self.tstart)/3600
+
+    def log(self, message):
+        if self.args['output']:
+            with open(self.args['output'], 'a') as f:
+                f.write(message + '\n')
+
+    def loop(self):
+        """
+        The monitor loop, it writes `ready.paransys` before the first reading.
+        """
+        with open('ready.paransys', 'w') as f:
+            f.write('PARANSYS_READY=1\n')
+        while True:
+            control = read_values('control.paransys')
+            if control.get('PARANSYS_GO', 0) >= 1:
+                self.solve(int(control.get('PARANSYS_RUNS', 0)))
+            elif control.get('PARANSYS_KILL', 0) >= 1:
+                if os.path.isfile('control.paransys'):
+                    os.remove('control.paransys')
+                return
+            time.sleep(self.wait)
+
+    def solve(self, runs):
+        """
+        Solve once, like the `*IF,PARANSYS_GO,GE,1` block of the monitor, a single set or a batch of them.
+        """
+        write_control(0, runs, 0, 0)
+        if os.path.isfile('par_out.paransys'):
+            os.remove('par_out.paransys')
+
+        tstart = time.time()
+        batch = read_values('batch.paransys')
+        nsets = int(batch.get('PARANSYS_NSETS', 0))
+        if nsets >= 1:
+            # Like the monitor, the batch size is read again after each set
+            n = int(batch.get('PARANSYS_FIRST', 1))
+            while n <= nsets:
+                write_parameters('set.paransys', {'PARANSYS_SET': n})
+                self.solve_set(f'par_in_{n}.paransys', f'par_out_{n}.paransys', {'PARANSYS_SET': n, 'PARANSYS_NSETS': nsets})
+                nsets = int(read_values('batch.paransys').get('PARANSYS_NSETS', 0))
+                n += 1
+        else:
+            self.solve_set('par_in.paransys', 'par_out.paransys', {})
+
+        control = read_values('control.paransys')
+        runs = int(control.get('PARANSYS_RUNS', runs)) + 1
+        self.log(f'PARANSYS mock solution {runs} with {max(nsets, 1)} sets in {time.time()-tstart:.3f} s.')
+        write_control(0, runs, 1, 0)
+
+    def solve_set(self, parinfile, paroutfile, monitor):
+        """
+        Solve a parameters set: /CLEAR, input parameters, main script, PARSAV and POST26.
+
+        Args:
+            parinfile (str): input parameters file.
+            paroutfile (str): output parameters file.
+            monitor (dict): monitor parameters that are read again after /CLEAR.
+        """
+        self.interpreter.clear()
+        self.interpreter.parameters.update(monitor)
+        tstart = time.time()
+        self.interpreter.parameters['PARANSYS_TSTART'] = self.wall()
+        if os.path.isfile(parinfile):
+            self.interpreter.run_file(parinfile)
+        parin = {name: value for name, value in self.interpreter.parameters.items() if not name.startswith('PARANSYS_')}
+        if os.path.isfile(self.main):
+            self.interpreter.run_file(self.main)
+
+        solvetime = self.interpreter.parameters.get('MOCK_TIME', self.args['time'])
+        solvetime *= (1-self.args['parallel']) + self.args['parallel']/max(self.args['nproc'], 1)
+        time.sleep(max(solvetime - (time.time()-tstart), 0))
+        if self.interpreter.parameters.get('MOCK_CRASH', 0):
+            self.log('PARANSYS mock solver crashed.')
+            os._exit(int(self.interpreter.parameters['MOCK_CRASH']))
+        self.interpreter.parameters['PARANSYS_TEND'] = self.wall()
+
+        self.parsav(paroutfile)
+        if os.path.isfile('rP26.paransys'):
+            self.post26(parin)
+
+    def parsav(self, fname):
+        """
+        Write all parameters like `PARSAV,ALL,fname`.
+        """
+        write_parameters(fname, self.interpreter.parameters)
+
+    def post26(self, parin):
+        """
+        Run `rP26.paransys`: export POST26 variables like the `P26EXP.paransys.mac` macro, and follow /RENAME and /DELETE.
+        """
+        with open('rP26.paransys', 'r') as f:
+            commands = [line.strip() for line in f if line.strip()]
+        steps = self.args['steps']
+        times = [(i+1)/steps for i in range(steps)]
+        scale = sum(parin.values())
+        for command in commands:
+            # %NAME% is replaced by the parameter value, like APDL
+            command = re.sub(r'%(\w+)%', lambda result: '{:g}'.format(self.interpreter.parameters.get(result.group(1).upper(), 0)), command)
+            args = [arg.strip() for arg in command.split(',')]
+            if args[0].upper() == 'P26EXP.PARANSYS':
+                var = int(args[1])
+                if var == 0:
+                    with open('P26_out.paransys', 'w') as f:
+                        f.write('!---PARANSYS---!\n')
+                    continue
+                values = times if var == 1 else [var*t*scale for t in times]
+                with open('P26_out.paransys', 'a') as f:
+                    f.write(f'*P26VAR={var}\n')
+                    for value in values:
+                        f.write((fixed_width(value) if self.fixed else '%G' % value) + '\n')
+                    f.write('*P26END\n')
+            elif args[0].upper() == '/RENAME':
+                os.replace(f'{args[1]}.{args[2]}', f'{args[4]}.{args[5]}')
+            elif args[0].upper() == '/DELETE':
+                if os.path.isfile(args[1]):
+                    os.remove(args[1])
+
+
+def main(argv):
+    args = parse_args(argv)
+    if args['input'] is None:
+        sys.exit('PARANSYS mock solver needs an input file (-i).')
+    args['input'] = os.path.abspath(args['input'])
+    if args['output']:
+        args['output'] = os.path.abspath(args['output'])
+    os.chdir(args['dir'])
+
+    time.sleep(args['start'])
+    lockfile = '{}.lock'.format(args['jobname'])
+    with open(lockfile, 'w') as f:
+        f.write(str(os.getpid()))
+    try:
+        solver = MockANSYS(args)
+        solver.log('PARANSYS mock solver started.')
+        solver.loop()
+        solver.log('PARANSYS mock solver closed.')
+    finally:
+        if os.path.isfile(lockfile):
+            os.remove(lockfile)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
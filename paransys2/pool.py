@@ -0,0 +1,306 @@
+"""
+A pool of ANSYS sessions to solve many parameters sets at the same time
+"""
+
+import os
+import math
+import queue
+import asyncio
+import threading
+import collections
+import concurrent.futures
+import paransys2.utils as utils
+from paransys2.ansys import ANSYS
+
+class ANSYSPool(ANSYS):
+    """
+    This class starts many ANSYS sessions, each one in it's own subfolder of `run_location`, and dispatches
+    the parameters sets to whichever session is idle.
+
+    It works like the `ANSYS` class, so `solve()` and `derivatives()` are also available here.
+
+    """
+
+    def __init__(self, workers=2, exec_loc=None, run_location=os.path.join('.', 'workingdir'), jobname='file', nproc=2, cleardir=False, add_flags=''):
+        """
+        Configure the pool of ANSYS sessions.
+
+        Args:
+            workers (int, optional): number of ANSYS sessions running at the same time. Defaults to 2.
+            exec_loc (str, optional): ANSYS executable location (like ANSYS194.exe). Defaults to None, then PARANSYS will try to find it.
+            run_location (str, optional): Folder where the sessions subfolders will be created. Defaults to 'workingdir' at current folder.
+            jobname (str, optional): ANSYS jobname. Defaults to 'file'.
+            nproc (int, optional): number of processor cores used by each session. Defaults to 2.
+            cleardir (bool, optional): clear all files in the working directory before running. Defaults to False.
+            add_flags (str, optional): additional ANSYS execution flags. Do not use `-b -i -o`. Defaults to ''.
+        """
+
+        super().__init__(exec_loc=exec_loc, run_location=run_location, jobname=jobname, nproc=nproc, cleardir=cleardir, add_flags=add_flags)
+
+        if workers < 1:
+            utils.messages.cerror(self, 'ANSYSPool needs at least one worker.')
+
+        # Each session works in it's own subfolder and shares the pool settings
+        self._sessions = []
+        for i in range(workers):
+            self._sessions.append(self._new_session(os.path.join(self._ANSYS['run_location'], 'worker{}'.format(i)), nproc))
+
+        # Idle sessions are taken from this queue
+        self._idle = queue.Queue()
+        for session in self._sessions:
+            self._idle.put(session)
+
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+        self._lock = threading.Lock()
+
+        # Idle sessions for the async methods, with it's event loop
+        self._aidle = None
+
+        utils.messages.cprint(self, f'ANSYSPool created with {workers} sessions.')
+
+
+    def _new_session(self, location, nproc):
+        """
+        (For internal use)
+        Create a session in it's own folder, sharing the pool settings, model, cache and timings.
+
+        Returns:
+            ANSYS: the new session.
+        """
+        os.makedirs(location, exist_ok=True)
+        session = ANSYS(exec_loc=self._ANSYS['exec_loc'], run_location=location, jobname=self._ANSYS['jobname'], nproc=nproc, cleardir=self._ANSYS['cleardir'], add_flags=self._ANSYS['add_flags'])
+        session._print = self._print
+        session._log = self._log
+        session._settings = self._settings
+        session._model = self._model
+        session._cache = self._cache
+        session._timings = self._timings
+        session._timing_callbacks = self._timing_callbacks
+        return session
+
+
+    def setAPDLmodel(self, main, extrafiles=[], location='.', solution=None, invariant=[]):
+        """
+        Sets APDL model script and other necessary files for all sessions. See `ANSYS.setAPDLmodel()`.
+
+        Args:
+            main (str): main APDL script (who will run), or the preprocessing script if `solution` is set.
+            extrafiles (list of strings, optional): list with files that will complete the model. Defaults to [].
+            location (str, optional): Folder where the main script and another files are. Defaults to '.' (current folder).
+            solution (str, optional): solution APDL script, it runs after `main` or after the saved preprocessing. Defaults to None.
+            invariant (list of strings, optional): parameters that don't change the preprocessing, used just with `solution`. Defaults to [].
+        """
+        super().setAPDLmodel(main, extrafiles=extrafiles, location=location, solution=solution, invariant=invariant)
+        for session in self._sessions:
+            session._model = self._model
+            session._staged = {}
+            session._prepkey = None
+
+
+    def setCache(self, location=os.path.join('.', 'paransys_cache'), maxsize=1024):
+        """
+        Enable a persistent cache of results shared by all sessions. See `ANSYS.setCache()`.
+
+        Args:
+            location (str, optional): Folder where results are saved. Set it as None to disable the cache. Defaults to 'paransys_cache' at current folder.
+            maxsize (float, optional): Maximum cache size in MB. Defaults to 1024.
+        """
+        super().setCache(location=location, maxsize=maxsize)
+        for session in self._sessions:
+            session._cache = self._cache
+
+
+    def setLogStream(self, enabled=True, callback=None):
+        """
+        Follow the ANSYS log of all sessions. See `ANSYS.setLogStream()`.
+
+        Args:
+            enabled (bool, optional): follow the logs or stop following them. Defaults to True.
+            callback (function, optional): called as `callback(worker, line)` for each line, where `worker` is the
+                session number. Defaults to None, then lines are printed.
+        """
+        for worker, session in enumerate(self._sessions):
+            if not enabled:
+                session.setLogStream(enabled=False)
+            elif callback is None:
+                session.setLogStream(callback=lambda line, worker=worker: utils.messages.cprint(self, f'   ANSYS {worker}| {line}'))
+            else:
+                session.setLogStream(callback=lambda line, worker=worker: callback(worker, line))
+
+
+    def process_status(self):
+        """
+        Status of the ANSYS process of each session. See `ANSYS.process_status()`.
+
+        Returns:
+            list of dicts: one by session.
+        """
+        return [session.process_status() for session in self._sessions]
+
+
+    def solve(self, P26vars=[], **parin):
+        """
+        Solve ANSYS model in the first idle session. See `ANSYS.solve()`.
+
+        Returns:
+            dict: An dictionary with all parameters values at the end of the analysis.
+            pandas.DataFrame: A pandas DataFrame with asked POST26 variables.
+        """
+        return self.solve_many([parin], P26vars=P26vars)[0]
+
+
+    def solve_batch(self, parins, P26vars=[], batchsize=None, failsafe=False, lookahead=None):
+        """
+        Solve many parameters sets in batches, dispatching each batch to an idle session. See `ANSYS.solve_batch()`.
+
+        Sets with different parameters names are split in different batches.
+
+        Args:
+            parins (iterable of dicts): parameters sets, each one like the `**parin` of `solve()`.
+            P26vars (list of integers, optional): POST26 variables numbers asked for all sets. Defaults to [].
+            batchsize (int, optional): maximum number of sets by batch. Defaults to None (the sets are split equally between sessions).
+            failsafe (bool, optional): if True a failed set doesn't stop the others. Defaults to False.
+            lookahead (int, optional): pipeline each batch, see `ANSYS.solve_batch()`. Defaults to None (not pipelined).
+
+        Returns:
+            list: A list with `(parout, p26df)` for each parameters set, in the same order of `parins`.
+        """
+        parins = list(parins)
+        if batchsize is None:
+            batchsize = max(math.ceil(len(parins)/len(self._sessions)), 1)
+
+        def task(batch):
+            session = self._idle.get()
+            try:
+                return session.solve_batch(batch, P26vars=P26vars, failsafe=failsafe, lookahead=lookahead)
+            finally:
+                self._idle.put(session)
+
+        batches = utils.anothers.batch_groups(parins, batchsize)
+        results = [None]*len(parins)
+        for indexes, batch in zip(batches, self._executor.map(task, [[parins[i] for i in indexes] for indexes in batches])):
+            for i, result in zip(indexes, batch):
+                results[i] = result
+        return results
+
+
+    def map(self, parins, P26vars=[], callback=None, failsafe=False, info=False):
+        """
+        Solve ANSYS model for a sequence of parameters sets using all sessions, yielding the results in the same order of `parins`.
+
+        Just a few sets are dispatched ahead of the returned results, so `parins` could be a long generator.
+
+        Args:
+            parins (iterable of dicts): parameters sets, each one like the `**parin` of `solve()`.
+            P26vars (list of integers, optional): POST26 variables numbers asked for all sets. Defaults to [].
+            callback (function, optional): function called as `callback(i, parout, p26df)` when the i-th set is solved.
+                The sets could finish out of order, but callbacks are called one at a time. Defaults to None.
+            failsafe (bool, optional): if True a failed set doesn't stop the others and returns `({'PARANSYS_ERROR': message, 'PARANSYS_STATUS': status}, None)`. Defaults to False.
+            info (bool, optional): if True it also yields a dictionary with `PARANSYS_RUNS`, `PARANSYS_TIME`, `PARANSYS_CACHED`, `PARANSYS_SOLVER_TIME` and the `PARANSYS_SESSION` folder. Defaults to False.
+
+        Yields:
+            tuple: `(parout, p26df)` for each parameters set, as returned by `solve()`, or `(parout, p26df, info)`.
+        """
+
+        def task(i, parin):
+            session = self._idle.get()
+            try:
+                parout, p26df, runinfo = session._solve_point(parin, P26vars, failsafe)
+            finally:
+                self._idle.put(session)
+            runinfo['PARANSYS_SESSION'] = session._ANSYS['run_location']
+            with self._lock:
+                if session._lasttiming is not None:
+                    self._lasttiming = session._lasttiming
+                if callback is not None:
+                    callback(i, parout, p26df)
+            return (parout, p26df, runinfo) if info else (parout, p26df)
+
+        window = 2*len(self._sessions)
+        pending = collections.deque()
+        for i, parin in enumerate(parins):
+            pending.append(self._executor.submit(task, i, parin))
+            if len(pending) >= window:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+    def _async_idle(self):
+        """
+        (For internal use)
+        Queue of idle sessions for the async methods. A new one is created for each event loop.
+
+        The async and the blocking methods take sessions from different queues, so don't use both at the same time.
+        """
+        loop = asyncio.get_running_loop()
+        if self._aidle is None or self._aidle[0] is not loop:
+            idle = asyncio.Queue()
+            for session in self._sessions:
+                idle.put_nowait(session)
+            self._aidle = (loop, idle)
+        return self._aidle[1]
+
+
+    async def solve_async(self, P26vars=[], **parin):
+        """
+        Coroutine version of `solve()`, solved by the first idle session. See `ANSYS.solve_async()`.
+
+        Returns:
+            dict: An dictionary with all parameters values at the end of the analysis.
+            pandas.DataFrame: A pandas DataFrame with asked POST26 variables.
+        """
+        return (await self.solve_many_async([parin], P26vars=P26vars))[0]
+
+
+    async def solve_many_async(self, parins, P26vars=[], callback=None, failsafe=False):
+        """
+        Coroutine version of `solve_many()`, the sets are overlapped in all sessions by `asyncio.gather()`.
+
+        Args:
+            parins (iterable of dicts): parameters sets, each one like the `**parin` of `solve()`.
+            P26vars (list of integers, optional): POST26 variables numbers asked for all sets. Defaults to [].
+            callback (function, optional): function called as `callback(i, parout, p26df)` when the i-th set is solved. Defaults to None.
+            failsafe (bool, optional): if True a failed set doesn't stop the others and returns `({'PARANSYS_ERROR': message, 'PARANSYS_STATUS': status}, None)`. Defaults to False.
+
+        Returns:
+            list: A list with `(parout, p26df)` for each parameters set, in the same order of `parins`.
+        """
+        idle = self._async_idle()
+
+        async def task(i, parin):
+            session = await idle.get()
+            try:
+                parout, p26df, _ = await session._solve_point_async(parin, P26vars, failsafe)
+            finally:
+                idle.put_nowait(session)
+            if session._lasttiming is not None:
+                self._lasttiming = session._lasttiming
+            if callback is not None:
+                callback(i, parout, p26df)
+            return parout, p26df
+
+        return list(await asyncio.gather(*[task(i, parin) for i, parin in enumerate(parins)]))
+
+
+    async def start_async(self):
+        """
+        Start all ANSYS sessions at the same time, without blocking the event loop.
+        """
+        await asyncio.gather(*[session.start_async() for session in self._sessions])
+
+
+    def exit(self):
+        """
+        Close all ANSYS sessions
+        """
+        utils.ansys.close_all(self._sessions)
+        self._executor.shutdown(wait=False)
+
+
+    async def exit_async(self):
+        """
+        Close all ANSYS sessions at the same time, without blocking the event loop
+        """
+        await asyncio.gather(*[session.exit_async() for session in self._sessions])
+        self._executor.shutdown(wait=False)
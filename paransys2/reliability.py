@@ -0,0 +1,561 @@
+"""
+Reliability analysis by Monte Carlo simulation
+"""
+
+import math
+import time
+import numpy
+import pandas
+import paransys2.utils as utils
+from paransys2.jacobian import Jacobian
+
+class Reliability:
+    """
+    This class keeps the random variables and the limit state function of a reliability analysis of an ANSYS model,
+    it's the base of `MonteCarlo` and `FORM`.
+
+    Variables are independent, with the distributions: `normal`, `lognormal`, `uniform`, `gumbel` (maximums) and
+    `constant`. The model fails when the limit state function is below or equal to zero.
+
+    """
+
+    def __init__(self, ansys):
+        """
+        Create a reliability analysis of an ANSYS model.
+
+        Args:
+            ansys (ANSYS or ANSYSPool): the session that solves the model, with it's APDL model already set.
+        """
+        self._print = ansys._print
+        self._log = ansys._log
+        self.ansys = ansys
+
+        # Variables {name: distribution parameters} and the limit state function
+        self._variables = {}
+        self._limitstate = None
+
+        # Results of the last analysis
+        self.history = None
+
+
+    def addVariable(self, name, distrib, mean=None, std=None, par1=None, par2=None):
+        """
+        Add a random variable (or a constant) to the model parameters.
+
+        Args:
+            name (str): parameter name.
+            distrib (str): 'normal', 'lognormal', 'uniform', 'gumbel' or 'constant'.
+            mean (float, optional): mean (or the value of a constant). Defaults to None.
+            std (float, optional): standard deviation. Defaults to None.
+            par1 (float, optional): lower limit of an uniform distribution, if mean and std aren't given. Defaults to None.
+            par2 (float, optional): upper limit of an uniform distribution, if mean and std aren't given. Defaults to None.
+        """
+        name = name.upper()
+        distrib = distrib.lower()
+        if distrib not in ['normal', 'lognormal', 'uniform', 'gumbel', 'constant']:
+            utils.messages.cerror(self, f'Distribution \"{distrib}\" of {name} isn\'t available.')
+
+        if distrib == 'constant':
+            if mean is None:
+                utils.messages.cerror(self, f'Constant {name} needs it\'s value as mean.')
+            variable = {'distrib': distrib, 'mean': mean, 'std': 0}
+        elif distrib == 'uniform' and mean is None:
+            if par1 is None or par2 is None or par2 <= par1:
+                utils.messages.cerror(self, f'Uniform {name} needs mean and std or the limits par1 < par2.')
+            variable = {'distrib': distrib, 'mean': (par1+par2)/2, 'std': (par2-par1)/math.sqrt(12), 'lower': par1, 'upper': par2}
+        else:
+            if mean is None or std is None or std <= 0:
+                utils.messages.cerror(self, f'Random variable {name} needs it\'s mean and a positive std.')
+            variable = {'distrib': distrib, 'mean': mean, 'std': std}
+            if distrib == 'uniform':
+                variable.update({'lower': mean-math.sqrt(3)*std, 'upper': mean+math.sqrt(3)*std})
+            elif distrib == 'lognormal':
+                if mean <= 0:
+                    utils.messages.cerror(self, f'Lognormal {name} needs a positive mean.')
+                zeta = math.sqrt(math.log(1 + (std/mean)**2))
+                variable.update({'zeta': zeta, 'lambda': math.log(mean) - zeta**2/2})
+            elif distrib == 'gumbel':
+                beta = std*math.sqrt(6)/math.pi
+                variable.update({'beta': beta, 'mode': mean - 0.5772156649015329*beta})
+
+        self._variables[name] = variable
+        utils.messages.cprint(self, f'Variable {name} set as {distrib} with mean {variable["mean"]} and std {variable["std"]}.')
+
+
+    def setLimitState(self, limitstate):
+        """
+        Set the limit state function, the model fails where it's <= 0.
+
+        Args:
+            limitstate (str or function): an expression with input and output parameters names, like 'FY - STRESS',
+                evaluated by `pandas.DataFrame.eval()`, or a function that receives a DataFrame with one row by
+                sample (input and output parameters as UPPER case columns) and returns the values of all rows.
+        """
+        if isinstance(limitstate, str):
+            limitstate = limitstate.upper()
+        self._limitstate = limitstate
+        utils.messages.cprint(self, f'Limit state function set as {limitstate}.')
+
+
+    @property
+    def random(self):
+        """
+        Names of the random variables, the constants aren't included.
+        """
+        return [name for name, variable in self._variables.items() if variable['distrib'] != 'constant']
+
+
+    def to_physical(self, U):
+        """
+        Transform points from the standard normal space to the variables distributions.
+
+        Args:
+            U (numpy.ndarray): points as rows, with a column by random variable (in the order of `random`).
+
+        Returns:
+            pandas.DataFrame: all parameters, including the constants.
+        """
+        X = {}
+        for k, name in enumerate(self.random):
+            variable = self._variables[name]
+            u = U[:, k]
+            if variable['distrib'] == 'normal':
+                X[name] = variable['mean'] + variable['std']*u
+            elif variable['distrib'] == 'lognormal':
+                X[name] = numpy.exp(variable['lambda'] + variable['zeta']*u)
+            elif variable['distrib'] == 'uniform':
+                X[name] = variable['lower'] + (variable['upper']-variable['lower'])*normal_cdf(u)
+            elif variable['distrib'] == 'gumbel':
+                X[name] = variable['mode'] - variable['beta']*numpy.log(-numpy.log(normal_cdf(u)))
+        for name, variable in self._variables.items():
+            if variable['distrib'] == 'constant':
+                X[name] = numpy.full(len(U), float(variable['mean']))
+        return pandas.DataFrame(X, columns=list(self._variables))
+
+
+    def to_standard(self, point):
+        """
+        Transform a point from the variables distributions to the standard normal space.
+
+        Args:
+            point (dict): values of the random variables.
+
+        Returns:
+            numpy.ndarray: the point in the standard normal space.
+        """
+        point = utils.anothers.to_upper(dict(point))
+        u = []
+        for name in self.random:
+            variable = self._variables[name]
+            x = point.get(name, variable['mean'])
+            if variable['distrib'] == 'normal':
+                u.append((x-variable['mean'])/variable['std'])
+            elif variable['distrib'] == 'lognormal':
+                u.append((math.log(x)-variable['lambda'])/variable['zeta'])
+            elif variable['distrib'] == 'uniform':
+                u.append(float(normal_ppf((x-variable['lower'])/(variable['upper']-variable['lower']))))
+            elif variable['distrib'] == 'gumbel':
+                u.append(float(normal_ppf(math.exp(-math.exp(-(x-variable['mode'])/variable['beta'])))))
+        return numpy.array(u, dtype=float)
+
+
+    def dxdu(self, U):
+        """
+        Derivatives of the random variables with respect to their standard normal variables.
+
+        Args:
+            U (numpy.ndarray): points as rows, with a column by random variable (in the order of `random`).
+
+        Returns:
+            numpy.ndarray: `dx/du` of each variable at each point.
+        """
+        U = numpy.atleast_2d(U)
+        X = self.to_physical(U)
+        D = numpy.empty_like(U, dtype=float)
+        for k, name in enumerate(self.random):
+            variable = self._variables[name]
+            u = U[:, k]
+            if variable['distrib'] == 'normal':
+                D[:, k] = variable['std']
+            elif variable['distrib'] == 'lognormal':
+                D[:, k] = variable['zeta']*X[name].to_numpy()
+            elif variable['distrib'] == 'uniform':
+                D[:, k] = (variable['upper']-variable['lower'])*normal_pdf(u)
+            elif variable['distrib'] == 'gumbel':
+                cdf = normal_cdf(u)
+                D[:, k] = variable['beta']*normal_pdf(u)/(cdf*-numpy.log(cdf))
+        return D
+
+
+    def _evaluate(self, batch):
+        """
+        (For internal use)
+        Limit state function at each sample.
+        """
+        if isinstance(self._limitstate, str):
+            return numpy.asarray(batch.eval(self._limitstate), dtype=float)
+        return numpy.asarray(self._limitstate(batch), dtype=float)
+
+
+
+class MonteCarlo(Reliability):
+    """
+    This class evaluates the failure probability of an ANSYS model with random parameters by Monte Carlo simulation.
+
+    Samples are created in the standard normal space for all variables at once and transformed to each distribution,
+    they are solved in batches (in parallel with an `ANSYSPool`) and the failure probability is updated after each
+    batch, so the simulation stops as soon as it's coefficient of variation reaches the target.
+
+    Sampling methods:
+
+        `mc`:  crude Monte Carlo.
+        `lhs`: Latin hypercube, each batch is a Latin hypercube of it's size.
+        `is`:  importance sampling, centered at a point (like the design point of a FORM analysis).
+
+    """
+
+    def __init__(self, ansys):
+        """
+        Create a simulation for an ANSYS model.
+
+        Args:
+            ansys (ANSYS or ANSYSPool): the session that solves the model, with it's APDL model already set.
+        """
+        super().__init__(ansys)
+        self.samples = None
+
+
+    def sample(self, n, method='mc', center=None, rng=None):
+        """
+        Create samples in the standard normal space.
+
+        Args:
+            n (int): number of samples.
+            method (str, optional): 'mc', 'lhs' or 'is'. Defaults to 'mc'.
+            center (numpy.ndarray, optional): importance sampling center in the standard normal space. Defaults to None.
+            rng (numpy.random.Generator, optional): random generator. Defaults to None.
+
+        Returns:
+            numpy.ndarray: the samples as rows.
+            numpy.ndarray: the weight of each sample (1 for 'mc' and 'lhs').
+        """
+        rng = numpy.random.default_rng() if rng is None else rng
+        nvars = len(self.random)
+        if method == 'mc':
+            return rng.standard_normal((n, nvars)), numpy.ones(n)
+        elif method == 'lhs':
+            P = (numpy.argsort(rng.random((n, nvars)), axis=0) + rng.random((n, nvars)))/n
+            return normal_ppf(P), numpy.ones(n)
+        elif method == 'is':
+            U = center + rng.standard_normal((n, nvars))
+            # Ratio between the standard normal and the shifted sampling densities
+            return U, numpy.exp(-U @ center + center @ center/2)
+        utils.messages.cerror(self, f'Sampling method \"{method}\" isn\'t available, use \"mc\", \"lhs\" or \"is\".')
+
+
+    def run(self, method='mc', cvtarget=0.05, maxsolves=10000, batchsize=100, minfailures=1, center=None, P26vars=[], usebatch=False, seed=None):
+        """
+        Run the simulation until the coefficient of variation of the failure probability reaches `cvtarget`.
+
+        Args:
+            method (str, optional): sampling method, 'mc', 'lhs' or 'is'. Defaults to 'mc'.
+            cvtarget (float, optional): target coefficient of variation of the failure probability. Defaults to 0.05.
+            maxsolves (int, optional): maximum number of ANSYS solutions. Defaults to 10000.
+            batchsize (int, optional): samples solved before each update. Defaults to 100.
+            minfailures (int, optional): failures needed before stopping, so a lucky start doesn't stop it. Defaults to 1.
+            center (dict, optional): importance sampling center, like the design point, with the random variables values. Defaults to None.
+            P26vars (list of integers, optional): POST26 variables asked, they are kept just by a results store/cache. Defaults to [].
+            usebatch (bool, optional): send each batch by `solve_batch()` (one monitor run signal by batch) instead of `solve_many()`. Defaults to False.
+            seed (int, optional): random generator seed. Defaults to None.
+
+        Returns:
+            dict: with the failure probability `pf`, it's coefficient of variation `cov`, the reliability index `beta`,
+                the number of `solves`, `failures` and `errors` (solutions that failed and were ignored).
+        """
+        if self._limitstate is None:
+            utils.messages.cerror(self, 'The limit state function isn\'t set, use setLimitState().')
+        if not self.random:
+            utils.messages.cerror(self, 'There isn\'t any random variable, use addVariable().')
+        if method == 'is':
+            if center is None:
+                utils.messages.cerror(self, 'Importance sampling needs a center, like the design point.')
+            center = self.to_standard(center)
+
+        tstart = time.time()
+        rng = numpy.random.default_rng(seed)
+        utils.messages.cprint(self, f'Running a Monte Carlo simulation ({method}) up to {maxsolves} solutions, target CoV of {cvtarget}.')
+
+        # Incremental sums of the estimator
+        solves, errors, failures = 0, 0, 0
+        sumw, sumw2 = 0.0, 0.0
+        frames, history = [], []
+        pf, cov = 0.0, numpy.inf
+        while solves < maxsolves:
+            n = min(batchsize, maxsolves-solves)
+            U, weights = self.sample(n, method, center, rng)
+            X = self.to_physical(U)
+            parins = X.to_dict('records')
+            if usebatch:
+                results = self.ansys.solve_batch(parins, P26vars=P26vars, failsafe=True)
+            else:
+                results = self.ansys.solve_many(parins, P26vars=P26vars, failsafe=True)
+
+            rows = []
+            for parin, (parout, _) in zip(parins, results):
+                row = utils.anothers.to_upper(dict(parout))
+                row.update(parin)
+                rows.append(row)
+            batch = pandas.DataFrame(rows)
+            ok = ~batch['PARANSYS_ERROR'].notna().to_numpy() if 'PARANSYS_ERROR' in batch.columns else numpy.ones(n, dtype=bool)
+            batch['PARANSYS_OK'] = ok
+            batch['WEIGHT'] = weights
+
+            g = numpy.full(n, numpy.nan)
+            if ok.any():
+                g[ok] = self._evaluate(batch[ok])
+            batch['G'] = g
+            failed = ok & (g <= 0)
+            batch['FAILED'] = failed
+            frames.append(batch)
+
+            # Failed solutions aren't samples
+            solves += n
+            errors += int((~ok).sum())
+            failures += int(failed.sum())
+            sumw += float(weights[failed].sum())
+            sumw2 += float((weights[failed]**2).sum())
+            pf, cov = estimate(sumw, sumw2, solves-errors)
+
+            history.append({'SOLVES': solves, 'FAILURES': failures, 'ERRORS': errors, 'PF': pf, 'COV': cov, 'BETA': beta(pf)})
+            utils.messages.cprint(self, '   {} solutions, pf = {:.4e}, CoV = {:.4f}.'.format(solves, pf, cov))
+            if failures >= minfailures and cov <= cvtarget:
+                break
+
+        self.samples = pandas.concat(frames, ignore_index=True)
+        self.history = pandas.DataFrame(history)
+        if errors > 0:
+            utils.messages.cprint(self, f'** {errors} solutions failed, they were ignored.')
+        utils.messages.cprint(self, 'Monte Carlo simulation finished in {:.3f} minutes: pf = {:.4e}, CoV = {:.4f}, beta = {:.4f}.'.format((time.time()-tstart)/60, pf, cov, beta(pf)))
+        return {'pf': pf, 'cov': cov, 'beta': beta(pf), 'solves': solves, 'failures': failures, 'errors': errors}
+
+
+class FORM(Reliability):
+    """
+    This class evaluates the reliability index of an ANSYS model by the First Order Reliability Method,
+    searching the design point with the HLRF algorithm in the standard normal space.
+
+    The gradient of the limit state function is evaluated by finite differences: the current point and all
+    perturbations are solved at once (in parallel with an `ANSYSPool`), so each iteration takes the time of one
+    solution. With `broyden=True` the gradient is just updated by Broyden's method between full finite difference
+    passes, then an iteration needs just one solution. A full pass is also done when the updates stop improving
+    the step or when they stop moving before the limit state is reached.
+
+    """
+
+    def _gradient(self, parin, dh, method):
+        """
+        (For internal use)
+        Limit state function and it's gradient with respect to the random variables by finite differences.
+
+        Returns:
+            Jacobian: derivatives of `G`, with it's value at `values`.
+            int: number of solutions.
+        """
+        plan = self.ansys._deriv_stencil(dh, method, self.random, [], parin)
+        points = [point for _, point in plan['stencil']]
+        if plan['central']:
+            # The limit state function is also needed at the current point
+            points = [plan['parin']] + points
+        results = self._solve(points)
+        plan['base'] = results[0][0]
+        return self.ansys._deriv_combine(plan, results[1:], ['G'], True), len(points)
+
+
+    def _solve(self, points):
+        """
+        (For internal use)
+        Solve points and evaluate the limit state function at them, as the output `G`.
+
+        Returns:
+            list: `(parout, p26df)` of each point, with `G` at `parout`.
+        """
+        results = self.ansys.solve_many(points)
+        rows = []
+        for point, (parout, _) in zip(points, results):
+            row = utils.anothers.to_upper(dict(parout))
+            row.update(point)
+            rows.append(row)
+        for (parout, _), g in zip(results, self._evaluate(pandas.DataFrame(rows))):
+            parout['G'] = float(g)
+        return results
+
+
+    def run(self, dh=0.01, method='forward', tolerance=1e-3, maxiter=30, broyden=False, refresh=5, start=None):
+        """
+        Search the design point.
+
+        Args:
+            dh (float, optional): relative step size of the finite differences, like `derivatives()`. Defaults to 0.01.
+            method (str, optional): finite difference method, 'forward', 'backward' or 'central'. Defaults to 'forward'.
+            tolerance (float, optional): it stops when the step in the standard normal space and the limit state
+                function (relative to it's first value) are below it. Defaults to 1e-3.
+            maxiter (int, optional): maximum number of iterations. Defaults to 30.
+            broyden (bool, optional): update the gradient by Broyden's method between full finite difference passes. Defaults to False.
+            refresh (int, optional): iterations between full finite difference passes, when `broyden=True`. Defaults to 5.
+            start (dict, optional): starting point, with the random variables values. Defaults to None, the variables means.
+
+        Returns:
+            dict: with the reliability index `beta`, the failure probability `pf`, the `design_point` (all parameters),
+                the direction cosines `alpha` of the random variables, the number of `iterations` and `solves`, and
+                if it `converged`.
+        """
+        if self._limitstate is None:
+            utils.messages.cerror(self, 'The limit state function isn\'t set, use setLimitState().')
+        if not self.random:
+            utils.messages.cerror(self, 'There isn\'t any random variable, use addVariable().')
+        if maxiter < 1:
+            utils.messages.cerror(self, 'FORM needs at least one iteration (maxiter >= 1).')
+
+        tstart = time.time()
+        names = self.random
+        if start is None:
+            start = {name: self._variables[name]['mean'] for name in names}
+        u = self.to_standard(start)
+        utils.messages.cprint(self, 'Running FORM (HLRF) with {} gradients.'.format('Broyden updated' if broyden else 'finite difference'))
+
+        gradient, g0, solves, history = None, None, 0, []
+        converged, stalled = False, False
+        for iteration in range(1, maxiter+1):
+            parin = self.to_physical(u.reshape(1, -1)).iloc[0].to_dict()
+            # Broyden's updates are replaced by a full pass periodically or when they stop improving
+            full = gradient is None or not broyden or stalled or (iteration-1) % refresh == 0
+            # The gradient is kept in the standard normal space, where Broyden's updates aren't biased by the variables scales
+            point = dict(zip(names, u.tolist()))
+            if full:
+                gradient, n = self._gradient(parin, dh, method)
+                gradient = Jacobian(gradient.gradient('G')*self.dxdu(u)[0], ['G'], names, point, gradient.values)
+            else:
+                parout, _ = self._solve([parin])[0]
+                gradient, n = gradient.broyden(point, {'G': parout['G']}), 1
+            solves += n
+
+            g = gradient.values['G']
+            g0 = g if g0 is None else g0
+            gradu = gradient.gradient('G')
+            norm = numpy.linalg.norm(gradu)
+            if norm == 0:
+                utils.messages.cerror(self, 'The limit state function gradient is null, FORM can\'t go on.')
+
+            # HLRF step
+            unew = (gradu @ u - g)/norm**2*gradu
+            alpha = -gradu/norm
+            index = float(alpha @ unew)
+            step = numpy.linalg.norm(unew-u)
+            stalled = bool(history) and step >= history[-1]['STEP']
+            history.append({'ITERATION': iteration, 'BETA': index, 'G': g, 'STEP': step, 'SOLVES': solves, 'GRADIENT': 'full' if full else 'broyden'})
+            utils.messages.cprint(self, '   Iteration {}: beta = {:.5f}, G = {:.5g}, step = {:.3e}.'.format(iteration, index, g, step))
+            u = unew
+            if step < tolerance and abs(g) <= tolerance*max(abs(g0), 1e-300):
+                converged = True
+                break
+            # An updated gradient that stops moving before G converges needs a full pass
+            stalled = stalled or (not full and step < tolerance)
+
+        self.history = pandas.DataFrame(history)
+        if not converged:
+            utils.messages.cprint(self, f'** FORM didn\'t converge in {maxiter} iterations.')
+        pf = float(normal_cdf(-index))
+        utils.messages.cprint(self, 'FORM finished in {:.3f} minutes with {} solutions: beta = {:.5f}, pf = {:.4e}.'.format((time.time()-tstart)/60, solves, index, pf))
+        return {
+            'beta': index,
+            'pf': pf,
+            'design_point': self.to_physical(u.reshape(1, -1)).iloc[0].to_dict(),
+            'alpha': dict(zip(names, alpha.tolist())),
+            'iterations': iteration,
+            'solves': solves,
+            'converged': converged
+        }
+
+
+def estimate(sumw, sumw2, n):
+    """
+    Failure probability and it's coefficient of variation from the sums of the failed samples weights.
+
+    Args:
+        sumw (float): sum of the weights of failed samples (their number, without importance sampling).
+        sumw2 (float): sum of the squared weights of failed samples.
+        n (int): number of samples.
+
+    Returns:
+        float: failure probability.
+        float: coefficient of variation, infinite while there isn't any failure.
+    """
+    if n == 0:
+        return 0.0, numpy.inf
+    pf = sumw/n
+    if pf <= 0:
+        return 0.0, numpy.inf
+    variance = max(sumw2/n - pf**2, 0)/n
+    return pf, math.sqrt(variance)/pf
+
+
+def beta(pf):
+    """
+    Reliability index of a failure probability, `-normal_ppf(pf)`.
+    """
+    if pf <= 0:
+        return numpy.inf
+    if pf >= 1:
+        return -numpy.inf
+    return -float(normal_ppf(pf))
+
+
+_erfc = numpy.frompyfunc(math.erfc, 1, 1)
+
+def normal_pdf(u):
+    """
+    Standard normal probability density function.
+    """
+    u = numpy.asarray(u, dtype=float)
+    return numpy.exp(-u*u/2)/math.sqrt(2*math.pi)
+
+
+def normal_cdf(u):
+    """
+    Standard normal cumulative distribution function.
+    """
+    return 0.5*numpy.asarray(_erfc(-numpy.asarray(u, dtype=float)/math.sqrt(2)), dtype=float)
+
+
+# Coefficients of Acklam's inverse normal approximation
+_a = [-3.969683028665376e+01, 2.209460984245205e+02, -2.759285104469687e+02, 1.383577518672690e+02, -3.066479806614716e+01, 2.506628277459239e+00]
+_b = [-5.447609879822406e+01, 1.615858368580409e+02, -1.556989798598866e+02, 6.680131188771972e+01, -1.328068155288572e+01]
+_c = [-7.784894002430293e-03, -3.223964580411365e-01, -2.400758277161838e+00, -2.549732539343734e+00, 4.374664141464968e+00, 2.938163982698783e+00]
+_d = [7.784695709041462e-03, 3.224671290700398e-01, 2.445134137142996e+00, 3.754408661907416e+00]
+
+def normal_ppf(p):
+    """
+    Inverse of the standard normal cumulative distribution function, by Acklam's approximation refined
+    with one Halley step (relative error near the machine precision).
+    """
+    p = numpy.asarray(p, dtype=float)
+    x = numpy.empty_like(p)
+    low = p < 0.02425
+    high = p > 1-0.02425
+    mid = ~(low | high)
+
+    q = p[mid]-0.5
+    r = q*q
+    x[mid] = (((((_a[0]*r+_a[1])*r+_a[2])*r+_a[3])*r+_a[4])*r+_a[5])*q/(((((_b[0]*r+_b[1])*r+_b[2])*r+_b[3])*r+_b[4])*r+1)
+    for side, values in [(1, p[low]), (-1, 1-p[high])]:
+        q = numpy.sqrt(-2*numpy.log(values))
+        tail = side*(((((_c[0]*q+_c[1])*q+_c[2])*q+_c[3])*q+_c[4])*q+_c[5])/((((_d[0]*q+_d[1])*q+_d[2])*q+_d[3])*q+1)
+        x[low if side == 1 else high] = tail
+
+    # Halley refinement
+    with numpy.errstate(over='ignore', invalid='ignore'):
+        e = normal_cdf(x) - p
+        u = e*math.sqrt(2*math.pi)*numpy.exp(x*x/2)
+        refined = x - u/(1 + x*u/2)
+    x = numpy.where(numpy.isfinite(refined), refined, x)
+    return x
@@ -0,0 +1,515 @@
+"""
+Scheduling of ANSYS sessions by processor cores and license tokens
+"""
+
+import os
+import math
+import time
+import asyncio
+import itertools
+import functools
+import threading
+import collections
+import concurrent.futures
+import pandas
+import paransys2.utils as utils
+from paransys2.ansys import ANSYS
+from paransys2.pool import ANSYSPool
+
+class Scheduler(ANSYSPool):
+    """
+    This class solves parameters sets in many ANSYS sessions, like `ANSYSPool`, but the number of sessions and the
+    cores of each one (it's `-np`) are decided for each set by the machine cores and a budget of license tokens.
+
+    Each set has a cost hint, it's relative solution time (see `setCost()`), and it gets a share of the cores
+    proportional to it among the sets solved at the same time. So a long queue of light sets runs in many one core
+    sessions, while a few heavy sets get more cores each and the last set of the queue gets all free cores. A set
+    waits for the cores of it's share while much lighter sets are running, instead of starting with just the free
+    ones, and the busy cores never go above `cores`. An idle session is started again with another `-np` just
+    when it's needed.
+
+    ANSYS keeps it's licenses while it's open, so the tokens of idle sessions are counted too and an idle session
+    is closed when it's tokens are needed by another one.
+
+    Each decision is kept, see `schedule()` and `schedule_stats()`.
+
+    """
+
+    def __init__(self, cores=None, tokens=None, tokencost=None, maxsessions=None, exec_loc=None, run_location=os.path.join('.', 'workingdir'), jobname='file', cleardir=False, add_flags=''):
+        """
+        Configure the scheduler, sessions are created when they are needed.
+
+        Args:
+            cores (int, optional): processor cores used at the same time. Defaults to None, all cores of the machine.
+            tokens (int, optional): license tokens budget. Defaults to None (unlimited).
+            tokencost (function, optional): license tokens of a session with `nproc` cores, as `tokencost(nproc)`.
+                Defaults to None, then `default_tokencost()` is used.
+            maxsessions (int, optional): maximum number of sessions at the same time. Defaults to None (limited by cores and tokens).
+            exec_loc (str, optional): ANSYS executable location (like ANSYS194.exe). Defaults to None, then PARANSYS will try to find it.
+            run_location (str, optional): Folder where the sessions subfolders will be created. Defaults to 'workingdir' at current folder.
+            jobname (str, optional): ANSYS jobname. Defaults to 'file'.
+            cleardir (bool, optional): clear all files in the working directory before running. Defaults to False.
+            add_flags (str, optional): additional ANSYS execution flags. Do not use `-b -i -o -np`. Defaults to ''.
+        """
+
+        ANSYS.__init__(self, exec_loc=exec_loc, run_location=run_location, jobname=jobname, nproc=1, cleardir=cleardir, add_flags=add_flags)
+
+        self.cores = cores or os.cpu_count() or 1
+        self.tokens = tokens
+        self.tokencost = tokencost if tokencost is not None else default_tokencost
+        self.maxsessions = maxsessions
+        if self.tokens is not None and self.tokencost(1) > self.tokens:
+            utils.messages.cerror(self, f'The license tokens budget ({self.tokens}) isn\'t enough for a single session.')
+
+        # Sessions are created when needed, the running ones are kept with their jobs
+        self._sessions = []
+        self._running = {}
+        self._cost = None
+        self._logsettings = (False, None)
+
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=self._limit())
+        self._lock = threading.RLock()
+        self._changed = threading.Condition(self._lock)
+        self._aidle = None
+
+        # Decisions and resources usage
+        self._history = []
+        self._usage = {'tlast': None, 'coreseconds': 0.0, 'maxcores': 0, 'maxtokens': 0}
+
+        tokens = 'unlimited' if self.tokens is None else self.tokens
+        utils.messages.cprint(self, f'Scheduler created with {self.cores} cores and {tokens} license tokens.')
+
+
+    def setCost(self, function=None):
+        """
+        Set the cost hint of each parameters set, it's solution time relative to the others (only the ratios matter).
+
+        Args:
+            function (function, optional): called as `function(parin)` returning the cost. Defaults to None, all sets cost 1.
+        """
+        self._cost = function
+
+
+    def setLogStream(self, enabled=True, callback=None):
+        """
+        Follow the ANSYS log of all sessions, also the ones created later. See `ANSYSPool.setLogStream()`.
+
+        Args:
+            enabled (bool, optional): follow the logs or stop following them. Defaults to True.
+            callback (function, optional): called as `callback(worker, line)` for each line, where `worker` is the
+                session number. Defaults to None, then lines are printed.
+        """
+        self._logsettings = (enabled, callback)
+        super().setLogStream(enabled=enabled, callback=callback)
+
+
+    def map(self, parins, P26vars=[], callback=None, failsafe=False, info=False, costs=None):
+        """
+        Solve ANSYS model for a sequence of parameters sets, yielding the results in the same order of `parins`.
+
+        Just a few sets are dispatched ahead of the returned results, so `parins` could be a long generator.
+
+        Args:
+            parins (iterable of dicts): parameters sets, each one like the `**parin` of `solve()`.
+            P26vars (list of integers, optional): POST26 variables numbers asked for all sets. Defaults to [].
+            callback (function, optional): function called as `callback(i, parout, p26df)` when the i-th set is solved.
+                The sets could finish out of order, but callbacks are called one at a time. Defaults to None.
+            failsafe (bool, optional): if True a failed set doesn't stop the others and returns `({'PARANSYS_ERROR': message, 'PARANSYS_STATUS': status}, None)`. Defaults to False.
+            info (bool, optional): if True it also yields a dictionary with `PARANSYS_RUNS`, `PARANSYS_TIME`, `PARANSYS_CACHED`, `PARANSYS_SOLVER_TIME`, the `PARANSYS_SESSION` folder and it's `PARANSYS_NPROC`. Defaults to False.
+            costs (iterable of floats, optional): cost hint of each set. Defaults to None, then the function of `setCost()` is used.
+
+        Yields:
+            tuple: `(parout, p26df)` for each parameters set, as returned by `solve()`, or `(parout, p26df, info)`.
+        """
+
+        def task(session, i, parin):
+            parout, p26df, runinfo = session._solve_point(parin, P26vars, failsafe)
+            runinfo['PARANSYS_SESSION'] = session._ANSYS['run_location']
+            runinfo['PARANSYS_NPROC'] = session._ANSYS['nproc']
+            with self._lock:
+                if session._lasttiming is not None:
+                    self._lasttiming = session._lasttiming
+                if callback is not None:
+                    callback(i, parout, p26df)
+            return (parout, p26df, runinfo) if info else (parout, p26df)
+
+        parins = iter(parins)
+        costs = itertools.repeat(None) if costs is None else iter(costs)
+        jobs = ((self._job_cost(parin, cost), functools.partial(task, i=i, parin=parin)) for i, (parin, cost) in enumerate(zip(parins, costs)))
+        return self._dispatch(jobs)
+
+
+    def solve_many(self, parins, P26vars=[], callback=None, failsafe=False, costs=None):
+        """
+        Solve ANSYS model for a list of parameters sets. It is the same as `list(map(...))`.
+
+        Returns:
+            list: A list with `(parout, p26df)` for each parameters set, in the same order of `parins`.
+        """
+        return list(self.map(parins, P26vars=P26vars, callback=callback, failsafe=failsafe, costs=costs))
+
+
+    def solve_batch(self, parins, P26vars=[], batchsize=None, failsafe=False, lookahead=None, costs=None):
+        """
+        Solve many parameters sets in batches, each batch is scheduled as one job with the sum of it's sets costs. See `ANSYS.solve_batch()`.
+
+        Sets with different parameters names are split in different batches.
+
+        Args:
+            parins (iterable of dicts): parameters sets, each one like the `**parin` of `solve()`.
+            P26vars (list of integers, optional): POST26 variables numbers asked for all sets. Defaults to [].
+            batchsize (int, optional): maximum number of sets by batch. Defaults to None (the sets are split equally between the sessions that could run at the same time).
+            failsafe (bool, optional): if True a failed set doesn't stop the others. Defaults to False.
+            lookahead (int, optional): pipeline each batch, see `ANSYS.solve_batch()`. Defaults to None (not pipelined).
+            costs (iterable of floats, optional): cost hint of each set. Defaults to None, then the function of `setCost()` is used.
+
+        Returns:
+            list: A list with `(parout, p26df)` for each parameters set, in the same order of `parins`.
+        """
+        parins = list(parins)
+        costs = [None]*len(parins) if costs is None else list(costs)
+        costs = [self._job_cost(parin, cost) for parin, cost in zip(parins, costs)]
+        if batchsize is None:
+            batchsize = max(math.ceil(len(parins)/self._limit()), 1)
+
+        def task(session, batch):
+            return session.solve_batch(batch, P26vars=P26vars, failsafe=failsafe, lookahead=lookahead)
+
+        batches = utils.anothers.batch_groups(parins, batchsize)
+        jobs = ((sum(costs[i] for i in indexes), functools.partial(task, batch=[parins[i] for i in indexes])) for indexes in batches)
+        results = [None]*len(parins)
+        for indexes, batch in zip(batches, self._dispatch(jobs)):
+            for i, result in zip(indexes, batch):
+                results[i] = result
+        return results
+
+
+    async def solve_many_async(self, parins, P26vars=[], callback=None, failsafe=False, costs=None):
+        """
+        Coroutine version of `solve_many()`, the sets are scheduled by a thread without blocking the event loop.
+
+        Returns:
+            list: A list with `(parout, p26df)` for each parameters set, in the same order of `parins`.
+        """
+        loop = asyncio.get_running_loop()
+        costs = None if costs is None else list(costs)
+        return await loop.run_in_executor(None, functools.partial(self.solve_many, list(parins), P26vars=P26vars, callback=callback, failsafe=failsafe, costs=costs))
+
+
+    def schedule(self):
+        """
+        Decisions of the scheduler, one row by job (a parameters set, or a batch of them).
+
+        Columns: `COST` (hint), `NPROC` (cores given), `SESSION` (session number), `STARTED` (the session was started,
+        or started again with another `-np`, for the job), `CORES` and `TOKENS` (busy cores and tokens in use after
+        it was dispatched), `WAIT` (seconds in the queue) and `TIME` (seconds solving, None while it runs).
+
+        Returns:
+            pandas.DataFrame: the decisions, in the dispatch order.
+        """
+        with self._lock:
+            rows = [dict(record) for record in self._history]
+        columns = ['COST', 'NPROC', 'SESSION', 'STARTED', 'CORES', 'TOKENS', 'WAIT', 'TIME']
+        return pandas.DataFrame(rows, columns=['JOB']+columns).set_index('JOB')
+
+
+    def schedule_stats(self, reset=False):
+        """
+        Summary of the scheduler decisions.
+
+        Args:
+            reset (bool, optional): forget the decisions after the summary. Defaults to False.
+
+        Returns:
+            dict: `jobs`, `points_per_hour` (finished jobs by hour, from the first dispatch to the last end),
+                `core_usage` (mean fraction of `cores` busy), `max_cores` and `max_tokens` (peaks in use),
+                `sessions` (created), `starts` (sessions started or started again) and `nproc` (`{nproc: jobs}`).
+        """
+        with self._lock:
+            self._account()
+            history = [dict(record) for record in self._history]
+            usage = dict(self._usage)
+            if reset:
+                self._history = []
+                self._usage = {'tlast': None, 'coreseconds': 0.0, 'maxcores': 0, 'maxtokens': 0}
+
+        finished = [record for record in history if record['TIME'] is not None]
+        if history:
+            elapsed = max([record['TEND'] for record in finished], default=time.time()) - min(record['TSTART'] for record in history)
+        else:
+            elapsed = 0
+        return {
+            'jobs': len(finished),
+            'points_per_hour': 3600*len(finished)/elapsed if elapsed > 0 else None,
+            'core_usage': usage['coreseconds']/(elapsed*self.cores) if elapsed > 0 else None,
+            'max_cores': usage['maxcores'],
+            'max_tokens': usage['maxtokens'],
+            'sessions': len(self._sessions),
+            'starts': sum(record['STARTED'] for record in history),
+            'nproc': dict(collections.Counter(record['NPROC'] for record in history))
+        }
+
+
+    def _job_cost(self, parin, cost=None):
+        """
+        (For internal use)
+        Cost hint of a parameters set.
+        """
+        if cost is None:
+            cost = 1.0 if self._cost is None else self._cost(parin)
+        if cost <= 0:
+            utils.messages.cerror(self, f'The cost hint must be positive, not {cost}.')
+        return float(cost)
+
+
+    def _limit(self):
+        """
+        (For internal use)
+        Maximum number of sessions solving at the same time, each one with at least one core and the tokens of one core.
+        """
+        limit = self.cores
+        if self.maxsessions is not None:
+            limit = min(limit, self.maxsessions)
+        if self.tokens is not None:
+            limit = min(limit, self.tokens//self.tokencost(1))
+        return max(limit, 1)
+
+
+    def _dispatch(self, jobs):
+        """
+        (For internal use)
+        Run jobs `(cost, function)`, each one as `function(session)` when the scheduler finds cores and tokens for it.
+
+        Yields:
+            the result of each job, in the jobs order.
+        """
+        jobs = iter(jobs)
+        window = 2*self._limit()
+        upcoming = collections.deque()
+        pending = collections.deque()
+        exhausted = False
+        while True:
+            while not exhausted and len(upcoming)+len(pending) < window:
+                try:
+                    cost, function = next(jobs)
+                except StopIteration:
+                    exhausted = True
+                    break
+                upcoming.append((cost, function, time.time()))
+
+            with self._changed:
+                while upcoming:
+                    decision = self._decide(upcoming, exhausted)
+                    if decision is None:
+                        break
+                    session, nproc = decision
+                    cost, function, tqueued = upcoming.popleft()
+                    record = self._begin(session, nproc, cost, tqueued)
+                    future = self._executor.submit(self._run, session, function, record)
+                    future.add_done_callback(self._notify)
+                    pending.append(future)
+
+                if not pending and not upcoming:
+                    return
+                if not pending or not pending[0].done():
+                    # Wait for a job to finish
+                    self._changed.wait(1.0)
+                    continue
+
+            yield pending.popleft().result()
+
+
+    def _decide(self, upcoming, exhausted):
+        """
+        (For internal use)
+        Cores and session for the next job, with the lock held.
+
+        The job gets a share of `cores` proportional to it's cost among the running jobs and the next ones that
+        could run with them, limited by the free cores and tokens. A job without it's share free waits while
+        jobs at least twice lighter are running, they free their cores soon.
+
+        Returns:
+            tuple: `(session, nproc)`, or None if the job must wait.
+        """
+        free = self.cores - sum(record['NPROC'] for record in self._running.values())
+        limit = self._limit()
+        if free < 1 or len(self._running) >= limit:
+            return None
+
+        cost = upcoming[0][0]
+        wave = sum(record['COST'] for record in self._running.values())
+        wave += sum(job[0] for job in itertools.islice(upcoming, limit-len(self._running)))
+        share = max(int(self.cores*cost/wave), 1)
+        if exhausted and len(upcoming) == 1:
+            share = max(share, free)
+        lighter = sum(record['NPROC'] for record in self._running.values() if 2*record['COST'] <= cost)
+        if share > free and lighter > 0:
+            return None
+        nproc = min(share, free)
+
+        # Less cores if the tokens aren't enough
+        while nproc >= 1:
+            session = self._session_for(nproc)
+            if session is not None:
+                return session, nproc
+            nproc -= 1
+        return None
+
+
+    def _session_for(self, nproc):
+        """
+        (For internal use)
+        An idle session with `nproc` cores, closing idle sessions when their tokens are needed, or a new one.
+
+        Returns:
+            ANSYS: the session, or None if the tokens aren't enough.
+        """
+        idle = [session for session in self._sessions if session not in self._running]
+        for session in idle:
+            if session._ANSYS['nproc'] == nproc and _is_open(session):
+                return session
+
+        # Idle sessions with other -np are closed while the tokens are missing
+        others = [session for session in idle if _is_open(session)]
+        while self.tokens is not None and self._tokens_in_use() + self.tokencost(nproc) > self.tokens and others:
+            self._close(others.pop())
+        if self.tokens is not None and self._tokens_in_use() + self.tokencost(nproc) > self.tokens:
+            return None
+
+        # A closed session, a new one or the last idle one started again
+        closed = [session for session in idle if not _is_open(session)]
+        if closed:
+            session = closed[0]
+        elif len(self._sessions) < self._limit():
+            session = self._new_session(os.path.join(self._ANSYS['run_location'], 'session{}'.format(len(self._sessions))), nproc)
+            self._follow_log(session, len(self._sessions))
+            self._sessions.append(session)
+        elif others:
+            session = others.pop()
+            self._close(session)
+        else:
+            return None
+        session._ANSYS['nproc'] = nproc
+        return session
+
+
+    def _tokens_in_use(self):
+        """
+        (For internal use)
+        License tokens of the open or running sessions.
+        """
+        return sum(self.tokencost(session._ANSYS['nproc']) for session in self._sessions if session in self._running or _is_open(session))
+
+
+    def _close(self, session):
+        """
+        (For internal use)
+        Close an idle session, releasing it's license.
+        """
+        utils.messages.cprint(self, 'Closing the session with {} cores at {}.'.format(session._ANSYS['nproc'], session._ANSYS['run_location']))
+        session.exit()
+
+
+    def _follow_log(self, session, worker):
+        """
+        (For internal use)
+        Follow the log of a new session if `setLogStream()` is enabled.
+        """
+        enabled, callback = self._logsettings
+        if not enabled:
+            return
+        if callback is None:
+            session.setLogStream(callback=lambda line: utils.messages.cprint(self, f'   ANSYS {worker}| {line}'))
+        else:
+            session.setLogStream(callback=lambda line: callback(worker, line))
+
+
+    def _begin(self, session, nproc, cost, tqueued):
+        """
+        (For internal use)
+        Keep a dispatched job, with the lock held.
+
+        Returns:
+            dict: the job record.
+        """
+        self._account()
+        tstart = time.time()
+        record = {
+            'JOB': len(self._history),
+            'COST': cost,
+            'NPROC': nproc,
+            'SESSION': self._sessions.index(session),
+            'STARTED': not _is_open(session),
+            'CORES': None,
+            'TOKENS': None,
+            'WAIT': tstart-tqueued,
+            'TIME': None,
+            'TSTART': tstart,
+            'TEND': None
+        }
+        self._running[session] = record
+        record['CORES'] = sum(running['NPROC'] for running in self._running.values())
+        record['TOKENS'] = self._tokens_in_use()
+        self._usage['maxcores'] = max(self._usage['maxcores'], record['CORES'])
+        self._usage['maxtokens'] = max(self._usage['maxtokens'], record['TOKENS'])
+        self._history.append(record)
+        return record
+
+
+    def _run(self, session, function, record):
+        """
+        (For internal use)
+        Run a job in a thread of the executor, releasing it's cores at the end.
+        """
+        try:
+            return function(session)
+        finally:
+            with self._changed:
+                self._account()
+                record['TEND'] = time.time()
+                record['TIME'] = record['TEND']-record['TSTART']
+                del self._running[session]
+
+
+    def _notify(self, future):
+        """
+        (For internal use)
+        Wake up the dispatcher when a job is finished.
+        """
+        with self._changed:
+            self._changed.notify_all()
+
+
+    def _account(self):
+        """
+        (For internal use)
+        Add the busy cores since the last change to the cores usage, with the lock held.
+        """
+        now = time.time()
+        if self._usage['tlast'] is not None:
+            busy = sum(record['NPROC'] for record in self._running.values())
+            self._usage['coreseconds'] += busy*(now-self._usage['tlast'])
+        self._usage['tlast'] = now
+
+
+
+def default_tokencost(nproc):
+    """
+    License tokens of a session: one solver license, plus one HPC token by core above the 4 cores included with it.
+    Use your own function at `Scheduler(tokencost=...)` if your licenses work in another way.
+
+    Args:
+        nproc (int): session cores.
+
+    Returns:
+        int: tokens.
+    """
+    return 1 + max(nproc-4, 0)
+
+
+def _is_open(session):
+    """
+    (For internal use)
+    The session ANSYS process is running.
+    """
+    return session._process is not None and session._process.poll() is None
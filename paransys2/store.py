@@ -0,0 +1,192 @@
+"""
+An on-disk store of results for long sweeps
+"""
+
+import os
+import re
+import csv
+import threading
+import pandas
+import paransys2.utils as utils
+
+class ResultStore:
+    """
+    This class appends each solved point to CSV chunk files, so a long sweep isn't lost if Python dies
+    and it could be resumed skipping the points already solved.
+
+    Each point is a row with it's `POINT` number, a `PARANSYS_KEY` (hash of the input parameters and POST26 variables),
+    the input and output parameters, `PARANSYS_RUNS`, `PARANSYS_TIME`, `PARANSYS_CACHED`, `PARANSYS_SOLVER_TIME`, `PARANSYS_OK`, `PARANSYS_ERROR` and `PARANSYS_STATUS`.
+    POST26 variables are saved in long format at other chunk files.
+
+    Rows are written (and flushed) as soon as they arrive, nothing is kept in memory but the keys of solved points.
+
+    """
+
+    def __init__(self, location=os.path.join('.', 'paransys_store'), chunksize=1000):
+        """
+        Open (or create) a store folder.
+
+        Args:
+            location (str, optional): Folder where results are saved. Defaults to 'paransys_store' at current folder.
+            chunksize (int, optional): Maximum number of points in each chunk file. Defaults to 1000.
+        """
+        os.makedirs(location, exist_ok=True)
+        self.location = location
+        self.chunksize = chunksize
+        self._lock = threading.Lock()
+
+        # Current chunk
+        self._file = None
+        self._writer = None
+        self._header = None
+        self._rows = 0
+        self._p26file = None
+
+        # Keys of solved points from old chunks, new chunks are numbered after the last one (even with gaps)
+        self._keys = set()
+        self._nchunks = max([number+1 for kind in ['results', 'post26'] for number, _ in self._chunks(kind, numbers=True)], default=0)
+        for fname in self._chunks('results'):
+            try:
+                keys = pandas.read_csv(fname, usecols=['PARANSYS_KEY', 'PARANSYS_OK'])
+            except (ValueError, pandas.errors.EmptyDataError):
+                continue
+            self._keys.update(keys['PARANSYS_KEY'][keys['PARANSYS_OK'] == True].dropna())
+
+
+    def _chunks(self, kind, numbers=False):
+        """
+        (For internal use)
+        List chunk files of a kind ('results' or 'post26') in order, or `(number, file)` with `numbers`.
+        """
+        patt = re.compile(r'{}_([0-9]+)\.csv$'.format(kind))
+        chunks = []
+        for entry in os.scandir(self.location):
+            result = patt.match(entry.name)
+            if result:
+                chunks.append((int(result.group(1)), entry.path))
+        chunks.sort()
+        return chunks if numbers else [path for _, path in chunks]
+
+
+    def key(self, parin, P26vars=[]):
+        """
+        Key of a point, see `utils_anothers.parin_key()`.
+        """
+        return utils.anothers.parin_key(parin, P26vars)
+
+
+    def __contains__(self, key):
+        return key in self._keys
+
+
+    def __len__(self):
+        return len(self._keys)
+
+
+    def _newchunk(self, header):
+        """
+        (For internal use)
+        Close the current chunk and open a new one with this header.
+        """
+        self._close()
+        fname = os.path.join(self.location, 'results_{:05d}.csv'.format(self._nchunks))
+        p26fname = os.path.join(self.location, 'post26_{:05d}.csv'.format(self._nchunks))
+        self._nchunks += 1
+        self._file = open(fname, 'w', newline='')
+        self._writer = csv.DictWriter(self._file, fieldnames=header, extrasaction='ignore')
+        self._writer.writeheader()
+        self._header = header
+        self._rows = 0
+        self._p26fname = p26fname
+
+
+    def append(self, point, parin, parout, info, p26df=None, P26vars=[]):
+        """
+        Append a solved point.
+
+        Args:
+            point: point number (or index) in the sweep.
+            parin (dict): input parameters.
+            parout (dict): output parameters, or `{'PARANSYS_ERROR': message, 'PARANSYS_STATUS': status}` if it failed.
+            info (dict): run information from `map(..., info=True)`.
+            p26df (pandas.DataFrame, optional): POST26 variables. Defaults to None.
+            P26vars (list of integers, optional): POST26 variables numbers asked. Defaults to [].
+        """
+        key = self.key(parin, P26vars)
+        row = {'POINT': point, 'PARANSYS_KEY': key}
+        row.update(utils.anothers.to_upper(parin))
+        row.update(parout)
+        row.update(info)
+        row['PARANSYS_OK'] = 'PARANSYS_ERROR' not in parout
+        row.setdefault('PARANSYS_ERROR', '')
+        row.setdefault('PARANSYS_STATUS', 'ok')
+
+        with self._lock:
+            # A new chunk when it's full or when this point has new columns
+            if self._file is None or self._rows >= self.chunksize or not set(row) <= set(self._header):
+                self._newchunk(list(row))
+            self._writer.writerow(row)
+            self._file.flush()
+            self._rows += 1
+
+            if p26df is not None and len(p26df) > 0:
+                p26long = p26df.reset_index().melt(id_vars='Time', var_name='VARIABLE', value_name='VALUE')
+                p26long.insert(0, 'PARANSYS_KEY', key)
+                p26long.insert(0, 'POINT', point)
+                if self._p26file is None:
+                    self._p26file = open(self._p26fname, 'w', newline='')
+                    p26long.to_csv(self._p26file, index=False)
+                else:
+                    p26long.to_csv(self._p26file, index=False, header=False)
+                self._p26file.flush()
+
+            if row['PARANSYS_OK']:
+                self._keys.add(key)
+
+
+    def _close(self):
+        """
+        (For internal use)
+        Close the current chunk files.
+        """
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if self._p26file is not None:
+            self._p26file.close()
+            self._p26file = None
+
+
+    def close(self):
+        """
+        Close the store files. It could be appended again after it.
+        """
+        with self._lock:
+            self._close()
+
+
+    def read(self):
+        """
+        Read all saved points. If a point was saved more than once (like a failed point in a resumed sweep) just the last one is kept.
+
+        Returns:
+            pandas.DataFrame: one row by point, sorted by `POINT`.
+        """
+        frames = [pandas.read_csv(fname) for fname in self._chunks('results') if os.path.getsize(fname) > 0]
+        if not frames:
+            return pandas.DataFrame()
+        results = pandas.concat(frames, ignore_index=True).drop_duplicates(['POINT', 'PARANSYS_KEY'], keep='last')
+        return results.sort_values('POINT', kind='stable').reset_index(drop=True)
+
+
+    def read_post26(self):
+        """
+        Read all saved POST26 variables.
+
+        Returns:
+            pandas.DataFrame: in long format, with columns `POINT`, `PARANSYS_KEY`, `Time`, `VARIABLE` and `VALUE`.
+        """
+        frames = [pandas.read_csv(fname) for fname in self._chunks('post26') if os.path.getsize(fname) > 0]
+        if not frames:
+            return pandas.DataFrame(columns=['POINT', 'PARANSYS_KEY', 'Time', 'VARIABLE', 'VALUE'])
+        return pandas.concat(frames, ignore_index=True)
@@ -0,0 +1,522 @@
+"""
+Surrogate models fitted to ANSYS results
+"""
+
+import copy
+import time
+import numpy
+import pandas
+import paransys2.utils as utils
+
+class Surrogate:
+    """
+    This class fits a cheap model (a surrogate) to input/output pairs of `solve()`, so outputs can be predicted
+    for thousands of points without ANSYS.
+
+    Two kinds are available:
+
+        `kriging`: ordinary Kriging (a Gaussian process) with a Gaussian correlation and one length scale by input,
+                   fitted by maximum likelihood. It's standard deviation is the Kriging prediction error.
+        `rbf`:     cubic radial basis functions with a linear tail. It hasn't a statistical error, so it's standard
+                   deviation is the leave-one-out error, growing with the distance to the nearest sample.
+
+    Inputs are scaled to [0, 1] by their bounds and each output is standardized, so parameters with very different
+    magnitudes are handled together. Each output has it's own model, fitted to the samples where it exists.
+
+    """
+
+    def __init__(self, inputs, outputs, kind='kriging', bounds=None, nugget=1e-10):
+        """
+        Create an empty surrogate.
+
+        Args:
+            inputs (list of strings): input parameters names.
+            outputs (list of strings): output parameters names.
+            kind (str, optional): 'kriging' or 'rbf'. Defaults to 'kriging'.
+            bounds (dict, optional): `{input: (lower, upper)}` used to scale the inputs and to sample infill candidates.
+                Defaults to None, then the sampled bounds are used.
+            nugget (float, optional): value added to the correlation matrix diagonal of Kriging, it's increased
+                when the samples are too close. Defaults to 1e-10.
+        """
+        self._print = True
+        self._log = False
+
+        if kind not in ['kriging', 'rbf']:
+            utils.messages.cerror(self, f'Surrogate kind must be \"kriging\" or \"rbf\", not \"{kind}\".')
+
+        self.inputs = utils.anothers.to_upper(list(inputs))
+        self.outputs = utils.anothers.to_upper(list(outputs))
+        self.kind = kind
+        self.bounds = None if bounds is None else {name.upper(): tuple(bounds[name]) for name in bounds}
+        self.nugget = nugget
+
+        # Samples as rows of inputs and outputs
+        self._rows = []
+
+        # Scales and fitted model of each output
+        self._scale = None
+        self._models = {}
+
+
+    def __len__(self):
+        return len(self._rows)
+
+
+    @property
+    def samples(self):
+        """
+        All samples, one by row, without repeated inputs (the last one is kept).
+
+        Returns:
+            pandas.DataFrame: with the inputs and outputs columns.
+        """
+        samples = pandas.DataFrame(self._rows, columns=self.inputs+self.outputs, dtype=float)
+        return samples.drop_duplicates(self.inputs, keep='last').reset_index(drop=True)
+
+
+    def add(self, parin, parout):
+        """
+        Add a sample. Failed solutions (with `PARANSYS_ERROR`) and samples without all inputs are ignored.
+
+        Args:
+            parin (dict): input parameters.
+            parout (dict): output parameters, like the ones returned by `solve()`.
+
+        Returns:
+            bool: True if it was added.
+        """
+        values = utils.anothers.to_upper(dict(parin))
+        values.update(utils.anothers.to_upper(dict(parout)))
+        error = values.get('PARANSYS_ERROR')
+        if (isinstance(error, str) and error) or any(values.get(name) is None for name in self.inputs):
+            return False
+        self._rows.append([values.get(name, numpy.nan) for name in self.inputs+self.outputs])
+        return True
+
+
+    def add_results(self, results):
+        """
+        Add many samples.
+
+        Args:
+            results (pandas.DataFrame or iterable of tuples): a DataFrame like the ones of `run_doe()` and `ResultStore.read()`,
+                where rows with `PARANSYS_OK=False` are ignored, or `(parin, parout)` pairs.
+
+        Returns:
+            int: number of samples added.
+        """
+        added = 0
+        if isinstance(results, pandas.DataFrame):
+            if 'PARANSYS_OK' in results.columns:
+                results = results[results['PARANSYS_OK'].astype(bool)]
+            for _, parin in utils.anothers.doe_points(self, results):
+                added += self.add(parin, {})
+        else:
+            for parin, parout in results:
+                added += self.add(parin, parout)
+        return added
+
+
+    def add_cache(self, cache, model=None):
+        """
+        Add all results of a `ResultCache`, the `solve()` history.
+
+        A cache could keep results of other models (or older versions of the same model), if `model` is given just
+        results of it are added.
+
+        Args:
+            cache (ResultCache or ANSYS): the cache, or an ANSYS session, then it's cache and model are used.
+            model (dict, optional): APDL model as in `ANSYS._model`. Defaults to None.
+
+        Returns:
+            int: number of samples added.
+        """
+        if hasattr(cache, '_cache'):
+            cache, model = cache._cache, cache._model
+        if cache is None:
+            utils.messages.cerror(self, 'The ANSYS session hasn\'t a results cache, enable it with setCache().')
+
+        added = 0
+        for key, parin, parout, p26df in cache.entries():
+            if parin is None:
+                continue
+            if model is not None:
+                # The POST26 variables asked aren't saved, they are found from the exported ones
+                p26vars = [] if p26df is None else [int(var) for var in p26df.columns]
+                if key not in [cache.key(model, parin, vars) for vars in [p26vars, [1]+p26vars]]:
+                    continue
+            added += self.add(parin, parout)
+        return added
+
+
+    def fit(self):
+        """
+        Fit the surrogate to all samples. Kriging length scales are found by maximum likelihood.
+
+        Returns:
+            Surrogate: itself, so `Surrogate(...).add_results(...)` could be followed by `.fit().predict(...)`.
+        """
+        tstart = time.time()
+        samples = self.samples
+        if len(samples) == 0:
+            utils.messages.cerror(self, 'The surrogate hasn\'t any sample.')
+
+        X = samples[self.inputs].to_numpy()
+        if self.bounds is None:
+            lower, upper = X.min(axis=0), X.max(axis=0)
+        else:
+            lower = numpy.array([self.bounds[name][0] for name in self.inputs], dtype=float)
+            upper = numpy.array([self.bounds[name][1] for name in self.inputs], dtype=float)
+        span = numpy.where(upper > lower, upper-lower, 1.0)
+        self._scale = {'lower': lower, 'span': span}
+        Xs = (X-lower)/span
+
+        self._models = {}
+        for name in self.outputs:
+            y = samples[name].to_numpy()
+            valid = numpy.isfinite(y)
+            if valid.sum() < 2:
+                utils.messages.cprint(self, f'** Output {name} has less than 2 samples, it isn\'t fitted.')
+                continue
+            self._models[name] = self._fit_output(Xs[valid], y[valid])
+
+        utils.messages.cprint(self, 'Surrogate ({}) fitted to {} samples in {:.3f} s.'.format(self.kind, len(samples), time.time()-tstart))
+        return self
+
+
+    def _fit_output(self, X, y, theta=None):
+        """
+        (For internal use)
+        Fit the model of one output to scaled inputs. Kriging length scales are optimized if `theta` isn't given.
+
+        Returns:
+            dict: the fitted model.
+        """
+        ymean, ystd = y.mean(), y.std()
+        ystd = ystd if ystd > 0 else 1.0
+        ys = (y-ymean)/ystd
+
+        if self.kind == 'kriging':
+            if theta is None:
+                theta = self._kriging_theta(X, ys)
+            model = self._kriging(X, ys, theta)
+        else:
+            model = self._rbf(X, ys)
+
+        model.update({'X': X, 'y': y, 'ymean': ymean, 'ystd': ystd})
+        return model
+
+
+    # Kriging
+
+    def _cholesky(self, R):
+        """
+        (For internal use)
+        Cholesky factor of a correlation matrix, the nugget is increased until it's positive definite.
+
+        Returns:
+            numpy.ndarray: the lower factor, or None if it couldn't be found.
+        """
+        nugget = self.nugget
+        identity = numpy.eye(len(R))
+        while nugget < 1e-2:
+            try:
+                return numpy.linalg.cholesky(R + nugget*identity)
+            except numpy.linalg.LinAlgError:
+                nugget *= 10
+        return None
+
+
+    def _kriging(self, X, y, theta):
+        """
+        (For internal use)
+        Ordinary Kriging with fixed length scales.
+
+        Returns:
+            dict: the model, with it's concentrated log-likelihood at `likelihood` (-inf if it failed).
+        """
+        n = len(X)
+        L = self._cholesky(correlation(X, X, theta))
+        if L is None:
+            return {'likelihood': -numpy.inf}
+        ones = numpy.linalg.solve(L, numpy.ones(n))
+        ly = numpy.linalg.solve(L, y)
+        mu = (ones @ ly)/(ones @ ones)
+        residual = ly - mu*ones
+        sigma2 = max((residual @ residual)/n, 1e-300)
+        likelihood = -0.5*(n*numpy.log(sigma2) + 2*numpy.log(numpy.diag(L)).sum())
+        return {
+            'theta': theta, 'L': L, 'ones': ones, 'oneRone': ones @ ones, 'mu': mu, 'sigma2': sigma2,
+            'alpha': numpy.linalg.solve(L.T, residual), 'likelihood': likelihood
+        }
+
+
+    def _kriging_theta(self, X, y):
+        """
+        (For internal use)
+        Length scales (as log10 of theta) with maximum likelihood: the best isotropic value of a coarse grid is
+        refined for each input by a pattern search.
+
+        Returns:
+            numpy.ndarray: theta of each input.
+        """
+        ninputs = X.shape[1]
+        best, logtheta = -numpy.inf, numpy.zeros(ninputs)
+        for value in numpy.linspace(-2, 2, 9):
+            likelihood = self._kriging(X, y, 10**numpy.full(ninputs, value))['likelihood']
+            if likelihood > best:
+                best, logtheta = likelihood, numpy.full(ninputs, value)
+
+        step = 0.5
+        while step >= 0.05:
+            improved = False
+            for k in range(ninputs):
+                for direction in [1, -1]:
+                    trial = logtheta.copy()
+                    trial[k] = numpy.clip(trial[k] + direction*step, -3, 3)
+                    likelihood = self._kriging(X, y, 10**trial)['likelihood']
+                    if likelihood > best:
+                        best, logtheta, improved = likelihood, trial, True
+                        break
+            if not improved:
+                step /= 2
+        return 10**logtheta
+
+
+    # Radial basis functions
+
+    def _rbf(self, X, y):
+        """
+        (For internal use)
+        Cubic radial basis functions with a linear tail, and their leave-one-out error.
+
+        Returns:
+            dict: the model.
+        """
+        n, ninputs = X.shape
+        P = numpy.hstack([numpy.ones((n, 1)), X])
+        A = numpy.zeros((n+ninputs+1, n+ninputs+1))
+        A[:n, :n] = numpy.sqrt(sqdistance(X, X))**3
+        A[:n, n:] = P
+        A[n:, :n] = P.T
+        Ainv = numpy.linalg.pinv(A)
+        weights = Ainv @ numpy.concatenate([y, numpy.zeros(ninputs+1)])
+
+        # Leave-one-out errors without refitting (Rippa), and the mean distance between neighbours
+        loo = weights[:n]/numpy.where(numpy.abs(numpy.diag(Ainv)[:n]) > 0, numpy.diag(Ainv)[:n], numpy.inf)
+        distance = sqdistance(X, X)
+        numpy.fill_diagonal(distance, numpy.inf)
+        spacing = numpy.sqrt(distance.min(axis=1)).mean() if n > 1 else 1.0
+        return {'weights': weights, 'loo': numpy.sqrt(numpy.mean(loo**2)), 'spacing': spacing if spacing > 0 else 1.0}
+
+
+    # Predictions
+
+    def _scaled(self, points):
+        """
+        (For internal use)
+        Scaled inputs of some points.
+
+        Returns:
+            numpy.ndarray: points as rows.
+            bool: it was just one point given as a 1-D array or a dict.
+        """
+        if self._scale is None:
+            utils.messages.cerror(self, 'The surrogate isn\'t fitted, use fit() before it.')
+        single = False
+        if isinstance(points, dict):
+            points, single = [points], True
+        if isinstance(points, pandas.DataFrame) or (isinstance(points, list) and points and isinstance(points[0], dict)):
+            X = numpy.array([[parin[name] for name in self.inputs] for _, parin in utils.anothers.doe_points(self, points)], dtype=float)
+        else:
+            X = numpy.asarray(points, dtype=float)
+            if X.ndim == 1:
+                X, single = X.reshape(1, -1), True
+            if X.shape[1] != len(self.inputs):
+                utils.messages.cerror(self, f'Points need {len(self.inputs)} columns, one by input: {self.inputs}.')
+        return (X-self._scale['lower'])/self._scale['span'], single
+
+
+    def _predict_output(self, model, X):
+        """
+        (For internal use)
+        Standardized mean and standard deviation of one output at scaled points.
+        """
+        if self.kind == 'kriging':
+            r = correlation(X, model['X'], model['theta'])
+            mean = model['mu'] + r @ model['alpha']
+            v = numpy.linalg.solve(model['L'], r.T)
+            u = 1 - model['ones'] @ v
+            mse = model['sigma2']*(1 - (v**2).sum(axis=0) + u**2/model['oneRone'])
+            std = numpy.sqrt(numpy.clip(mse, 0, None))
+        else:
+            n = len(model['X'])
+            distance = sqdistance(X, model['X'])
+            P = numpy.hstack([numpy.ones((len(X), 1)), X])
+            mean = numpy.sqrt(distance)**3 @ model['weights'][:n] + P @ model['weights'][n:]
+            std = model['loo']*numpy.sqrt(distance.min(axis=1))/model['spacing']
+        return mean, std
+
+
+    def predict(self, points, chunksize=10000):
+        """
+        Predict the outputs at many points at once.
+
+        Args:
+            points (numpy.ndarray, pandas.DataFrame, dict or list of dicts): points as rows with the inputs in the same
+                order of `inputs`, or with the inputs names. A 1-D array (or a dict) is just one point.
+            chunksize (int, optional): points evaluated together, it limits the memory used. Defaults to 10000.
+
+        Returns:
+            numpy.ndarray: mean of each output (one column by output, in the same order of `outputs`).
+            numpy.ndarray: standard deviation (error estimate) of each output.
+        """
+        X, single = self._scaled(points)
+        mean = numpy.full((len(X), len(self.outputs)), numpy.nan)
+        std = numpy.full((len(X), len(self.outputs)), numpy.nan)
+        for j, name in enumerate(self.outputs):
+            model = self._models.get(name)
+            if model is None:
+                continue
+            for k in range(0, len(X), chunksize):
+                m, s = self._predict_output(model, X[k:k+chunksize])
+                mean[k:k+chunksize, j] = model['ymean'] + m*model['ystd']
+                std[k:k+chunksize, j] = s*model['ystd']
+        if single:
+            return mean[0], std[0]
+        return mean, std
+
+
+    # Adaptive infill
+
+    def _believe(self, X):
+        """
+        (For internal use)
+        A copy of the surrogate that takes it's own predictions at scaled points as samples, without new length scales.
+        Kriging errors just depend on the samples locations, so it's how a batch of infill points is spread.
+        """
+        believer = copy.copy(self)
+        believer._models = {}
+        for name, model in self._models.items():
+            mean, _ = self._predict_output(model, X)
+            y = numpy.concatenate([model['y'], model['ymean'] + model['ystd']*mean])
+            believer._models[name] = self._fit_output(numpy.vstack([model['X'], X]), y, model.get('theta'))
+        return believer
+
+
+    def candidates(self, n, seed=None):
+        """
+        Random points (a Latin hypercube) inside the bounds.
+
+        Args:
+            n (int): number of points.
+            seed (int, optional): random generator seed. Defaults to None.
+
+        Returns:
+            numpy.ndarray: points as rows.
+        """
+        if self._scale is None:
+            utils.messages.cerror(self, 'The surrogate isn\'t fitted, use fit() before it.')
+        rng = numpy.random.default_rng(seed)
+        ninputs = len(self.inputs)
+        U = (numpy.argsort(rng.random((n, ninputs)), axis=0) + rng.random((n, ninputs)))/n
+        return self._scale['lower'] + U*self._scale['span']
+
+
+    def infill(self, ansys, candidates=1000, maxsolves=20, tolerance=0.01, batch=1, fixed={}, seed=None):
+        """
+        Improve the surrogate solving ANSYS just where it's uncertain.
+
+        At each step the candidates with the biggest standard deviation (relative to each output standard deviation)
+        are solved by `ansys.solve_many()` and the surrogate is fitted again. With `batch` > 1 the points of a step are
+        spread by taking the surrogate predictions as samples, and with an `ANSYSPool` they are solved in parallel.
+        It stops when all relative errors are below `tolerance` or after `maxsolves` solutions.
+
+        Args:
+            ansys (ANSYS or ANSYSPool): the session that solves the model.
+            candidates (int, numpy.ndarray or pandas.DataFrame, optional): infill candidates, or the number of random
+                candidates created inside the bounds. Defaults to 1000.
+            maxsolves (int, optional): maximum number of ANSYS solutions. Defaults to 20.
+            tolerance (float, optional): relative standard deviation where it stops. Defaults to 0.01.
+            batch (int, optional): points solved at each step. Defaults to 1.
+            fixed (dict, optional): other parameters, with the same value for all solutions. Defaults to {}.
+            seed (int, optional): random generator seed of the candidates. Defaults to None.
+
+        Returns:
+            pandas.DataFrame: the solved points, with the inputs, outputs and the relative error before solving them.
+        """
+        tstart = time.time()
+        if self._scale is None:
+            self.fit()
+        if isinstance(candidates, int):
+            candidates = self.candidates(candidates, seed)
+        X, _ = self._scaled(candidates)
+        X = numpy.unique(X, axis=0)
+        original = X*self._scale['span'] + self._scale['lower']
+
+        utils.messages.cprint(self, f'Surrogate infill with {len(X)} candidates, up to {maxsolves} solutions.')
+        solved = []
+        while len(solved) < maxsolves and len(X) > 0:
+            # Next points, spread by believing the surrogate
+            believer, chosen, errors = self, [], []
+            for _ in range(min(batch, maxsolves-len(solved), len(X))):
+                error = numpy.zeros(len(X))
+                for name, model in believer._models.items():
+                    error = numpy.maximum(error, believer._predict_output(model, X)[1])
+                if chosen:
+                    error[chosen] = -1
+                best = int(numpy.argmax(error))
+                if error[best] <= tolerance:
+                    break
+                chosen.append(best)
+                errors.append(error[best])
+                if len(chosen) < batch:
+                    believer = believer._believe(X[[best]])
+
+            if not chosen:
+                utils.messages.cprint(self, f'   All relative errors are below {tolerance}.')
+                break
+
+            parins = []
+            for index in chosen:
+                parin = dict(fixed)
+                parin.update(zip(self.inputs, original[index].tolist()))
+                parins.append(parin)
+            for parin, error, (parout, _) in zip(parins, errors, ansys.solve_many(parins, failsafe=True)):
+                self.add(parin, parout)
+                row = utils.anothers.to_upper(dict(parin))
+                row.update({name: parout.get(name, numpy.nan) for name in self.outputs})
+                row['PARANSYS_ERROR'] = parout.get('PARANSYS_ERROR')
+                row['SURROGATE_ERROR'] = error
+                solved.append(row)
+
+            keep = numpy.ones(len(X), dtype=bool)
+            keep[chosen] = False
+            X, original = X[keep], original[keep]
+            self.fit()
+            utils.messages.cprint(self, '   {} solutions, biggest relative error was {:.4g}.'.format(len(solved), max(errors)))
+
+        utils.messages.cprint(self, 'Surrogate infill finished in {:.3f} minutes with {} solutions.'.format((time.time()-tstart)/60, len(solved)))
+        return pandas.DataFrame(solved)
+
+
+def sqdistance(A, B):
+    """
+    Squared distances between the rows of two matrices.
+
+    Returns:
+        numpy.ndarray: with `len(A)` rows and `len(B)` columns.
+    """
+    distance = (A**2).sum(axis=1)[:, None] + (B**2).sum(axis=1)[None, :] - 2*(A @ B.T)
+    return numpy.clip(distance, 0, None)
+
+
+def correlation(A, B, theta):
+    """
+    Gaussian correlation `exp(-sum(theta*(a-b)**2))` between the rows of two matrices.
+
+    Returns:
+        numpy.ndarray: with `len(A)` rows and `len(B)` columns.
+    """
+    scale = numpy.sqrt(theta)
+    return numpy.exp(-sqdistance(A*scale, B*scale))
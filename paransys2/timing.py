@@ -0,0 +1,173 @@
+"""
+Timing of each phase of a solution
+"""
+
+import time
+import threading
+import collections
+import contextlib
+import numpy
+import pandas
+
+class SolveTimer:
+    """
+    This class keeps the time spent at each phase of one `solve()`.
+
+    Phases are timed as spans (a phase could have more than one span, like `write`, they are summed):
+
+        `cache`: looking for the result at the cache and saving it there.
+        `start`: starting ANSYS, just when it wasn't running.
+        `write`: writing input parameters, POST26 requests and the run signal.
+        `stage`: staging the model files at `run_location`.
+        `wait`:  waiting for ANSYS, it's the solver time plus the monitor latency.
+        `read`:  reading output parameters and POST26 variables.
+
+    `solver` is the time ANSYS spent between reading the input parameters and saving the output parameters,
+    measured by ANSYS itself (`PARANSYS_TSTART` and `PARANSYS_TEND` at `par_out.paransys`), so
+    `overhead = total - solver` is the time added by PARANSYS and the monitor loop.
+
+    """
+
+    def __init__(self, callbacks=[]):
+        """
+        Start timing a solution.
+
+        Args:
+            callbacks (list of functions, optional): functions called as `callback(phase, event, timer)` when
+                each span starts (event 'start') and ends (event 'end'). Defaults to [].
+        """
+        self.phases = collections.OrderedDict()
+        self.solver = None
+        self.total = None
+        self.cached = False
+        self._callbacks = list(callbacks)
+        self._tstart = time.perf_counter()
+
+
+    def _notify(self, phase, event):
+        for callback in self._callbacks:
+            callback(phase, event, self)
+
+
+    @contextlib.contextmanager
+    def span(self, phase):
+        """
+        Time a block of code as a phase, like `with timer.span('stage'): ...`.
+
+        Args:
+            phase (str): phase name.
+        """
+        self._notify(phase, 'start')
+        tstart = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[phase] = self.phases.get(phase, 0.0) + time.perf_counter()-tstart
+            self._notify(phase, 'end')
+
+
+    def stop(self, solver=None, cached=False):
+        """
+        Finish timing the solution.
+
+        Args:
+            solver (float, optional): solver time in seconds, as measured by ANSYS. Defaults to None.
+            cached (bool, optional): the result came from the cache. Defaults to False.
+        """
+        self.total = time.perf_counter()-self._tstart
+        self.solver = solver
+        self.cached = cached
+        self._notify('total', 'end')
+
+
+    @property
+    def overhead(self):
+        """
+        Time spent out of the solver, or None if the solver time is unknown.
+        """
+        if self.total is None or self.solver is None:
+            return None
+        return self.total-self.solver
+
+
+    def as_dict(self):
+        """
+        All times in seconds.
+
+        Returns:
+            dict: {phase: seconds}, plus `solver`, `overhead` and `total`.
+        """
+        times = dict(self.phases)
+        times['solver'] = self.solver
+        times['overhead'] = self.overhead
+        times['total'] = self.total
+        return times
+
+
+    def __repr__(self):
+        times = ', '.join('{}={:.4f}'.format(phase, value) for phase, value in self.as_dict().items() if value is not None)
+        return f'SolveTimer({times})'
+
+
+class TimingStats:
+    """
+    This class collects `SolveTimer`s of many solutions. Results found in the cache are just counted,
+    they would hide the real solution times.
+
+    """
+
+    def __init__(self, history=100000):
+        """
+        Create an empty collection.
+
+        Args:
+            history (int, optional): number of solutions kept for each phase, the oldest ones are forgotten. Defaults to 100000.
+        """
+        self.history = history
+        self.cached = 0
+        self._times = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+
+    def add(self, timer):
+        """
+        Add a finished solution.
+
+        Args:
+            timer (SolveTimer): the solution times.
+        """
+        with self._lock:
+            if timer.cached:
+                self.cached += 1
+                return
+            for phase, value in timer.as_dict().items():
+                if value is None:
+                    continue
+                if phase not in self._times:
+                    self._times[phase] = collections.deque(maxlen=self.history)
+                self._times[phase].append(value)
+
+
+    def clear(self):
+        """
+        Forget all solutions.
+        """
+        with self._lock:
+            self.cached = 0
+            self._times = collections.OrderedDict()
+
+
+    def summary(self):
+        """
+        Statistics of each phase.
+
+        Returns:
+            pandas.DataFrame: one row by phase, with `count`, `mean`, `p50`, `p95`, `max` and `sum` in seconds.
+        """
+        rows = {}
+        with self._lock:
+            for phase, values in self._times.items():
+                values = numpy.fromiter(values, dtype=float, count=len(values))
+                p50, p95 = numpy.percentile(values, [50, 95])
+                rows[phase] = {'count': len(values), 'mean': values.mean(), 'p50': p50, 'p95': p95, 'max': values.max(), 'sum': values.sum()}
+        return pandas.DataFrame.from_dict(rows, orient='index', columns=['count', 'mean', 'p50', 'p95', 'max', 'sum'])
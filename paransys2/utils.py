@@ -3,6 +3,7 @@ import paransys2.utils_files as files
 import paransys2.utils_ansys as ansys
 import paransys2.utils_messages as messages
 import paransys2.utils_anothers as anothers
+import paransys2.utils_watch as watch
 
 #from utils_files import *
 #from utils_ansys import *
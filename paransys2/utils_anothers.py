@@ -1,3 +1,7 @@
+import numbers
+import hashlib
+import numpy
+import pandas
 import paransys2.utils as utils
 
 def to_upper(thing):
@@ -22,20 +26,95 @@ def to_upper(thing):
         return thing
         
 
-def deriv_progress(self, parameter, parin):
+def normalize_parin(parin, P26vars=[]):
+    """
+    Write a parameters set in a normalized form: UPPER case names, sorted and numbers as floats.
+
+    Args:
+        parin (dict): input parameters.
+        P26vars (list of integers, optional): POST26 variables numbers. Defaults to [].
+
+    Returns:
+        str: like `A=1.0;B=2.5;P26=[1, 2]`.
+    """
+    parin = to_upper(parin)
+    normalized = ''
+    for name in sorted(parin):
+        value = parin[name]
+        if isinstance(value, numbers.Real):
+            value = float(value)
+        normalized += '{}={!r};'.format(name, value)
+    P26vars = sorted(set(int(var) for var in P26vars))
+    return normalized + 'P26={}'.format(P26vars)
+
+
+def parin_key(parin, P26vars=[]):
+    """
+    Hash of a normalized parameters set (see `normalize_parin()`).
+
+    Returns:
+        str: SHA-1 hash.
+    """
+    return hashlib.sha1(normalize_parin(parin, P26vars).encode()).hexdigest()
+
+
+def batch_groups(parins, batchsize):
+    """
+    Split parameters sets in batches with the same parameters names.
+
+    The scripts of a batch are filtered once, so a parameter set by just some sets of a batch would lose it's
+    default value in the others.
+
+    Args:
+        parins (list of dicts): parameters sets.
+        batchsize (int): maximum number of sets by batch.
+
+    Returns:
+        list: lists with the indexes of the sets of each batch.
+    """
+    groups = {}
+    for i, parin in enumerate(parins):
+        groups.setdefault(frozenset(to_upper(list(parin))), []).append(i)
+    return [indexes[k:k+batchsize] for indexes in groups.values() for k in range(0, len(indexes), batchsize)]
+
+
+def doe_points(self, points, names=None):
+    """
+    Iterate over design of experiments points as dictionaries with UPPER case names.
+
+    Args:
+        points (pandas.DataFrame, numpy.ndarray or iterable of dicts): one point by row and one parameter by column.
+        names (list of strings, optional): parameters names, needed just if `points` is a numpy.ndarray. Defaults to None.
+
+    Yields:
+        tuple: `(index, parin)` for each point, where index is the DataFrame index or the point position.
+    """
+    if isinstance(points, pandas.DataFrame):
+        columns = to_upper([str(column) for column in points.columns])
+        for index, row in zip(points.index, points.itertuples(index=False, name=None)):
+            yield index, dict(zip(columns, row))
+    elif isinstance(points, numpy.ndarray):
+        if names is None or points.ndim != 2 or len(names) != points.shape[1]:
+            utils.messages.cerror(self, 'A numpy.ndarray of points needs the parameters names of each column.')
+        names = to_upper(list(names))
+        for index, row in enumerate(points):
+            yield index, dict(zip(names, row.tolist()))
+    else:
+        for index, parin in enumerate(points):
+            yield index, to_upper(dict(parin))
+
+
+def deriv_progress(self, done, total):
     """
     Found how much of derivatives is complete.
 
+    It just counts solved points, so it stays right when points finish out of order.
+
     Args:
-        parameter (str): Current parameter.
-        parin (dict): All input parameters.
+        done (int): Number of solved points.
+        total (int): Number of points needed by the finite difference method.
     """
-    i = 0
-    for each in parin:
-        i += 1
-        if each == parameter:
-            done = i/len(parin)
-            utils.messages.cprint(self, 'Derivatives {:.2%} evaluated.'.format(done))
+    utils.messages.cprint(self, 'Derivatives {:.2%} evaluated.'.format(done/total))
 
 
 def str2num(strin):
@@ -48,6 +127,19 @@ def str2num(strin):
         return ans
 
 
+# main.paransys of a model with a solution script
+reuse_apdl = """*IF,PARANSYS_REUSE,GE,1,THEN
+PARSAV,SCALAR,paransys_keep,paransys
+RESUME,paransys_prep,db
+PARRES,CHANGE,paransys_keep,paransys
+*ELSE
+/INPUT,{main}
+SAVE,paransys_prep,db
+*ENDIF
+/INPUT,{solution}
+"""
+
+
 monitor_apdl = """
 /NOPR
 *CREATE,rewctrl.paransys
@@ -62,6 +154,12 @@ monitor_apdl = """
 %C
 /OUTPUT
 *END
+*CREATE,wrset.paransys
+/OUTPUT,set,paransys
+*VWRITE,'PARANSYS_SET=%PARANSYS_SET%'
+%C
+/OUTPUT
+*END
 *CREATE,P26EXP.paransys.mac
 _P26_PAR=ARG1
 *IF,_P26_PAR,EQ,0,THEN
@@ -84,7 +182,7 @@ VGET,_P26_EXPORT(1,0),_P26_PAR
 *VWRITE,'*P26VAR=%_P26_PAR%'
 %C
 *VWRITE,_P26_EXPORT(1,0)
-%G
+{p26format}
 *VWRITE,'*P26END'
 %C
 /OUTPUT,TERM
@@ -92,6 +190,10 @@ VGET,_P26_EXPORT(1,0),_P26_PAR
 *END
 PARANSYS_LOOP=1
 PARANSYS_RUNS=0
+/OUTPUT,ready,paransys
+*VWRITE,'PARANSYS_READY=1'
+%C
+/OUTPUT
 *DOWHILE,PARANSYS_LOOP
 /INPUT,control.paransys
 *IF,PARANSYS_GO,GE,1,THEN
@@ -101,13 +203,42 @@ PARANSYS_DONE=0
 PARANSYS_KILL=0
 /INPUT,rewctrl,paransys
 /DELETE,par_out.paransys,,,BOTH
+PARANSYS_NSETS=0
+PARANSYS_FIRST=1
+/INPUT,batch.paransys
+*IF,PARANSYS_NSETS,GE,1,THEN
+PARANSYS_SET=PARANSYS_FIRST-1
+/INPUT,wrset,paransys
+PARANSYS_NEXT=PARANSYS_NSETS-PARANSYS_SET
+*DOWHILE,PARANSYS_NEXT
+/INPUT,set.paransys
+PARANSYS_SET=PARANSYS_SET+1
+/INPUT,wrset,paransys
 /CLEAR,start.ans
+/INPUT,set.paransys
+*GET,PARANSYS_TSTART,ACTIVE,0,TIME,WALL
+/INPUT,par_in_%PARANSYS_SET%,paransys
+/GOPR
+/INPUT,{main}
+/NOPR
+*GET,PARANSYS_TEND,ACTIVE,0,TIME,WALL
+PARSAV,ALL,par_out_%PARANSYS_SET%,paransys
+/INPUT,rP26.paransys
+/INPUT,set.paransys
+/INPUT,batch.paransys
+PARANSYS_NEXT=PARANSYS_NSETS-PARANSYS_SET
+*ENDDO
+*ELSE
+/CLEAR,start.ans
+*GET,PARANSYS_TSTART,ACTIVE,0,TIME,WALL
 /INPUT,par_in.paransys
 /GOPR
 /INPUT,{main}
 /NOPR
+*GET,PARANSYS_TEND,ACTIVE,0,TIME,WALL
 PARSAV,ALL,par_out.paransys
 /INPUT,rP26.paransys
+*ENDIF
 /INPUT,control.paransys
 PARANSYS_GO=0
 PARANSYS_RUNS=PARANSYS_RUNS+1
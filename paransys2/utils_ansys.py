@@ -4,9 +4,16 @@ Useful function for ANSYS
 
 import re
 import os
-import time
+import sys
+import shlex
+import atexit
+import threading
+import subprocess
 import paransys2.utils as utils
 
+# Sessions with an ANSYS started by PARANSYS, or already running when they started, they are closed at exit
+_supervised = set()
+
 def find_exec(self):
     """
     Try to find ANSYS executable location by enviroment variables
@@ -15,6 +22,7 @@ def find_exec(self):
         str: ANSYS executable location
     """
     ansys_version = 0
+    exec_loc = None
     for var in os.environ:
         result = re.search(r'(?<=ANSYS)[0-9]+(?=_DIR)', var, re.IGNORECASE)
         if result:
@@ -22,9 +30,12 @@ def find_exec(self):
 
     if ansys_version > 0:
         exec_loc = os.getenv(fr'ANSYS{ansys_version}_DIR')
-        exec_loc = fr'{exec_loc}\bin\winx64\ANSYS{ansys_version}.exe'
+        if os.name == 'nt':
+            exec_loc = os.path.join(exec_loc, 'bin', 'winx64', f'ANSYS{ansys_version}.exe')
+        else:
+            exec_loc = os.path.join(exec_loc, 'bin', f'ansys{ansys_version}')
 
-    if os.path.isfile(exec_loc):
+    if exec_loc is not None and os.path.isfile(exec_loc):
         utils.messages.cprint(self, fr'Using ANSYS v{ansys_version} found at "{exec_loc}".')
         return exec_loc
     else:
@@ -33,52 +44,365 @@ def find_exec(self):
 
 def start(self):
     """
-    Start ANSYS if it isn't already running
+    Start ANSYS if it isn't already running, waiting for the monitor to write `ready.paransys`.
     """
     if not is_running(self):
-        utils.messages.cprint(self, 'Starting ANSYS.')
-        utils.files.create_monitor(self)
-        utils.files.remove_control(self)
-        utils.files.write_control(self)
-        
-        flags = '  -b -i \"{run_location}\\monitor.paransys\" -o \"{run_location}\\paransys.ansys.log\" -smp -np {nproc} -j {jobname} -dir \"{run_location}\" {add_flags} '.format(**self._ANSYS)
-        _ = os.spawnl(os.P_NOWAIT, self._ANSYS['exec_loc'], flags)
-
-        count = 0
-        while (not is_running(self)) and (count <= self._settings['starter_max_wait']):
-            count += self._settings['starter_sleep']
-            time.sleep(self._settings['starter_sleep'])
-
-        if is_running(self):
-            utils.messages.cprint(self, '   ANSYS started.')
-        else:
-            utils.messages.cerror(self, '   ANSYS couldn\'t start.')
+        launch(self)
+        utils.watch.wait_for(self, lambda: ready(self), fname='ready.paransys', timeout=self._settings['starter_max_wait'])
+        started(self)
     return None
 
 
+async def start_async(self):
+    """
+    Start ANSYS if it isn't already running, waiting for it without blocking the event loop
+    """
+    if not is_running(self):
+        launch(self)
+        await utils.watch.wait_for_async(self, lambda: ready(self), fname='ready.paransys', timeout=self._settings['starter_max_wait'])
+        started(self)
+    return None
+
+
+def launch(self):
+    """
+    (For internal use)
+    Create the monitor and control files and launch the ANSYS process.
+    """
+    utils.messages.cprint(self, 'Starting ANSYS.')
+    utils.files.create_monitor(self)
+    utils.files.remove_control(self)
+    utils.files.remove_ready(self)
+    utils.files.write_control(self)
+    utils.files.write_batch(self, [])
+
+    # Lines of older runs aren't followed
+    logstart = log_size(self)
+    self._process = subprocess.Popen(command(self), stdin=subprocess.DEVNULL)
+    _supervised.add(self)
+    # A new ANSYS hasn't any saved preprocessing
+    self._prepkey = None
+
+    tail_log(self, logstart)
+
+
+def log_size(self):
+    """
+    (For internal use)
+    Size of the ANSYS log, or 0 if it doesn't exist.
+    """
+    logfile = os.path.join(self._ANSYS['run_location'], 'paransys.ansys.log')
+    return os.path.getsize(logfile) if os.path.isfile(logfile) else 0
+
+
+def tail_log(self, start=None):
+    """
+    (For internal use)
+    (Re)start or stop following the ANSYS log, as set by `setLogStream()`.
+
+    Args:
+        start (int, optional): log position where it starts. Defaults to None, the current end of the log.
+    """
+    if self._logtail is not None:
+        self._logtail.stop()
+        self._logtail = None
+    if self._logstream is not None:
+        if start is None:
+            start = log_size(self)
+        self._logtail = LogTail(os.path.join(self._ANSYS['run_location'], 'paransys.ansys.log'), self._logstream, start=start)
+        self._logtail.start()
+
+
+def ready(self):
+    """
+    (For internal use)
+    Test if the starting ANSYS is ready (or if it already failed).
+
+    Returns:
+        bool: True when the monitor wrote `ready.paransys` or the process finished with an error.
+    """
+    if os.path.isfile(os.path.join(self._ANSYS['run_location'], 'ready.paransys')):
+        return True
+    return self._process is not None and self._process.poll() not in [None, 0]
+
+
+def started(self):
+    """
+    (For internal use)
+    Verify if ANSYS started.
+    """
+    if os.path.isfile(os.path.join(self._ANSYS['run_location'], 'ready.paransys')) and is_running(self):
+        utils.messages.cprint(self, '   ANSYS started (PID {}).'.format(self._process.pid))
+    else:
+        returncode = None if self._process is None else self._process.poll()
+        utils.messages.cerror(self, f'   ANSYS couldn\'t start (exit code {returncode}), take a look at paransys.ansys.log.')
+
+
+def command(self):
+    """
+    Command line that starts ANSYS.
+
+    A Python script as `exec_loc` (like the `paransys2.mockansys` stand-in) is started by the current Python interpreter.
+
+    Returns:
+        list of strings: the executable and it's arguments.
+    """
+    run_location = self._ANSYS['run_location']
+    cmd = [self._ANSYS['exec_loc']]
+    if cmd[0].lower().endswith('.py'):
+        cmd = [sys.executable] + cmd
+    cmd += [
+        '-b',
+        '-i', os.path.join(run_location, 'monitor.paransys'),
+        '-o', os.path.join(run_location, 'paransys.ansys.log'),
+        '-smp',
+        '-np', str(self._ANSYS['nproc']),
+        '-j', self._ANSYS['jobname'],
+        '-dir', run_location
+    ]
+    cmd += shlex.split(self._ANSYS['add_flags'], posix=(os.name != 'nt'))
+    return cmd
+
+
 def kill(self):
     """
-    Close ANSYS
+    Close ANSYS, waiting for the process to finish. After `kill_timeout` seconds it's terminated.
     """
-    while is_running(self):
+    if is_running(self):
         utils.files.write_control(self, kill=True)
-        time.sleep(1)
+        if self._process is not None and self._process.poll() is None:
+            try:
+                self._process.wait(self._settings['kill_timeout'])
+            except subprocess.TimeoutExpired:
+                utils.messages.cprint(self, 'ANSYS didn\'t close, terminating it.')
+                self._process.terminate()
+                self._process.wait()
+        # ANSYS wasn't started here (or it's launcher already finished), the monitor closes it
+        if not utils.watch.wait_for(self, lambda: closing(self), fname=watched(self), timeout=self._settings['kill_timeout']):
+            utils.messages.cprint(self, '** ANSYS didn\'t close, it must be closed by hand.')
+    closed(self)
+
+
+async def kill_async(self):
+    """
+    Close ANSYS without blocking the event loop
+    """
+    if is_running(self):
+        utils.files.write_control(self, kill=True)
+        finished = await utils.watch.wait_for_async(self, lambda: closing(self), fname=watched(self), timeout=self._settings['kill_timeout'])
+        if self._process is not None and self._process.poll() is None:
+            utils.messages.cprint(self, 'ANSYS didn\'t close, terminating it.')
+            self._process.terminate()
+            self._process.wait()
+        elif not finished:
+            utils.messages.cprint(self, '** ANSYS didn\'t close, it must be closed by hand.')
+    closed(self)
+
+
+def closing(self):
+    """
+    (For internal use)
+    Test if a closing ANSYS finished, sending the exit signal again if the control file lost it.
+
+    Returns:
+        bool: True when ANSYS isn't running.
+    """
+    if not is_running(self):
+        return True
+    if not utils.files.read_control(self)['PARANSYS_KILL']:
+        utils.files.write_control(self, kill=True)
+    return False
+
+
+def watched(self):
+    """
+    (For internal use)
+    Files that change when ANSYS closes: the control file and the lock file.
+    """
+    return ['control.paransys', '{}.lock'.format(self._ANSYS['jobname'])]
+
+
+def terminate(self):
+    """
+    Stop a hung or crashed ANSYS at once, without the monitor, so a new one could be started.
+    """
+    if self._process is not None and self._process.poll() is None:
+        utils.messages.cprint(self, 'Terminating ANSYS.')
+        self._process.terminate()
+        try:
+            self._process.wait(self._settings['kill_timeout'])
+        except subprocess.TimeoutExpired:
+            self._process.kill()
+            self._process.wait()
+    if self._process is not None:
+        remove_lock(self)
+    elif is_running(self):
+        utils.messages.cprint(self, '** ANSYS wasn\'t started by PARANSYS, it must be closed by hand.')
+    closed(self)
+
+
+def remove_lock(self):
+    """
+    (For internal use)
+    Remove the lock file left by a crashed or terminated ANSYS started by this session.
+    """
+    if self._process is None or self._process.poll() is None:
+        return
+    lockfile = os.path.join(self._ANSYS['run_location'], '{}.lock'.format(self._ANSYS['jobname']))
+    try:
+        os.remove(lockfile)
+    except OSError:
+        pass
+
+
+def closed(self):
+    """
+    (For internal use)
+    Forget a closed ANSYS process.
+    """
+    if self._logtail is not None:
+        self._logtail.stop()
+        self._logtail = None
+    _supervised.discard(self)
+    if self._process is not None and self._process.poll() is not None:
+        utils.messages.cprint(self, 'ANSYS closed (exit code {}).'.format(self._process.returncode))
     else:
         utils.messages.cprint(self, 'ANSYS closed.')
 
 
+def close_all(sessions=None):
+    """
+    Close many ANSYS sessions, by default all ANSYS started by PARANSYS or used by it's sessions. It's called at exit.
+
+    All of them receive the exit signal at once and then each one is waited, so they close at the same time.
+
+    Args:
+        sessions (list of ANSYS, optional): sessions to close. Defaults to None, all of them.
+    """
+    sessions = list(_supervised) if sessions is None else list(sessions)
+    for session in sessions:
+        if is_running(session):
+            utils.files.write_control(session, kill=True)
+    for session in sessions:
+        kill(session)
+
+atexit.register(close_all)
+
+
+def status(self):
+    """
+    Status of the ANSYS process started by this session.
+
+    Returns:
+        dict: with the process `pid`, if it's `running` and it's `returncode` (None while it runs).
+    """
+    if self._process is None:
+        return {'pid': None, 'running': is_running(self), 'returncode': None}
+    return {'pid': self._process.pid, 'running': is_running(self), 'returncode': self._process.poll()}
+
+
 def is_running(self):
     """
     Test if ANSYS is running.
 
+    If it was started here it's running while the process is alive, a lock file left by it doesn't matter. If not
+    it's tested by the lock file: on Windows ANSYS keeps it open, so it can't be removed while ANSYS runs, anywhere
+    else it must exist and it's process must be alive. A running ANSYS that wasn't started here is also closed at exit.
+
     Returns:
         bool: Is it running?
     """
+    if self._process is not None:
+        return self._process.poll() is None
+
     running = False
-    lockfile = '{}\\{}.lock'.format(self._ANSYS['run_location'], self._ANSYS['jobname'])
-    if os.path.isfile(lockfile):
-        try:
+    lockfile = os.path.join(self._ANSYS['run_location'], '{}.lock'.format(self._ANSYS['jobname']))
+    if os.name == 'nt':
+        if os.path.isfile(lockfile):
+            try:
+                os.remove(lockfile)
+            except:
+                running = True
+    elif os.path.isfile(lockfile):
+        running = lock_alive(lockfile)
+        if not running:
             os.remove(lockfile)
-        except:
-            running = True
+    if running:
+        _supervised.add(self)
     return running
+
+
+class LogTail(threading.Thread):
+    """
+    Thread that follows a log file, like `tail -f`, sending each new line to a function.
+    """
+
+    def __init__(self, fname, callback, start=0, interval=0.2):
+        """
+        Args:
+            fname (str): log file location, it doesn't need to exist yet.
+            callback (function): called as `callback(line)` for each line.
+            start (int, optional): position where reading starts, if the file is rewritten it starts from the beginning. Defaults to 0.
+            interval (float, optional): seconds between readings. Defaults to 0.2.
+        """
+        super().__init__(daemon=True)
+        self.fname = fname
+        self.callback = callback
+        self.start_at = start
+        self.interval = interval
+        self._stopping = threading.Event()
+
+    def run(self):
+        f = None
+        buffer = ''
+        try:
+            while True:
+                stopping = self._stopping.is_set()
+                if f is None and os.path.isfile(self.fname):
+                    f = open(self.fname, 'r', errors='replace')
+                    if os.path.getsize(self.fname) >= self.start_at:
+                        f.seek(self.start_at)
+                if f is not None:
+                    buffer += f.read()
+                    *lines, buffer = buffer.split('\n')
+                    for line in lines:
+                        self.callback(line.rstrip())
+                if stopping:
+                    break
+                self._stopping.wait(self.interval)
+        finally:
+            if f is not None:
+                f.close()
+
+    def stop(self):
+        """
+        Read the last lines and stop.
+        """
+        self._stopping.set()
+        self.join()
+
+
+def lock_alive(lockfile):
+    """
+    Test if the process that wrote a lock file (when it has just a PID, like the mock solver lock) is alive.
+    It's used just for ANSYS that weren't started by the session, so a lock without a PID (like the ANSYS one) is
+    taken as alive.
+
+    Args:
+        lockfile (str): lock file location.
+
+    Returns:
+        bool: False just if the lock PID doesn't exist anymore.
+    """
+    try:
+        with open(lockfile, 'r') as f:
+            pid = int(f.read().strip())
+    except (OSError, ValueError):
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        pass
+    return True
@@ -4,93 +4,236 @@ Useful functions for files
 """
 import re
 import os
+import time
 import shutil
+import mmap
+import functools
+import numpy
 import pandas 
 import paransys2.utils as utils
 
+def model_files(model):
+    """
+    All files of a model: the main script, the solution script (if it exists) and the extra files.
+
+    Args:
+        model (dict): APDL model as in `ANSYS._model`.
+
+    Returns:
+        list of strings: files names.
+    """
+    files = [model['main']]
+    if model.get('solution'):
+        files.append(model['solution'])
+    return files + list(model['extrafiles'])
+
+
+def classify_model(self):
+    """
+    Classify model files as scripts or binaries once, when the model is set.
+
+    It saves at `self._model['files']` the source location, the type and the modification time and size of each file.
+    """
+    self._model['files'] = {}
+    for fname in model_files(self._model):
+        source = os.path.join(self._model['location'], fname)
+        stat = os.stat(source)
+        self._model['files'][fname] = {
+            'source': source,
+            'text': is_text_file(source),
+            'signature': (stat.st_mtime_ns, stat.st_size)
+        }
+
+
 def copy_model(self, parameters):
     """
-    Copy model files. 
+    Stage model files at run location. 
     
-    Script files are filtered looking for some commands and parameters, binary files are just coppied.
+    Script files are filtered looking for some commands and parameters, binary files are just linked (or coppied).
+    Each file is staged again only when the source changes (by modification time and size) or, for scripts,
+    when the parameters names change. So the same model could be solved many times without copying it again.
 
     Args:
         parameters (dict): analysis parameters that PARANSYS will change if it's a script
     """
 
-    modelfiles = [self._model['main']] + self._model['extrafiles']
+    if 'files' not in self._model:
+        classify_model(self)
+
     destination = self._ANSYS['run_location']
+    names = frozenset(utils.anothers.to_upper(list(parameters)))
 
-    for fname in modelfiles:
-        fname = '{}\\{}'.format(self._model['location'], fname)
+    for fname, info in self._model['files'].items():
+        source = info['source']
         try:
-            f = open(fname, 'r')
-            f.close()
-        except:
-            utils.messages.cerror(self, f'PARANSYS couldn\'t copy \"{fname}\".')
-        else:
-            if is_text_file(fname) and len(parameters) > 0:
-                copy_and_filter_scripts(fname, destination, parameters)
-            else:
-                shutil.copy(fname, destination)
-
-    fname = f'{destination}\\main.paransys'
-    with open(fname, 'w+') as f:
+            stat = os.stat(source)
+        except OSError:
+            utils.messages.cerror(self, f'PARANSYS couldn\'t copy \"{source}\".')
+
+        signature = (stat.st_mtime_ns, stat.st_size)
+        if signature != info['signature']:
+            info['text'] = is_text_file(source)
+            info['signature'] = signature
+
+        filtered = info['text'] and len(parameters) > 0
+        state = (signature, names if filtered else None)
+        _, scriptname = os.path.split(source)
+        target = os.path.join(destination, scriptname)
+        if self._staged.get(fname) == state and os.path.isfile(target):
+            continue
+
+        # The model could be at run_location, then the target is the source and it's never removed
+        inplace = os.path.samefile(os.path.dirname(os.path.abspath(source)), destination)
+
+        # Never write over a link, it would change the source file
+        if os.path.lexists(target) and not inplace:
+            os.remove(target)
+        if filtered:
+            copy_and_filter_scripts(source, destination, parameters)
+        elif not inplace:
+            link_file(self, source, target)
+        self._staged[fname] = state
+
+    fname = os.path.join(destination, 'main.paransys')
+    if self._model.get('solution'):
+        # The preprocessing is saved, or resumed when PARANSYS_REUSE is set at par_in
+        inpstr = utils.anothers.reuse_apdl.format(main=self._model['main'], solution=self._model['solution'])
+    else:
         inpstr = '/INPUT,{}'.format(self._model['main'])
-        f.write(inpstr)
+    if self._staged.get('main.paransys') != inpstr or not os.path.isfile(fname):
+        with open(fname, 'w+') as f:
+            f.write(inpstr)
+        self._staged['main.paransys'] = inpstr
+
+
+def prep_key(self, parameters):
+    """
+    Key of the preprocessing of a parameters set, when the model has a solution script.
+
+    It's made by the preprocessing files signatures and the parameters that aren't invariant, so two sets
+    with the same key have the same preprocessed database.
+
+    Args:
+        parameters (dict): input parameters.
+
+    Returns:
+        str: the key, or None if the model hasn't a solution script.
+    """
+    if not self._model.get('solution'):
+        return None
+    if 'files' not in self._model:
+        classify_model(self)
+    signatures = [(fname, info['signature']) for fname, info in self._model['files'].items() if fname != self._model['solution']]
+    parameters = {name: value for name, value in utils.anothers.to_upper(parameters).items() if name not in self._model['invariant']}
+    return '{!r};{}'.format(signatures, utils.anothers.normalize_parin(parameters))
+
+
+def link_file(self, source, target):
+    """
+    Put a file at target location without copying it if possible.
+
+    With `self._settings['stage_mode']` as 'link' it tries a hard link, then a symbolic link and just then a copy.
+    With 'copy' it's always coppied.
+
+    Args:
+        source (str): source file location.
+        target (str): target file location.
+    """
+    if self._settings['stage_mode'] == 'link':
+        try:
+            os.link(source, target)
+            return
+        except (OSError, AttributeError):
+            pass
+        try:
+            os.symlink(os.path.abspath(source), target)
+            return
+        except (OSError, AttributeError, NotImplementedError):
+            pass
+    shutil.copy(source, target)
+
+
+# Keys for simple lines
+# Commands that assigns values to variables in the form "command,variable,..."
+keys_line_assigns = [r'\*set', r'\*get', r'\*del', r'\*dim']
+# Commands that could bug the code, like /exit and /clear
+keys_line_forbidden = ['/clear', 'eof', '/exit', r'\*ask']
+
+# Keys for multiple lines
+# for *PREAD,...,END PREAD : 
+# r"^[^!]*((?<=(\*PREAD))\s*,\s*(ARRAY3D|ARRAY2D)\s*,(.|\n)*(?=(END PREAD)))"
+# 
+
+# Old pattern
+#pattLine = re.compile(r"^[^!]*(((?<=({assigns}))\s*({parameters})\s*(?=,))|((?<![a-zA-Z_0-9])\s*({parameters})\s*(?=[=+]))|({forbidden}))".format(**pattLineKeys), flags=re.IGNORECASE)
+
+# Words that receive values as "word =" or "*SET,word,"
+pattAssignedWords = re.compile(r'(\w+)\s*\=')
+pattCommandWords = re.compile(r'(?:{assigns})\s*,\s*(\w+)\s*,'.format(assigns='|'.join(keys_line_assigns)))
+forbidden_words = [key.replace('\\', '') for key in keys_line_forbidden]
+
+
+@functools.lru_cache(maxsize=64)
+def filter_matcher(names):
+    """
+    Create the function that finds lines that must be filtered for a set of parameters names.
+
+    It's created once for each set of names, so many solutions with the same parameters just reuse it.
+    It's the same as the old pattern (see `paransys2.benchmarks.filtering`), but instead of testing each
+    parameter name at each position it finds the assigned words and looks for them in a set.
+
+    Args:
+        names (frozenset of strings): parameters names in UPPER case.
+
+    Returns:
+        function: `match(code)` that returns True if the code part of a line (before any "!") must be filtered.
+    """
+    def match(code):
+        lower = code.lower()
+        for word in forbidden_words:
+            if word in lower:
+                return True
+        if '*' in lower:
+            for word in pattCommandWords.findall(lower):
+                if word.upper() in names:
+                    return True
+        if '=' in lower:
+            for word in pattAssignedWords.findall(lower):
+                if word.upper() in names:
+                    return True
+        return False
+    return match
 
 
 def copy_and_filter_scripts(fname, destination, parameters):
     """
     Copy model scripts filtering some commands and parameters.
 
+    The script is streamed line by line and each line is tested by the matcher from `filter_matcher()`,
+    where most APDL lines (like `K,1,0,0`) are discarded by cheap substring tests. It's written to a temporary
+    file that replaces the target just at the end, so the source could be at `destination`.
+
     Args:
         fname (str): source script file
         destination (str): destionation folder
         parameters (dict): analysis parameters that PARANSYS will change
+    """
 
-    Raises:
-        RuntimeError: [description]
-    """
-
-    # Keys for simple lines
-    # Commands that assigns values to variables in the form "command,variable,..."
-    keys_line_assigns = [r'\*set', r'\*get', r'\*del', r'\*dim']
-    # Commands that could bug the code, like /exit and /clear
-    keys_line_forbidden = ['/clear', 'eof', '/exit', r'\*ask']
-    # Join each key group 
-    pattLineKeys = {
-        'parameters':   '|'.join(parameters),
-        'assigns':      '|'.join(keys_line_assigns),
-        'forbidden':    '|'.join(keys_line_forbidden)
-    }
+    match = filter_matcher(frozenset(utils.anothers.to_upper(list(parameters))))
 
-    # Keys for multiple lines
-    # for *PREAD,...,END PREAD : 
-    # r"^[^!]*((?<=(\*PREAD))\s*,\s*(ARRAY3D|ARRAY2D)\s*,(.|\n)*(?=(END PREAD)))"
-    # 
-
-    # Compile the regex patterns 
-    # 
-    # Old pattern
-    #pattLine = re.compile(r"^[^!]*(((?<=({assigns}))\s*({parameters})\s*(?=,))|((?<![a-zA-Z_0-9])\s*({parameters})\s*(?=[=+]))|({forbidden}))".format(**pattLineKeys), flags=re.IGNORECASE)
-    pattLine = re.compile(r"^[^!]*((?<![\w])({parameters})(?![\w])\s*\=|(?<=({assigns}))\s*,\s*({parameters})\s*,|({forbidden}))".format(**pattLineKeys), flags=re.IGNORECASE)
-    #pattMulti = re.compile(r"", flags=re.IGNORECASE)
-
-    # Read original script file
-    with open(fname, 'r') as f:
-        script = f.readlines()
-    
     # Get script name
     _, scriptname = os.path.split(fname)
 
     # Filter the content and save the new script
-    with open(f'{destination}\\{scriptname}', 'w') as f:
-        for line in script:
+    target = os.path.join(destination, scriptname)
+    temporary = target + '.paransys.tmp'
+    with open(fname, 'r') as fin, open(temporary, 'w') as fout:
+        for line in fin:
             # If matchs make it's conent a comment
-            if pattLine.search(line):
-                f.write('! Line Removed by PARANSYS, old content: ')
-            f.write(line)
+            if match(line.split('!', 1)[0]):
+                fout.write('! Line Removed by PARANSYS, old content: ')
+            fout.write(line)
+    os.replace(temporary, target)
 
 
 def is_text_file(fname):
@@ -103,7 +246,11 @@ def is_text_file(fname):
     Returns:
         bool: If text return True, if binary return False
     """
-    return not(b'\x00' in open(fname, 'rb').read())
+    with open(fname, 'rb') as f:
+        for chunk in iter(lambda: f.read(65536), b''):
+            if b'\x00' in chunk:
+                return False
+    return True
 
 
 def create_monitor(self):
@@ -112,11 +259,12 @@ def create_monitor(self):
     """
     monitor = {
         "main": 'main.paransys',
-        "wait": self._settings['monitor_wait']
+        "wait": self._settings['monitor_wait'],
+        "p26format": '(E24.16)' if self._settings['p26_format'] == 'fixed' else '%G'
     }
     
     monitorsource = utils.anothers.monitor_apdl.format(**monitor)
-    fapdlmonitor = '{run_location}\\monitor.paransys'.format(**self._ANSYS)
+    fapdlmonitor = os.path.join(self._ANSYS['run_location'], 'monitor.paransys')
     with open(fapdlmonitor, 'w') as f:
         f.write(monitorsource)
     utils.messages.cprint(self, '   Monitor file created.')
@@ -147,8 +295,10 @@ def read_control(self):
     Returns:
         dict: with controls values.
     """
-    parameters = read_parameters(self, 'control.paransys')
-    if parameters:
+    keys = ['PARANSYS_GO', 'PARANSYS_DONE', 'PARANSYS_KILL', 'PARANSYS_RUNS']
+    parameters = read_parameters(self, 'control.paransys', keys)
+    # A control file being written could be incomplete
+    if parameters and all(key in parameters for key in keys):
         parameters = {
             'PARANSYS_GO':   bool(parameters['PARANSYS_GO']),
             'PARANSYS_DONE': bool(parameters['PARANSYS_DONE']),
@@ -166,18 +316,121 @@ def read_control(self):
     return parameters
 
 
-def write_parin(self, parameters):
+def write_parin(self, parameters, fname='par_in.paransys', reuse=None):
     """
     Write input parameters
 
     Args:
         parameters (dict): dictionary with parameters and it's values.
+        fname (str, optional): file that will receive parameters. Defaults to 'par_in.paransys'.
+        reuse (bool, optional): write `PARANSYS_REUSE`, ANSYS resumes the saved preprocessing if it's True. Defaults to None (not written).
     """
     self._parin = parameters
-    fname = 'par_in.paransys'
+    if reuse is not None:
+        parameters = dict(parameters)
+        parameters['PARANSYS_REUSE'] = int(reuse)
     write_parameters(self, fname, parameters)
 
 
+def write_batch(self, parins, reuse=None):
+    """
+    Write a batch of parameters sets, solved by the monitor in one run signal.
+
+    Each set is written at `par_in_<n>.paransys` (n from 1) and their number at `batch.paransys`,
+    old outputs of this sets are removed. An empty list sets the monitor back to a single set at `par_in.paransys`.
+
+    Args:
+        parins (list of dicts): parameters sets.
+        reuse (list of bools, optional): `PARANSYS_REUSE` of each set, see `write_parin()`. Defaults to None.
+    """
+    write_batch_sets(self, parins, reuse)
+    write_batch_size(self, len(parins))
+
+
+def write_batch_sets(self, parins, reuse=None, first=1):
+    """
+    Write the sets of a batch without changing it's size, so a running batch could be extended.
+
+    Args:
+        parins (list of dicts): parameters sets.
+        reuse (list of bools, optional): `PARANSYS_REUSE` of each set, see `write_parin()`. Defaults to None.
+        first (int, optional): number of the first set. Defaults to 1.
+    """
+    for n, parameters in enumerate(parins, start=first):
+        if reuse is not None:
+            parameters = dict(parameters)
+            parameters['PARANSYS_REUSE'] = int(reuse[n-first])
+        write_parameters(self, f'par_in_{n}.paransys', parameters)
+        for fname in [f'par_out_{n}.paransys', f'P26_out_{n}.paransys']:
+            fname = os.path.join(self._ANSYS['run_location'], fname)
+            if os.path.isfile(fname):
+                os.remove(fname)
+
+
+def write_batch_size(self, nsets, first=1):
+    """
+    Write `batch.paransys`, the monitor solves the sets from `first` to `nsets`.
+
+    The monitor reads it again after each set, so a running batch solves the sets added to it. That's why
+    it's written to a temporary file and renamed, the monitor never reads it half written.
+
+    Args:
+        nsets (int): number of the last set, 0 for a single set at `par_in.paransys`.
+        first (int, optional): number of the first set. Defaults to 1.
+    """
+    write_parameters(self, 'batch.paransys.tmp', {'PARANSYS_NSETS': nsets, 'PARANSYS_FIRST': first})
+    fname = os.path.join(self._ANSYS['run_location'], 'batch.paransys')
+    for _ in range(100):
+        try:
+            os.replace(fname + '.tmp', fname)
+            return
+        except PermissionError:
+            # Windows can't replace it while ANSYS is reading it
+            time.sleep(0.01)
+    os.replace(fname + '.tmp', fname)
+
+
+def read_set(self):
+    """
+    Number of the set that the monitor is solving in a batch.
+
+    Returns:
+        int: set number, 0 if it isn't known yet.
+    """
+    parameters = read_parameters(self, 'set.paransys')
+    if not parameters:
+        return 0
+    return int(parameters.get('PARANSYS_SET', 0))
+
+
+def remove_set(self):
+    """
+    Remove 'set.paransys' if it exists, so an old batch isn't taken as the current one.
+    """
+    fname = os.path.join(self._ANSYS['run_location'], 'set.paransys')
+    if os.path.isfile(fname):
+        os.remove(fname)
+
+
+def batch_solved(self, nsets, post26=False, first=1):
+    """
+    Number of sets of a stopped batch that were solved, the ones with their outputs written.
+
+    Args:
+        nsets (int): number of the last set in the batch.
+        post26 (bool, optional): POST26 variables were asked, so their export is also needed. Defaults to False.
+        first (int, optional): number of the first set. Defaults to 1.
+
+    Returns:
+        int: sets solved, from the first one.
+    """
+    for n in range(first, nsets+1):
+        fnames = [f'par_out_{n}.paransys'] + ([f'P26_out_{n}.paransys'] if post26 else [])
+        if not all(os.path.isfile(os.path.join(self._ANSYS['run_location'], fname)) for fname in fnames):
+            return n-first
+    return max(nsets-first+1, 0)
+
+
 def write_parameters(self, fname, parameters):
     """
     Create the file with input parameters values
@@ -186,81 +439,156 @@ def write_parameters(self, fname, parameters):
         fname (str): file that will receive parameters.
         parameters (dict): dictionary with parameters and it's values.
     """
-    fname = '{}\\{}'.format(self._ANSYS['run_location'], fname)
+    fname = os.path.join(self._ANSYS['run_location'], fname)
     with open(fname, 'w') as f:
         for param in parameters:
             line = '{}={}\n'.format(param, parameters[param])
             f.write(line)
 
 
-def read_parout(self):
+# Parameters created by the monitor, they aren't model outputs
+monitor_parameters = ['PARANSYS_SET', 'PARANSYS_NSETS', 'PARANSYS_FIRST', 'PARANSYS_NEXT', 'PARANSYS_REUSE']
+
+
+def read_parout(self, only=None, fname='par_out.paransys'):
     """
     Read and verify output parameters.
 
+    The solver timestamps (`PARANSYS_TSTART` and `PARANSYS_TEND`, in hours) are removed from the parameters and
+    the solver time, in seconds, is kept at `self._solvertime` (None if they aren't there).
+
+    Args:
+        only (list of strings, optional): just this parameters are read. Defaults to None (all of them).
+        fname (str, optional): output parameters file. Defaults to 'par_out.paransys'.
+
     Returns:
         dict: With all parameters and their values.
+
+    Raises:
+        SolverError: with status 'crashed' if ANSYS didn't write the file.
     """
-    parout = read_parameters(self, 'par_out.paransys')
+    if only is not None:
+        only = utils.anothers.to_upper(list(only)) + ['PARANSYS_TSTART', 'PARANSYS_TEND']
+    parout = read_parameters(self, fname, only)
+    if parout is False:
+        utils.messages.cerror(self, f'ANSYS didn\'t write the output parameters ("{fname}"), take a look at paransys.ansys.log.', status='crashed')
+    for name in monitor_parameters:
+        parout.pop(name, None)
+    tstart = parout.pop('PARANSYS_TSTART', None)
+    tend = parout.pop('PARANSYS_TEND', None)
+    self._solvertime = (tend-tstart)*3600 if tstart is not None and tend is not None else None
     parin  = self._parin
     for par in parin:
-        if parin[par] != parout[par.upper()]:
+        if only is not None and par.upper() not in only:
+            continue
+        if par.upper() not in parout:
+            msg = '** Input parameter \"{}\" is missing in the output parameters. It should not happen, please verify it!'.format(par)
+            utils.messages.cprint(self, msg)
+        elif parin[par] != parout[par.upper()]:
             msg = '** Input parameter \"{}\" was set as \"{}\" but finished as \"{}\". It should not happen, please verify it!'.format(par, parin[par], parout[par.upper()])
             utils.messages.cprint(self, msg)
     return parout
 
 
-def read_parameters(self, fname):
+# Parameters as "parm=value" or "*SET,parm,value", just the first one of each line
+pattParameter = re.compile(r'^.*?(?:\*SET\s*,\s*(\w+)\s*,|(\w+)\s*\=)\s*([-+]?(?:[0-9]+\.?[0-9]*|\.[0-9]+)(?:[ED][-+]?[0-9]+)?)', re.IGNORECASE | re.MULTILINE)
+# Files changed less than this time (in ns) before they were read could change again without changing it's signature
+stable_age = 1e9
+# Maximum files kept parsed by `read_parameters()`, the oldest one is dropped
+parcache_size = 64
+
+
+def read_parameters(self, fname, only=None):
     """
     Read and interpret parameters from files. 
 
-    It should be defined as `parm=value` or `*SET,parm,value`.
+    It should be defined as `parm=value` or `*SET,parm,value`. The whole file is parsed by a single pattern and
+    values are converted to int (if they are integers) or float.
+
+    The result is kept with the file modification time and size, so an unchanged file isn't parsed again
+    (up to `parcache_size` files).
 
     Args:
         fname (str): File to import parameters
+        only (list of strings, optional): just this parameters are converted and returned. Defaults to None (all of them).
 
     Returns:
         dict: With all parameters and their values.
     """
 
-    fname = '{}\\{}'.format(self._ANSYS['run_location'], fname)
+    fname = os.path.join(self._ANSYS['run_location'], fname)
+    if only is not None:
+        only = frozenset(utils.anothers.to_upper(list(only)))
 
-    if not os.path.isfile(fname):
+    try:
+        stat = os.stat(fname)
+    except OSError:
         return False
 
+    signature = (stat.st_mtime_ns, stat.st_size)
+    cached = self._parcache.get((fname, only))
+    if cached is not None and cached[0] == signature:
+        return dict(cached[1])
+
+    tread = time.time_ns()
     try:
         with open(fname, 'r') as f:
-            content = f.readlines()
+            content = f.read()
     except:
         utils.messages.cerror(self, f'PARANSYS cannot open \"{fname}\".')
-    else:
-        params = {}
-        patt1 = re.compile(r'([\w]+)\s*\=\s*([0-9\.\-ED]+)', re.IGNORECASE)
-        patt2 = re.compile(r'(?<=\*SET,)\s*([\w]+)\s*,\s*([0-9\.\-ED]+)', re.IGNORECASE)
-        for line in content:
-            result = patt1.search(line) or patt2.search(line)
-            if result:
-                params[result.group(1)] = utils.anothers.str2num(result.group(2))
 
-    return params
+    params = {}
+    for result in pattParameter.finditer(content):
+        name = result.group(1) or result.group(2)
+        if only is not None and name.upper() not in only:
+            continue
+        value = float(result.group(3).replace('D', 'E').replace('d', 'E'))
+        if value.is_integer():
+            value = int(value)
+        params[name] = value
+
+    # Just files that were stable when read are kept
+    self._parcache.pop((fname, only), None)
+    if tread - stat.st_mtime_ns > stable_age:
+        while len(self._parcache) >= parcache_size:
+            self._parcache.pop(next(iter(self._parcache)))
+        self._parcache[(fname, only)] = (signature, params)
+
+    return dict(params)
 
 
 def remove_control(self):
     """
     Remove PARANSYS control file
     """
-    controlfile = '{run_location}\\control.paransys'.format(**self._ANSYS)
+    controlfile = os.path.join(self._ANSYS['run_location'], 'control.paransys')
     if os.path.isfile(controlfile):
         os.remove(controlfile)
         utils.messages.cprint(self, '   Control file removed.')
 
 
-def write_ask_post26(self, p26vars):
+def remove_ready(self):
+    """
+    Remove the file that ANSYS monitor writes when it's ready
+    """
+    readyfile = os.path.join(self._ANSYS['run_location'], 'ready.paransys')
+    if os.path.isfile(readyfile):
+        os.remove(readyfile)
+
+
+def write_ask_post26(self, p26vars, batch=False):
     """
     Write 'rP26.paransys' that ask ANSYS for selected POST26 variables.
 
+    In a batch it's used by all sets, each one renames it's export to `P26_out_<n>.paransys`, and
+    it must be removed by `remove_ask_post26()` after the batch.
+
+    Args:
+        p26vars (list of integers): POST26 variables numbers.
+        batch (bool, optional): it's for a batch of sets. Defaults to False.
     """
     fname = 'rP26.paransys'
-    fname = '{}\\{}'.format(self._ANSYS['run_location'], fname)
+    fname = os.path.join(self._ANSYS['run_location'], fname)
 
     if len(p26vars) > 0:
         if 1 not in p26vars:
@@ -270,43 +598,155 @@ def write_ask_post26(self, p26vars):
             f.write('P26EXP.paransys,0\n')
             for var in p26vars:
                 f.write('P26EXP.paransys,{}\n'.format(int(var)))
-            f.write('/DELETE,rP26.paransys\n')
+            if batch:
+                f.write('/RENAME,P26_out,paransys,,P26_out_%PARANSYS_SET%,paransys\n')
+            else:
+                f.write('/DELETE,rP26.paransys\n')
 
 
-def read_post26(self):
+def remove_ask_post26(self):
+    """
+    Remove 'rP26.paransys' if it exists.
+    """
+    fname = os.path.join(self._ANSYS['run_location'], 'rP26.paransys')
+    if os.path.isfile(fname):
+        os.remove(fname)
+
+
+def read_post26(self, fname='P26_out.paransys'):
     """
     Read the POST26 exported variables.
 
+    The file is memory mapped and each `*P26VAR`/`*P26END` block is converted at once by numpy. With
+    `self._settings['p26_format']` as 'fixed' the values are written with fixed width, so each block
+    is converted straight from the mapped file without splitting it.
+
+    Args:
+        fname (str, optional): exported variables file. Defaults to 'P26_out.paransys'.
+
     Returns:
         pandas.DataFrame: With all asked POST26 variables plus var 1 (time) as index.
     """
 
-    fname = 'P26_out.paransys'
-    fname = '{}\\{}'.format(self._ANSYS['run_location'], fname)
+    fname = os.path.join(self._ANSYS['run_location'], fname)
 
     try:
-        with open(fname, 'r') as f:
-            content = f.readlines()
-    except:
-        p26df = pandas.DataFrame({})
-    else:
-        patt_beg = re.compile(r'(?<=\*P26VAR)\s*=\s*(\w+)\s*(?=\\n)*', re.IGNORECASE)
-        patt_end = re.compile(r'(\*P26END)', re.IGNORECASE)
-        varoppened = False 
-        p26values = {}
-        for line in content:
-            sbeg = patt_beg.search(line)
-            if sbeg:
-                varnum = utils.anothers.str2num(sbeg.group(1))
-                p26values[varnum] = []
-                varoppened = True
-            elif patt_end.search(line):
-                varoppened = False
-            elif varoppened == True:
-                p26values[varnum].append(utils.anothers.str2num(line))
-
-        p26df = pandas.DataFrame(p26values)
-        p26df.rename(columns={1: 'Time'}, inplace=True)
-        p26df.set_index('Time', inplace=True)
+        f = open(fname, 'rb')
+    except OSError:
+        return pandas.DataFrame({})
+
+    with f:
+        try:
+            content = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # Empty file
+            return pandas.DataFrame({})
+        with content:
+            p26values = parse_post26(content, self._settings['p26_format'] == 'fixed')
+
+    p26df = pandas.DataFrame(p26values)
+    p26df.rename(columns={1: 'Time'}, inplace=True)
+    p26df.set_index('Time', inplace=True)
 
     return p26df
+
+
+def parse_post26(content, fixed=False):
+    """
+    Find and convert each variable block of a POST26 export.
+
+    Args:
+        content (bytes-like): the exported file content.
+        fixed (bool, optional): values are written with fixed width, one by line. Defaults to False.
+
+    Returns:
+        dict: {variable number: numpy.ndarray}
+    """
+    view = memoryview(content)
+    p26values = {}
+    pos = 0
+    while True:
+        beg = content.find(b'*P26VAR', pos)
+        if beg < 0:
+            break
+        eol = content.find(b'\n', beg)
+        if eol < 0:
+            break
+        varnum = utils.anothers.str2num(bytes(view[beg:eol]).split(b'=', 1)[-1].strip().decode())
+        end = content.find(b'*P26END', eol)
+        if end < 0:
+            end = len(content)
+        p26values[varnum] = parse_post26_block(view[eol+1:end], fixed)
+        pos = end
+    return p26values
+
+
+# Fortran writes exponents with 3 digits without the 'E', like 0.1000000000000000-119
+pattFortranExponent = re.compile(rb'(?<=[0-9.])(?=[-+][0-9]{3}$)', re.MULTILINE)
+
+
+def parse_post26_block(block, fixed=False):
+    """
+    Convert a block of POST26 values, one by line.
+
+    Args:
+        block (memoryview): the values.
+        fixed (bool, optional): values were written as `(E24.16)`, so all lines have the same width. Defaults to False.
+
+    Returns:
+        numpy.ndarray: the values (or a list if some of them aren't numbers).
+    """
+    try:
+        if fixed:
+            values = parse_fixed_width(block)
+            if values is not None:
+                return values
+        return numpy.array(bytes(block).split(), dtype=float)
+    except ValueError:
+        pass
+    values = pattFortranExponent.sub(b'E', bytes(block).rstrip().replace(b'\r', b''))
+    try:
+        return numpy.array(values.split(), dtype=float)
+    except ValueError:
+        return [utils.anothers.str2num(line) for line in values.decode().splitlines() if line.strip()]
+
+
+def parse_fixed_width(block):
+    """
+    Convert values written as `(E24.16)` (like ` 0.1234567890123456E+01`) straight from their bytes.
+
+    The mantissa digits and the exponent are always at the same columns, so they are converted as digits
+    matrices without creating any string. Exponents with 3 digits are written without the 'E' (`-119`).
+
+    Args:
+        block (memoryview): the values, one by line.
+
+    Returns:
+        numpy.ndarray: the values, or None if the lines aren't in this format.
+    """
+    first = bytes(block[:512])
+    width = first.find(b'\n') + 1
+    if width < 23:
+        return None
+    rows = len(block)//width
+    raw = numpy.frombuffer(block, dtype=numpy.uint8, count=rows*width).reshape(rows, width)
+
+    # Columns, from the end of line: [sign]0.dddddddddddddddd E+dd or +ddd
+    end = width-2 if first[width-2:width-1] == b'\r' else width-1
+    e = end-4
+    marked = raw[:, e] == ord('E')
+    signs = numpy.where(marked, raw[:, e+1], raw[:, e])
+    if not (((signs == ord('+')) | (signs == ord('-'))).all() and (raw[:, e-17] == ord('.')).all()):
+        return None
+    # Mantissa digits, the exponent field (the 'E' and signs are ignored) and exponent digits
+    numbers = raw[:, e-16:e+4] - numpy.uint8(ord('0'))
+    numbers[:, 16] = 0
+    numbers[marked, 17] = 0
+    if numbers.max() > 9:
+        return None
+
+    mantissa = numbers[:, :16] @ (10.0**numpy.arange(-1, -17, -1))
+    exponent = numbers[:, 17].astype(numpy.int64)*100 + numbers[:, 18].astype(numpy.int64)*10 + numbers[:, 19]
+    exponent = numpy.where(signs == ord('-'), -exponent, exponent)
+    mantissa[(raw[:, :e-17] == ord('-')).any(axis=1)] *= -1
+    return mantissa*numpy.power(10.0, exponent)
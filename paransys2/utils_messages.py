@@ -2,6 +2,19 @@
 Useful function for messages
 """
 
+class SolverError(RuntimeError):
+    """
+    Error of a solution that ANSYS couldn't finish.
+
+    Attributes:
+        status (str): 'timeout' if the solution took longer than `solve_timeout`, 'crashed' if ANSYS closed while solving.
+    """
+
+    def __init__(self, message, status):
+        super().__init__(message)
+        self.status = status
+
+
 # Custom print and error messages
 def cprint(self, message):
     """
@@ -16,20 +29,24 @@ def cprint(self, message):
         with open(self._log, 'a+') as log:
             log.write(rf'{message}\n')
 
-def cerror(self, error):
+def cerror(self, error, status=None):
     """
     (For internal use)
     Custom error with raise RuntimeError with log to file
 
     Args:
         error (str): custom error message to raise
+        status (str, optional): if it's set a SolverError with this status is raised. Defaults to None.
 
     Raises:
         RuntimeError: custom message
+        SolverError: custom message, when `status` is set
     """
     if self._log:
         with open(self._log, 'a+') as log:
             log.write(r'\n\nPARANSYS Runtime error: \n')
             log.write(rf'{error}\n')
             log.write(r'\n')
+    if status is not None:
+        raise SolverError(error, status)
     raise RuntimeError(error)
\ No newline at end of file
@@ -0,0 +1,275 @@
+"""
+Useful functions to wait for files written by ANSYS
+
+On Linux the folder is watched with inotify, so PARANSYS wakes up as soon as ANSYS closes the file.
+Anywhere else (or if inotify fails) it polls the file with an adaptive interval.
+"""
+
+import os
+import sys
+import time
+import select
+import asyncio
+import struct
+import ctypes
+import ctypes.util
+import paransys2.utils as utils
+
+# inotify constants (from sys/inotify.h)
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_TO    = 0x00000080
+_IN_CREATE      = 0x00000100
+_IN_NONBLOCK    = 0x00000800
+_IN_CLOEXEC     = 0x00080000
+_IN_EVENT       = struct.Struct('iIII')
+
+_libc = None
+
+
+class Watcher:
+    """
+    Watch a file (or many files of the same folder) through inotify events in their folder.
+    """
+
+    def __init__(self, fname):
+        """
+        Start watching a file.
+
+        Args:
+            fname (str or list of strings): file location, or locations of files in the same folder. They don't need to exist.
+
+        Raises:
+            OSError: if inotify isn't available.
+        """
+        global _libc
+        if not sys.platform.startswith('linux'):
+            raise OSError('inotify is only available on Linux.')
+        if _libc is None:
+            _libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+
+        fnames = [fname] if isinstance(fname, str) else list(fname)
+        folder = os.path.dirname(fnames[0])
+        self._names = {os.fsencode(os.path.basename(fname)) for fname in fnames}
+        self._fd = _libc.inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed.')
+        wd = _libc.inotify_add_watch(self._fd, os.fsencode(folder or '.'), _IN_CLOSE_WRITE | _IN_MOVED_TO | _IN_CREATE)
+        if wd < 0:
+            os.close(self._fd)
+            raise OSError(ctypes.get_errno(), f'inotify couldn\'t watch \"{folder}\".')
+
+    def wait(self, timeout):
+        """
+        Wait until a watched file is written or the timeout expires.
+
+        Args:
+            timeout (float): maximum waiting time in seconds.
+
+        Returns:
+            bool: True if a watched file was written.
+        """
+        ready, _, _ = select.select([self._fd], [], [], timeout)
+        if not ready:
+            return False
+        changed = False
+        try:
+            data = os.read(self._fd, 65536)
+        except BlockingIOError:
+            return False
+        pos = 0
+        while pos < len(data):
+            _, _, _, namelen = _IN_EVENT.unpack_from(data, pos)
+            pos += _IN_EVENT.size
+            name = data[pos:pos+namelen].rstrip(b'\x00')
+            pos += namelen
+            if name in self._names:
+                changed = True
+        return changed
+
+    def close(self):
+        """
+        Stop watching.
+        """
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+
+def watcher(self, fname):
+    """
+    Create a Watcher for a file if inotify is available and enabled in `self._settings['use_inotify']`.
+
+    Args:
+        fname (str or list of strings): file location, or locations of files in the same folder.
+
+    Returns:
+        Watcher: or None if PARANSYS should poll the file.
+    """
+    if not self._settings['use_inotify']:
+        return None
+    try:
+        return Watcher(fname)
+    except (OSError, AttributeError):
+        return None
+
+
+def wait_for(self, condition, fname='control.paransys', timeout=None):
+    """
+    Wait until `condition()` is True, testing it when a file at `run_location` changes.
+
+    With inotify the condition is tested at each file change, or every `poll_max` seconds just to be sure.
+    Without it the condition is tested starting every `poll_min` seconds, growing by `poll_growth` up to `poll_max`.
+
+    Args:
+        condition (function): function without arguments that returns True when the wait is over.
+        fname (str or list of strings, optional): watched file name, or names. Defaults to 'control.paransys'.
+        timeout (float, optional): maximum waiting time in seconds, None waits forever. Defaults to None.
+
+    Returns:
+        bool: True if the condition was met, False if the timeout expired.
+    """
+    if isinstance(fname, str):
+        fname = os.path.join(self._ANSYS['run_location'], fname)
+    else:
+        fname = [os.path.join(self._ANSYS['run_location'], name) for name in fname]
+    delay = self._settings['poll_min']
+    tend = None if timeout is None else time.monotonic()+timeout
+    watch = watcher(self, fname)
+    try:
+        while not condition():
+            step = self._settings['poll_max'] if watch is not None else delay
+            if tend is not None:
+                remaining = tend-time.monotonic()
+                if remaining <= 0:
+                    return False
+                step = min(step, remaining)
+            if watch is not None:
+                watch.wait(step)
+            else:
+                time.sleep(step)
+                delay = min(delay*self._settings['poll_growth'], self._settings['poll_max'])
+    finally:
+        if watch is not None:
+            watch.close()
+    return True
+
+
+async def wait_for_async(self, condition, fname='control.paransys', timeout=None):
+    """
+    Coroutine version of `wait_for()`, it waits without blocking the event loop.
+
+    With inotify the event loop watches the inotify file descriptor, so no thread or sleep is needed.
+
+    Args:
+        condition (function): function without arguments that returns True when the wait is over.
+        fname (str or list of strings, optional): watched file name, or names. Defaults to 'control.paransys'.
+        timeout (float, optional): maximum waiting time in seconds, None waits forever. Defaults to None.
+
+    Returns:
+        bool: True if the condition was met, False if the timeout expired.
+    """
+    if isinstance(fname, str):
+        fname = os.path.join(self._ANSYS['run_location'], fname)
+    else:
+        fname = [os.path.join(self._ANSYS['run_location'], name) for name in fname]
+    delay = self._settings['poll_min']
+    tend = None if timeout is None else time.monotonic()+timeout
+    watch = watcher(self, fname)
+    loop = asyncio.get_running_loop()
+    changed = asyncio.Event()
+    if watch is not None:
+        try:
+            loop.add_reader(watch._fd, changed.set)
+        except (NotImplementedError, AttributeError):
+            watch.close()
+            watch = None
+    try:
+        while not condition():
+            step = self._settings['poll_max'] if watch is not None else delay
+            if tend is not None:
+                remaining = tend-time.monotonic()
+                if remaining <= 0:
+                    return False
+                step = min(step, remaining)
+            if watch is not None:
+                try:
+                    await asyncio.wait_for(changed.wait(), step)
+                except asyncio.TimeoutError:
+                    pass
+                changed.clear()
+                # Read the pending events, so the descriptor isn't ready anymore
+                watch.wait(0)
+            else:
+                await asyncio.sleep(step)
+                delay = min(delay*self._settings['poll_growth'], self._settings['poll_max'])
+    finally:
+        if watch is not None:
+            loop.remove_reader(watch._fd)
+            watch.close()
+    return True
+
+
+def wait_done(self, timeout=None):
+    """
+    Wait until ANSYS finishes the current solution (PARANSYS_DONE=1 at control file).
+
+    It also stops waiting if the ANSYS process closes or after `timeout` seconds.
+
+    Args:
+        timeout (float, optional): maximum solution time in seconds, None waits forever. Defaults to None.
+
+    Returns:
+        dict: the last control values read.
+
+    Raises:
+        SolverError: with status 'timeout' or 'crashed'.
+    """
+    control = {}
+    def done():
+        control.update(utils.files.read_control(self))
+        return control['PARANSYS_DONE'] != 0 or not utils.ansys.is_running(self)
+    finished = wait_for(self, done, timeout=timeout)
+    return check_done(self, control, finished, timeout)
+
+
+async def wait_done_async(self, timeout=None):
+    """
+    Coroutine version of `wait_done()`.
+
+    Args:
+        timeout (float, optional): maximum solution time in seconds, None waits forever. Defaults to None.
+
+    Returns:
+        dict: the last control values read.
+
+    Raises:
+        SolverError: with status 'timeout' or 'crashed'.
+    """
+    control = {}
+    def done():
+        control.update(utils.files.read_control(self))
+        return control['PARANSYS_DONE'] != 0 or not utils.ansys.is_running(self)
+    finished = await wait_for_async(self, done, timeout=timeout)
+    return check_done(self, control, finished, timeout)
+
+
+def check_done(self, control, finished, timeout):
+    """
+    (For internal use)
+    Verify why the wait for a solution is over.
+
+    Returns:
+        dict: the last control values read, if the solution is done.
+
+    Raises:
+        SolverError: with status 'timeout' or 'crashed'.
+    """
+    if not finished:
+        utils.messages.cerror(self, f'   ANSYS didn\'t finish the solution in {timeout} s.', status='timeout')
+    if control['PARANSYS_DONE'] == 0:
+        # It could finish just before closing
+        control.update(utils.files.read_control(self))
+        if control['PARANSYS_DONE'] == 0:
+            returncode = None if self._process is None else self._process.poll()
+            utils.messages.cerror(self, f'   ANSYS closed while solving (exit code {returncode}), take a look at paransys.ansys.log.', status='crashed')
+    return control